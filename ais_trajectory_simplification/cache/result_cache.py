@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from ais_trajectory_simplification import __version__
+from ais_trajectory_simplification.stats.processing_stats import ProcessingStats
+
+
+class ResultCache:
+    # results of cleaners and simplificators on disk, keyed by a hash of the input positions, the class,
+    # the method, their parameters and the library version:
+    #   <path>/<first 2 characters of key>/<key>.parquet (DataFrames) or .npy (keep masks)
+    # modification times of entries are updated on every hit, so the oldest ones were used least recently
+    EXTENSIONS = ['.parquet', '.npy']
+
+    def __init__(self, path: str, max_size_bytes: int = None, max_age_s: float = None):
+        self.path = path
+        self.max_size_bytes = max_size_bytes
+        self.max_age_s = max_age_s
+        # hits_count, misses_count, saved_bytes_count, evicted_entries_count
+        self.stats = ProcessingStats('ResultCache')
+
+    def key(self, pdf: pd.DataFrame, processor_class, method_name: str, init_kwargs: dict = None, method_kwargs: dict = None) -> str:
+        digest = hashlib.sha256()
+        parameters = {
+            'version': __version__,
+            'class': f"{processor_class.__module__}.{processor_class.__qualname__}",
+            'method': method_name,
+            'init_kwargs': init_kwargs or {},
+            'method_kwargs': method_kwargs or {},
+            'columns': [(str(column), str(dtype)) for column, dtype in pdf.dtypes.items()],
+            'index': [str(name) for name in pdf.index.names],
+        }
+        digest.update(json.dumps(parameters, sort_keys=True, default=repr).encode())
+        digest.update(pd.util.hash_pandas_object(pdf, index=True).to_numpy().tobytes())
+
+        return digest.hexdigest()
+
+    def _entry_path(self, key: str, extension: str) -> str:
+        return os.path.join(self.path, key[:2], f"{key}{extension}")
+
+    def load(self, key: str):
+        # None for missing entries
+        for extension in self.EXTENSIONS:
+            entry_path = self._entry_path(key, extension)
+            try:
+                if extension == '.parquet':
+                    result = pq.read_table(entry_path).to_pandas()
+                else:
+                    result = np.load(entry_path, allow_pickle=False)
+                os.utime(entry_path)
+                return result
+            except FileNotFoundError:
+                continue
+
+        return None
+
+    def save(self, key: str, result) -> int:
+        # written to a temporary file first, so that concurrent workers never read a partial entry
+        if isinstance(result, pd.DataFrame):
+            extension = '.parquet'
+        elif isinstance(result, np.ndarray):
+            extension = '.npy'
+        else:
+            raise TypeError(f"Only DataFrames and arrays can be cached, not {type(result).__name__}")
+        entry_path = self._entry_path(key, extension)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        temporary_path = f"{entry_path}.{uuid.uuid4().hex}.tmp"
+        if extension == '.parquet':
+            # format version 2.6 keeps nanosecond timestamps
+            pq.write_table(pa.Table.from_pandas(result, preserve_index=True), temporary_path, version='2.6')
+        else:
+            with open(temporary_path, 'wb') as file:
+                np.save(file, result, allow_pickle=False)
+        os.replace(temporary_path, entry_path)
+
+        return os.path.getsize(entry_path)
+
+    def get_or_compute(self, compute, key: str, stats: ProcessingStats = None):
+        # compute() is called only on a miss; workers of FleetRunner count in their own stats
+        stats = stats if stats is not None else self.stats
+        result = self.load(key)
+        if result is not None:
+            stats.count('hits_count')
+            return result
+
+        stats.count('misses_count')
+        result = compute()
+        stats.count('saved_bytes_count', self.save(key, result))
+
+        return result
+
+    def run(self, processor_class, method_name: str, pdf: pd.DataFrame, init_kwargs: dict = None, **method_kwargs):
+        # e.g. run(DPSimplificator, 'simplify_trajectory', ship_pdf, epsilon_m=100)
+        init_kwargs = init_kwargs or {}
+        key = self.key(pdf, processor_class, method_name, init_kwargs, method_kwargs)
+        result = self.get_or_compute(lambda: getattr(processor_class(pdf, **init_kwargs), method_name)(**method_kwargs), key)
+        self.evict()
+
+        return result
+
+    def _entries(self) -> list:
+        # (modification time, size, path) of all entries, the least recently used first
+        entries = []
+        if not os.path.isdir(self.path):
+            return entries
+        for directory in os.scandir(self.path):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                if entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    entry_stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry_stat.st_mtime, entry_stat.st_size, entry.path))
+
+        return sorted(entries)
+
+    def evict(self) -> int:
+        # removes entries not used for max_age_s and then the least recently used ones above max_size_bytes
+        if self.max_age_s is None and self.max_size_bytes is None:
+            return 0
+        entries = self._entries()
+        size_bytes = sum(size for modification_time, size, entry_path in entries)
+        min_modification_time = time.time() - self.max_age_s if self.max_age_s is not None else -np.inf
+
+        evicted_entries_count = 0
+        for modification_time, size, entry_path in entries:
+            is_too_old = modification_time < min_modification_time
+            is_too_large = self.max_size_bytes is not None and size_bytes > self.max_size_bytes
+            if not (is_too_old or is_too_large):
+                break
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
+            size_bytes = size_bytes - size
+            evicted_entries_count = evicted_entries_count + 1
+        self.stats.count('evicted_entries_count', evicted_entries_count)
+
+        return evicted_entries_count
+
+    def size_bytes(self) -> int:
+        return sum(size for modification_time, size, entry_path in self._entries())
+
+    def clear(self):
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
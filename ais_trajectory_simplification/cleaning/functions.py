@@ -1,11 +1,11 @@
 import pandas as pd
-import pyproj
 import numpy as np
 import folium
+from ais_trajectory_simplification.geodesy.functions import GEODESIC, inverse
+from ais_trajectory_simplification.trajectory.trajectory import Trajectory
 
-def get_azimuths_and_distance(start_longitude:float, start_latitude:float, end_longitude:float, end_latitude:float):
-    geodesic = pyproj.Geod(ellps='WGS84')
-    result = geodesic.inv(start_longitude, start_latitude, end_longitude, end_latitude)
+def get_azimuths_and_distance(start_longitude:float, start_latitude:float, end_longitude:float, end_latitude:float, method:str = GEODESIC):
+    result = inverse(start_longitude, start_latitude, end_longitude, end_latitude, method)
     
     return result
 
@@ -20,34 +20,95 @@ def sort_and_reset_index(pdf: pd.DataFrame, sort_col:str = 'position_timestamp')
     
     return result_pdf
 
-def calculate_metrics(pdf: pd.DataFrame, default_speed_reference_kn:int = 20) -> pd.DataFrame:
+def calculate_metrics(pdf: pd.DataFrame, default_speed_reference_kn:int = 20, geodesy_method:str = GEODESIC) -> pd.DataFrame:
     pdf = sort_and_reset_index(pdf)
-    # recalculation of bearing_since_prev_pos_deg
-    pdf['prev_pos_latitude'] = pdf['latitude'].shift(1)
-    pdf['prev_pos_longitude'] = pdf['longitude'].shift(1)
-    pdf['bearing_since_prev_pos_deg'], back_azimuth, pdf['distance_since_prev_pos_m'] = get_azimuths_and_distance(
-        pdf['prev_pos_longitude'], pdf['prev_pos_latitude'], pdf['longitude'], pdf['latitude']
-    )
-    # convert bearing_since_prev_pos_deg from -180 - +180 to 0 - 360
-    pdf['bearing_since_prev_pos_deg'][pdf['bearing_since_prev_pos_deg'] < 0] += 360
-    # caclulate speed and acceleration
-    pdf['prev_pos_position_timestamp'] = pdf['position_timestamp'].shift(1)
-    pdf['time_since_prev_pos_s'] = (
-        (pdf['position_timestamp'] - pdf['prev_pos_position_timestamp']) / np.timedelta64(1, 's')
-    )
-    pdf['speed_since_prev_pos_kn'] = (pdf['distance_since_prev_pos_m'] / pdf['time_since_prev_pos_s']) * (3600 / 1852)
-    pdf['prev_speed_since_prev_pos_kn'] = pdf['speed_since_prev_pos_kn'].shift(1)
-    pdf['acceleration_kn_s'] = (
-        (pdf['speed_since_prev_pos_kn'] - pdf['prev_speed_since_prev_pos_kn']) / 
-        pdf['time_since_prev_pos_s']
-    )
-    # add speed_reference_kn if no such column exists or replace nulls
-    if 'speed_reference_kn' not in pdf:
-        pdf['speed_reference_kn'] = default_speed_reference_kn
+    trajectory = Trajectory.from_pdf(pdf)
+    trajectory.calculate_metrics(default_speed_reference_kn, geodesy_method)
+
+    return trajectory.to_pdf()
+
+def trajectory_from_pdf(pdf: pd.DataFrame, sort_col:str = 'position_timestamp') -> Trajectory:
+    # columns of pdf are not copied, only sort_col is converted by pd.to_datetime
+    trajectory = Trajectory.from_pdf(pdf, sort_col)
+    if trajectory.index_name == None and 'index' in trajectory.columns:
+        # like reset_index and set_index('index'), the index column becomes the index and the index a level_0 column
+        index = trajectory.columns.pop('index')
+        trajectory.dtypes.pop('index')
+        trajectory.columns = {'level_0': trajectory.index, **trajectory.columns}
+        trajectory.dtypes = {'level_0': pdf.index.dtype, **trajectory.dtypes}
+        trajectory.index = index
+    if pdf[sort_col].dtype.kind != 'M':
+        timestamps = pd.to_datetime(pdf[sort_col])
+        trajectory.set_column(sort_col, Trajectory.series_to_numpy(timestamps), timestamps.dtype)
+    trajectory.index_name = 'index' if trajectory.index_name == None else trajectory.index_name
+
+    return trajectory
+
+def sort_and_reset_trajectory(pdf: pd.DataFrame, sort_col:str = 'position_timestamp') -> Trajectory:
+    # the same rows in the same order as of sort_and_reset_index, but every column is copied only once
+    trajectory = trajectory_from_pdf(pdf, sort_col)
+    # the first of repeated timestamps is kept, NaT is kept once and sorted last like by sort_values
+    timestamps_ns = trajectory.timestamps_ns
+    sort_keys = np.where(timestamps_ns == Trajectory.NAT, np.iinfo(np.int64).max, timestamps_ns)
+    sort_keys, positions = np.unique(sort_keys, return_index=True)
+    trajectory = trajectory.take(positions)
+    trajectory.source_positions = None
+
+    return trajectory
+
+def prepare_trajectory(pdf, geodesy_method:str = GEODESIC, with_metrics:bool = True, metric_columns:list = None,
+                       compact:bool = False) -> Trajectory:
+    # a Trajectory is expected to be already sorted with current metrics and is only shallow copied;
+    # metric_columns and compact are the low-memory options of Trajectory.calculate_metrics and Trajectory.compact
+    if isinstance(pdf, Trajectory):
+        trajectory = pdf.copy(deep=False)
+        return trajectory.compact() if compact and trajectory.time_epochs_ns is None else trajectory
+    trajectory = sort_and_reset_trajectory(pdf)
+    if compact:
+        trajectory.compact()
+    if with_metrics:
+        trajectory.calculate_metrics(geodesy_method=geodesy_method, metric_columns=metric_columns)
+
+    return trajectory
+
+def group_offsets(group_values: np.ndarray) -> np.ndarray:
+    boundaries = np.flatnonzero(group_values[1:] != group_values[:-1]) + 1
+    return np.concatenate([[0], boundaries, [len(group_values)]]).astype(np.int64)
+
+def prepare_fleet_trajectory(pdf, offsets: np.ndarray = None, group_column: str = 'mmsi', geodesy_method: str = GEODESIC,
+                             with_metrics: bool = True, sort_col: str = 'position_timestamp', metric_columns: list = None,
+                             compact: bool = False) -> tuple:
+    # one Trajectory of all vessels of a fleet sorted by vessel and time, vessel i being rows offsets[i] ... offsets[i + 1] - 1,
+    # by default where group_column changes; positions with the timestamp of the previous position of the vessel are dropped
+    # like in sort_and_reset_index, returns (trajectory, input row positions of its rows)
+    if isinstance(pdf, Trajectory):
+        trajectory = pdf.copy(deep=False)
     else:
-        pdf['speed_reference_kn'] = pdf['speed_reference_kn'].fillna(default_speed_reference_kn)
+        trajectory = trajectory_from_pdf(pdf, sort_col)
+    points_count = len(trajectory)
+    if offsets is None:
+        offsets = group_offsets(trajectory.columns[group_column])
+        if len(np.unique(trajectory.columns[group_column][offsets[:-1][:points_count]])) < len(offsets) - 1:
+            raise ValueError(f"Positions have to be sorted by {group_column}")
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if len(offsets) < 2 or offsets[0] != 0 or offsets[-1] != points_count or np.any(np.diff(offsets) < 0):
+        raise ValueError(f"Offsets have to grow from 0 to {points_count}")
+    trajectory.offsets = offsets
+
+    is_first = trajectory.first_rows()
+    time_differences_ns = np.diff(trajectory.timestamps_ns, prepend=trajectory.NAT)
+    if np.any((time_differences_ns < 0) & ~is_first):
+        raise ValueError(f"Positions of every vessel have to be sorted by {sort_col}")
+    input_positions = np.flatnonzero((time_differences_ns != 0) | is_first)
+    if len(input_positions) < points_count:
+        trajectory = trajectory.take(input_positions)
+        trajectory.source_positions = None
+    if compact:
+        trajectory.compact()
+    if with_metrics:
+        trajectory.calculate_metrics(geodesy_method=geodesy_method, metric_columns=metric_columns)
 
-    return pdf
+    return trajectory, input_positions
     m = folium.Map(location=[positions_pdf.iloc[0]['latitude'], positions_pdf.iloc[0]['longitude']], zoom_start=7)
     color_green = "#3f9c35"
     color_red = "#eb2a34"
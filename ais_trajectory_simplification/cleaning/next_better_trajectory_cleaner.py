@@ -1,95 +1,239 @@
 import pandas as pd
 import numpy as np
-from ais_trajectory_simplification.cleaning.functions import get_azimuths_and_distance, calculate_metrics, sort_and_reset_index
+from ais_trajectory_simplification.cleaning.functions import get_azimuths_and_distance, prepare_trajectory
+from ais_trajectory_simplification.fleet.functions import process_many
+from ais_trajectory_simplification.geodesy.functions import GEODESIC
+from ais_trajectory_simplification.stats.processing_stats import ProcessingStats, DISABLED_STATS
+from ais_trajectory_simplification.trajectory.trajectory import Trajectory
+from ais_trajectory_simplification.trajectory.trajectory_checkpoint import TrajectoryCheckpoint
 
 class NextBetterTrajectoryCleaner:
-    def __init__(self, pdf: pd.DataFrame, speed_limit_multiplier: int = 2, acceleration_limit_kn_s = 0.5):
+    RECALCULATED_COLUMNS = [
+        'bearing_since_prev_pos_deg',
+        'distance_since_prev_pos_m',
+        'time_since_prev_pos_s',
+        'speed_since_prev_pos_kn',
+        'acceleration_kn_s',
+        'no_of_cleaned_positions_since_prev_pos',
+    ]
+    # metrics read by the cleaner, the only ones calculated with lean_metrics
+    INPUT_METRIC_COLUMNS = Trajectory.LEAN_METRIC_COLUMNS
+
+    def __init__(self, pdf: pd.DataFrame, speed_limit_multiplier: int = 2, acceleration_limit_kn_s = 0.5, geodesy_method: str = GEODESIC, stats: ProcessingStats = None,
+                 checkpoint: TrajectoryCheckpoint = None, lean_metrics: bool = False, compact: bool = False):
         self.speed_service_multiplier = speed_limit_multiplier  
         self.acceleration_limit_kn_s = acceleration_limit_kn_s
+        self.lookup_limit = 4
+        self.speed_change_limit = 2
+        self.geodesy_method = geodesy_method
+        self.stats = stats if stats is not None else DISABLED_STATS
+        self.geodesic_calls_count = 0
+        # made by clean_trajectory_part of the previous part of the trajectory
+        self.checkpoint = checkpoint
+        if checkpoint is not None:
+            pdf = checkpoint.prepend_to(pdf)
+        self.input_columns = list(pdf.columns) if isinstance(pdf, pd.DataFrame) else None
         
-        self.pdf = sort_and_reset_index(pdf)
-        self.pdf = calculate_metrics(self.pdf)
-        self.pdf['no_of_cleaned_positions_since_prev_pos'] = 0
-
-        self.index_column_name = self.pdf.index.name
-        self.pdf = self.pdf.reset_index()
-        self.index_loc = self.pdf.columns.get_loc(self.index_column_name)
-        self.latitude_loc = self.pdf.columns.get_loc('latitude')
-        self.longitude_loc = self.pdf.columns.get_loc('longitude')
-        self.position_timestamp_loc = self.pdf.columns.get_loc('position_timestamp')
-        self.speed_reference_kn_loc = self.pdf.columns.get_loc('speed_reference_kn')
-        self.time_since_prev_pos_s_loc = self.pdf.columns.get_loc('time_since_prev_pos_s')
-        self.distance_since_prev_pos_m_loc = self.pdf.columns.get_loc('distance_since_prev_pos_m')
-        self.speed_since_prev_pos_kn_loc = self.pdf.columns.get_loc('speed_since_prev_pos_kn')
-        self.acceleration_kn_loc = self.pdf.columns.get_loc('acceleration_kn_s')
-        self.bearing_since_prev_pos_deg_loc = self.pdf.columns.get_loc('bearing_since_prev_pos_deg')
-        self.no_of_cleaned_positions_since_prev_pos_loc = self.pdf.columns.get_loc('no_of_cleaned_positions_since_prev_pos')
-        
+        with self.stats.phase('prepare'):
+            self.trajectory = prepare_trajectory(
+                pdf, self.geodesy_method, metric_columns=self.INPUT_METRIC_COLUMNS if lean_metrics else None, compact=compact)
+            self.trajectory.set_column('no_of_cleaned_positions_since_prev_pos', np.zeros(len(self.trajectory), dtype=np.int64))
+        self.stats.count('input_points_count', len(self.trajectory))
+
+        self.indexes = self.trajectory.index
+        self.longitudes = self.trajectory.longitudes
+        self.latitudes = self.trajectory.latitudes
+        self.speed_references_kn = self.trajectory.float_column('speed_reference_kn')
+        self.bearings = self.trajectory.float_column('bearing_since_prev_pos_deg')
+        self.distances_m = self.trajectory.float_column('distance_since_prev_pos_m')
+        self.times_s = self.trajectory.float_column('time_since_prev_pos_s')
+        self.speeds_kn = self.trajectory.float_column('speed_since_prev_pos_kn')
+        self.accelerations_kn_s = self.trajectory.float_column('acceleration_kn_s')
+        self.no_of_cleaned_positions = self.trajectory.columns['no_of_cleaned_positions_since_prev_pos']
+
+    def _checkpoint_parameters(self) -> dict:
+        return {
+            'speed_limit_multiplier': self.speed_service_multiplier,
+            'acceleration_limit_kn_s': self.acceleration_limit_kn_s,
+            'geodesy_method': self.geodesy_method,
+        }
+
     def _speed_over_max(self, speed_since_prev_pos_kn, speed_reference_kn):
         return speed_since_prev_pos_kn > self.speed_service_multiplier * speed_reference_kn
     
     def _acceleration_over_limit(self, acceleration_knots_s):
         return abs(acceleration_knots_s) > self.acceleration_limit_kn_s
         
-    def _is_outlier(self, position):
-        is_speed_over_max = self._speed_over_max(position[self.speed_since_prev_pos_kn_loc], position[self.speed_reference_kn_loc])
-        is__acceleration_over_limit = self._acceleration_over_limit(position[self.acceleration_kn_loc])
-        
-        return any([is_speed_over_max, is__acceleration_over_limit])
-    
-    def _next_is_better(self, pdf_arr, i) -> int:
-        lookup_limit = 4
-        speed_change_limit = 2
-        previous_position = pdf_arr[i-1] 
-        current_position = pdf_arr[i]
-        current_speed_difference = abs(current_position[self.speed_since_prev_pos_kn_loc] - previous_position[self.speed_since_prev_pos_kn_loc])
-        if current_speed_difference > speed_change_limit:
-            for j in range(1, min(lookup_limit, len(pdf_arr) - i)):
-                candidate_position = self._calculate_from_new_previous_position(pdf_arr[i+j].copy(), previous_position)
-                candidate_speed_difference = abs(candidate_position[self.speed_since_prev_pos_kn_loc] - previous_position[self.speed_since_prev_pos_kn_loc])
-                
-                if (candidate_speed_difference - current_speed_difference) < -2:
-                    return True
-            
-        return False
-            
-    def _calculate_from_new_previous_position(self, position, prev_position):
-        position[self.bearing_since_prev_pos_deg_loc], back_azimuth, position[self.distance_since_prev_pos_m_loc] = get_azimuths_and_distance(
-            prev_position[self.longitude_loc], prev_position[self.latitude_loc], position[self.longitude_loc], position[self.latitude_loc]
+    def _is_outlier(self, speed_since_prev_pos_kn, speed_reference_kn, acceleration_kn_s):
+        is_speed_over_max = self._speed_over_max(speed_since_prev_pos_kn, speed_reference_kn)
+        is__acceleration_over_limit = self._acceleration_over_limit(acceleration_kn_s)
+
+        return is_speed_over_max | is__acceleration_over_limit
+
+    def _current_metrics(self, position, recalculated_positions):
+        if position in recalculated_positions:
+            return recalculated_positions[position]
+
+        return (
+            self.bearings[position],
+            self.distances_m[position],
+            self.times_s[position],
+            self.speeds_kn[position],
+            self.accelerations_kn_s[position],
+            self.no_of_cleaned_positions[position],
         )
-        if position[self.bearing_since_prev_pos_deg_loc] < 0:
-            position[self.bearing_since_prev_pos_deg_loc] + 360
-
-        position[self.time_since_prev_pos_s_loc] = (
-            position[self.position_timestamp_loc] - prev_position[self.position_timestamp_loc]) / np.timedelta64(1, 's')
-        position[self.speed_since_prev_pos_kn_loc] = (
-            position[self.distance_since_prev_pos_m_loc] / position[self.time_since_prev_pos_s_loc]) * (3600 / 1852)
-        position[self.acceleration_kn_loc] = (
-            (position[self.speed_since_prev_pos_kn_loc] - prev_position[self.speed_since_prev_pos_kn_loc]) / position[self.time_since_prev_pos_s_loc]) 
-        
-        position[self.no_of_cleaned_positions_since_prev_pos_loc] = position[self.index_loc] - prev_position[self.index_loc] - 1
 
-        return position
-        
-    def clean_trajectory(self):
-        # start with index 1 to allow step back if index 1 is outlier
-        pdf_arr = self.pdf.to_numpy()
-        i = 1
-        iterator_end = len(pdf_arr)
-        while i < iterator_end:
-            is_outlier = self._is_outlier(pdf_arr[i])
-            is_better_to_take_next = self._next_is_better(pdf_arr, i)
-            if (is_outlier or is_better_to_take_next):
-                pdf_arr = np.delete(pdf_arr, i, axis=0)
-                iterator_end = len(pdf_arr)
-                if i < iterator_end:
-                    pdf_arr[i] = self._calculate_from_new_previous_position(pdf_arr[i], pdf_arr[i-1])
-                    
-            else:
-                i = i + 1
-
-        clean_pdf_arr = pdf_arr
-        result_pdf = pd.DataFrame(clean_pdf_arr, columns=self.pdf.columns).astype(self.pdf.dtypes.to_dict())
-        result_pdf = result_pdf.set_index(self.index_column_name)
-
-        return result_pdf
\ No newline at end of file
+    def _next_is_better(self, prev_position, position, speed_kn, prev_speed_kn, end: int = None) -> bool:
+        # end is the end of the vessel of the position
+        end = len(self.longitudes) if end is None else end
+        current_speed_difference = abs(speed_kn - prev_speed_kn)
+        if current_speed_difference > self.speed_change_limit:
+            # all candidates are compared with the same previous position in one call
+            candidate_positions = np.arange(position + 1, position + min(self.lookup_limit, end - position))
+            if len(candidate_positions) == 0:
+                return False
+            bearing, distance_m, time_s, candidate_speeds_kn, acceleration_kn_s, no_of_cleaned_positions = (
+                self._calculate_from_new_previous_position(candidate_positions, prev_position, prev_speed_kn))
+            candidate_speed_differences = np.abs(candidate_speeds_kn - prev_speed_kn)
+
+            return bool(np.any((candidate_speed_differences - current_speed_difference) < -2))
+
+        return False
+
+    def _calculate_from_new_previous_position(self, position, prev_position, prev_speed_kn):
+        # position can be a single row position or an array of row positions
+        self.geodesic_calls_count = self.geodesic_calls_count + 1
+        bearing, back_azimuth, distance_m = get_azimuths_and_distance(
+            self.longitudes[prev_position], self.latitudes[prev_position], self.longitudes[position], self.latitudes[position],
+            self.geodesy_method)
+
+        time_s = self.trajectory.seconds_between(prev_position, position)
+        speed_kn = (distance_m / time_s) * (3600 / 1852)
+        acceleration_kn_s = (speed_kn - prev_speed_kn) / time_s
+        no_of_cleaned_positions = self.indexes[position] - self.indexes[prev_position] - 1
+
+        return bearing, distance_m, time_s, speed_kn, acceleration_kn_s, no_of_cleaned_positions
+
+    def _select_positions(self, prev_position: int = 0, position: int = 1, recalculated_positions: dict = None, is_last: bool = True):
+        # with is_last=False positions are decided only while all lookup_limit positions after them exist,
+        # returns also the last kept position and the first position which was not decided;
+        # vessels of a fleet trajectory are cleaned one after another, prev_position and position are of the first one
+        keep_mask = np.ones(len(self.longitudes), dtype=bool)
+        recalculated_positions = dict(recalculated_positions or {})
+
+        # vectorized pre-screen, positions which are neither an outlier nor have a speed jump
+        # are kept as long as nothing was removed directly before them
+        is_outlier = self._is_outlier(self.speeds_kn, self.speed_references_kn, self.accelerations_kn_s)
+        is_speed_jump = np.zeros(len(self.longitudes), dtype=bool)
+        is_speed_jump[1:] = np.abs(np.diff(self.speeds_kn)) > self.speed_change_limit
+        suspicious_positions = np.flatnonzero(is_outlier | is_speed_jump)
+
+        offsets = self.trajectory.vessel_offsets()
+        for vessel_start, iterator_end in zip(offsets[:-1].tolist(), offsets[1:].tolist()):
+            if vessel_start > 0:
+                prev_position, position = vessel_start, vessel_start + 1
+            decided_end = iterator_end if is_last else iterator_end - self.lookup_limit + 1
+
+            # start with position 1 to allow step back if position 1 is outlier
+            while position < decided_end:
+                if prev_position == position - 1 and prev_position not in recalculated_positions:
+                    next_suspicious = np.searchsorted(suspicious_positions, position)
+                    next_suspicious_position = (
+                        suspicious_positions[next_suspicious] if next_suspicious < len(suspicious_positions) else iterator_end)
+                    if next_suspicious_position > position:
+                        position = min(next_suspicious_position, iterator_end)
+                        prev_position = position - 1
+                        continue
+
+                bearing, distance_m, time_s, speed_kn, acceleration_kn_s, no_of_cleaned_positions = self._current_metrics(
+                    position, recalculated_positions)
+                prev_speed_kn = self._current_metrics(prev_position, recalculated_positions)[3]
+                is_position_outlier = self._is_outlier(speed_kn, self.speed_references_kn[position], acceleration_kn_s)
+                is_better_to_take_next = self._next_is_better(prev_position, position, speed_kn, prev_speed_kn, iterator_end)
+                if (is_position_outlier or is_better_to_take_next):
+                    keep_mask[position] = False
+                    position = position + 1
+                    if position < iterator_end:
+                        recalculated_positions[position] = self._calculate_from_new_previous_position(
+                            position, prev_position, prev_speed_kn)
+                else:
+                    prev_position = position
+                    position = position + 1
+
+        return keep_mask, recalculated_positions, prev_position, position
+
+    def clean_trajectory(self, return_mask: bool = False, return_trajectory: bool = False):
+        geodesic_calls_count = self.geodesic_calls_count
+        with self.stats.phase('select'):
+            keep_mask, recalculated_positions, prev_position, position = self._select_positions()
+        self.stats.count('geodesic_calls_count', self.geodesic_calls_count - geodesic_calls_count)
+        self.stats.count('recalculations_count', len(recalculated_positions))
+        self.stats.count_selection(keep_mask)
+        if return_mask:
+            self.stats.emit()
+            return keep_mask
+
+        with self.stats.phase('build_result'):
+            result = self.trajectory.take(keep_mask, recalculated_positions, self.RECALCULATED_COLUMNS)
+            result = result if return_trajectory else result.to_pdf()
+        self.stats.count('array_copies_count', len(result.columns) + 1)
+        self.stats.emit()
+
+        return result
+
+    @classmethod
+    def clean_many(cls, pdf, offsets: np.ndarray = None, group_column: str = 'mmsi', init_kwargs: dict = None, return_mask: bool = False,
+                   return_trajectory: bool = False):
+        # all vessels of a fleet frame sorted by group_column and time at once, see fleet.functions.process_many
+        return process_many(cls, 'clean_trajectory', pdf, offsets, group_column, init_kwargs, return_mask,
+                            return_trajectory=return_trajectory)
+
+    def clean_trajectory_part(self, is_last: bool = False):
+        # cleans a trajectory part by part, e.g. one day at a time, and returns (result, checkpoint);
+        # positions which may still change with the next part are not returned, the cleaner of the next
+        # part gets them from the checkpoint, so concatenated results are the same as of clean_trajectory
+        if self.input_columns is None:
+            raise ValueError("Only DataFrames can be cleaned in parts")
+        if self.checkpoint is None:
+            prev_position, position, recalculated_positions = 0, 1, {}
+            output_start = 0
+        else:
+            self.checkpoint.check(type(self).__name__, self._checkpoint_parameters())
+            prev_position, position = self.checkpoint.state['prev_position'], self.checkpoint.state['position']
+            recalculated_positions = {
+                int(recalculated_position): tuple(values)
+                for recalculated_position, values in self.checkpoint.state['recalculated_positions'].items()
+            }
+            output_start = position
+
+        geodesic_calls_count = self.geodesic_calls_count
+        with self.stats.phase('select'):
+            keep_mask, recalculated_positions, prev_position, position = self._select_positions(
+                prev_position, position, recalculated_positions, is_last)
+        output_mask = keep_mask.copy()
+        output_mask[:output_start] = False
+        if not is_last:
+            output_mask[position:] = False
+        self.stats.count('geodesic_calls_count', self.geodesic_calls_count - geodesic_calls_count)
+        self.stats.count_selection(output_mask)
+
+        with self.stats.phase('build_result'):
+            result = self.trajectory.take(output_mask, recalculated_positions, self.RECALCULATED_COLUMNS).to_pdf()
+            checkpoint = None
+            if not is_last and len(keep_mask) > 0:
+                # the previous position of the last kept position is needed for its metrics
+                checkpoint_start = max(prev_position - 1, 0)
+                checkpoint_mask = np.zeros(len(keep_mask), dtype=bool)
+                checkpoint_mask[checkpoint_start:] = True
+                checkpoint = TrajectoryCheckpoint(type(self).__name__, self._checkpoint_parameters(),
+                    self.trajectory.take(checkpoint_mask).to_pdf()[self.input_columns], {
+                        'prev_position': int(prev_position - checkpoint_start),
+                        'position': int(position - checkpoint_start),
+                        'recalculated_positions': {
+                            int(recalculated_position - checkpoint_start): [value.item() if hasattr(value, 'item') else value for value in recalculated_positions[recalculated_position]]
+                            for recalculated_position in [prev_position, position] if recalculated_position in recalculated_positions
+                        },
+                    })
+        self.stats.emit()
+
+        return result, checkpoint
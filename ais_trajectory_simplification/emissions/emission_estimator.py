@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+from ais_trajectory_simplification.emissions.functions import DEFAULT_VESSEL_PARAMETERS, main_engine_loads, main_engine_sfocs_g_kwh
+
+
+class EmissionEstimator:
+    # fuel and CO2 of every segment (the move from the previous position to a position) of cleaned or
+    # simplified trajectories of a whole fleet at once; the average speed of a segment gives the main
+    # engine load by the propeller law, auxiliary engines run all the time
+    SEGMENT_COLUMNS = [
+        'time_since_prev_pos_s',
+        'distance_since_prev_pos_m',
+        'speed_since_prev_pos_kn',
+    ]
+
+    def __init__(self, vessel_parameters: pd.DataFrame = None, group_column: str = 'mmsi', voyage_column: str = None,
+                 default_speed_reference_kn: int = 20):
+        # vessel_parameters are indexed by group value and may have any of DEFAULT_VESSEL_PARAMETERS columns,
+        # missing vessels and null values get the defaults
+        self.vessel_parameters = vessel_parameters if vessel_parameters is not None else pd.DataFrame()
+        self.group_column = group_column
+        # e.g. a voyage number, voyages are aggregated per group value and voyage
+        self.voyage_column = voyage_column
+        self.default_speed_reference_kn = default_speed_reference_kn
+
+    def _group_values(self, pdf: pd.DataFrame) -> np.ndarray:
+        # groupby(group_column).apply(...) and FleetRunner results may have the group column only in the index
+        if self.group_column in pdf.columns:
+            return pdf[self.group_column].to_numpy()
+        return pdf.index.get_level_values(self.group_column).to_numpy()
+
+    def _vessel_parameter(self, name: str, group_values: np.ndarray) -> np.ndarray:
+        values = np.full(len(group_values), DEFAULT_VESSEL_PARAMETERS[name], dtype=np.float64)
+        if name in self.vessel_parameters.columns:
+            positions = self.vessel_parameters.index.get_indexer(group_values)
+            vessel_values = self.vessel_parameters[name].to_numpy(dtype=np.float64)[positions]
+            is_known = (positions >= 0) & ~np.isnan(vessel_values)
+            values[is_known] = vessel_values[is_known]
+
+        return values
+
+    def _design_speeds_kn(self, pdf: pd.DataFrame, group_values: np.ndarray) -> np.ndarray:
+        design_speeds_kn = self._vessel_parameter('design_speed_kn', group_values)
+        if 'speed_reference_kn' in pdf.columns:
+            speed_references_kn = pdf['speed_reference_kn'].to_numpy(dtype=np.float64)
+        else:
+            speed_references_kn = np.full(len(pdf), np.nan)
+        speed_references_kn = np.where(np.isnan(speed_references_kn), self.default_speed_reference_kn, speed_references_kn)
+
+        return np.where(np.isnan(design_speeds_kn), speed_references_kn, design_speeds_kn)
+
+    def estimate_segments(self, pdf: pd.DataFrame) -> pd.DataFrame:
+        # one row per position with the fuel and CO2 since the previous position, the first
+        # position of a trajectory has none
+        missing_columns = [column for column in self.SEGMENT_COLUMNS if column not in pdf.columns]
+        if missing_columns:
+            raise ValueError(f"Columns {missing_columns} are missing, use trajectories with calculated metrics")
+
+        group_values = self._group_values(pdf)
+        times_s = np.nan_to_num(pdf['time_since_prev_pos_s'].to_numpy(dtype=np.float64))
+        speeds_kn = np.nan_to_num(pdf['speed_since_prev_pos_kn'].to_numpy(dtype=np.float64), posinf=0)
+        times_h = times_s / 3600
+
+        loads = main_engine_loads(speeds_kn, self._design_speeds_kn(pdf, group_values))
+        main_engine_energies_kwh = loads * self._vessel_parameter('main_engine_power_kw', group_values) * times_h
+        auxiliary_engine_energies_kwh = self._vessel_parameter('auxiliary_engine_power_kw', group_values) * times_h
+        fuels_kg = (
+            main_engine_energies_kwh * main_engine_sfocs_g_kwh(loads, self._vessel_parameter('main_engine_sfoc_g_kwh', group_values))
+            + auxiliary_engine_energies_kwh * self._vessel_parameter('auxiliary_engine_sfoc_g_kwh', group_values)
+        ) / 1000
+
+        result_pdf = pd.DataFrame({self.group_column: group_values}, index=pdf.index)
+        if self.voyage_column is not None:
+            result_pdf[self.voyage_column] = pdf[self.voyage_column].to_numpy()
+        result_pdf['time_since_prev_pos_s'] = times_s
+        result_pdf['distance_since_prev_pos_m'] = np.nan_to_num(pdf['distance_since_prev_pos_m'].to_numpy(dtype=np.float64))
+        result_pdf['speed_since_prev_pos_kn'] = speeds_kn
+        if 'no_of_cleaned_positions_since_prev_pos' in pdf.columns:
+            result_pdf['no_of_cleaned_positions_since_prev_pos'] = pdf['no_of_cleaned_positions_since_prev_pos'].fillna(0).to_numpy(dtype=np.int64)
+        result_pdf['main_engine_load'] = loads
+        result_pdf['main_engine_energy_kwh'] = main_engine_energies_kwh
+        result_pdf['auxiliary_engine_energy_kwh'] = auxiliary_engine_energies_kwh
+        result_pdf['fuel_kg'] = fuels_kg
+        result_pdf['co2_kg'] = fuels_kg * self._vessel_parameter('carbon_factor', group_values)
+
+        return result_pdf
+
+    def _voyage_columns(self) -> list:
+        return [self.group_column] if self.voyage_column is None else [self.group_column, self.voyage_column]
+
+    def estimate_voyages(self, pdf: pd.DataFrame) -> pd.DataFrame:
+        # sums per vessel (and voyage)
+        segments_pdf = self.estimate_segments(pdf)
+        segments_pdf['segments_count'] = 1
+        segments_pdf = segments_pdf.drop(columns=['speed_since_prev_pos_kn', 'main_engine_load']).reset_index(drop=True)
+
+        return segments_pdf.groupby(self._voyage_columns(), sort=True).sum()
+
+    def compare(self, original_pdf: pd.DataFrame, simplified_pdf: pd.DataFrame) -> pd.DataFrame:
+        # fuel and CO2 of simplified trajectories against the trajectories they were simplified from
+        original_voyages_pdf = self.estimate_voyages(original_pdf)
+        simplified_voyages_pdf = self.estimate_voyages(simplified_pdf)
+        result_pdf = pd.DataFrame({
+            'original_segments_count': original_voyages_pdf['segments_count'],
+            'simplified_segments_count': simplified_voyages_pdf['segments_count'],
+        })
+        for column in ['distance_since_prev_pos_m', 'fuel_kg', 'co2_kg']:
+            result_pdf[f'original_{column}'] = original_voyages_pdf[column]
+            result_pdf[f'simplified_{column}'] = simplified_voyages_pdf[column]
+        result_pdf['co2_error_kg'] = result_pdf['simplified_co2_kg'] - result_pdf['original_co2_kg']
+        result_pdf['co2_relative_error'] = result_pdf['co2_error_kg'] / result_pdf['original_co2_kg']
+
+        return result_pdf
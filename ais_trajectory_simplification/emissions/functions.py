@@ -0,0 +1,26 @@
+import numpy as np
+
+# IMO Fourth GHG Study defaults for a vessel without known parameters, HFO with a slow speed main engine
+DEFAULT_VESSEL_PARAMETERS = {
+    'main_engine_power_kw': 10000.0,
+    'auxiliary_engine_power_kw': 750.0,
+    'main_engine_sfoc_g_kwh': 175.0,
+    'auxiliary_engine_sfoc_g_kwh': 227.0,
+    # t of CO2 per t of fuel
+    'carbon_factor': 3.114,
+    # nan means speed_reference_kn of the positions
+    'design_speed_kn': np.nan,
+}
+# below this load the main engine is considered off (drifting, at anchor or berth)
+MIN_MAIN_ENGINE_LOAD = 0.02
+
+
+def main_engine_loads(speeds_kn: np.ndarray, design_speeds_kn: np.ndarray) -> np.ndarray:
+    # propeller law, power grows with the cube of speed and is capped at the maximum continuous rating
+    loads = np.clip((speeds_kn / design_speeds_kn) ** 3, 0, 1)
+    return np.where(loads < MIN_MAIN_ENGINE_LOAD, 0, loads)
+
+
+def main_engine_sfocs_g_kwh(loads: np.ndarray, sfoc_g_kwh: np.ndarray) -> np.ndarray:
+    # specific fuel consumption is the lowest around 80% load (IMO Third GHG Study)
+    return sfoc_g_kwh * (0.455 * loads ** 2 - 0.710 * loads + 1.280)
@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+from ais_trajectory_simplification.geodesy.functions import GEODESIC, inverse
+from ais_trajectory_simplification.simplification.functions import perpendicular_points_on_line, sed_points_on_line
+
+
+class SimplificationErrorEvaluator:
+    # errors of simplified trajectories of a whole fleet against the trajectories they were simplified from;
+    # positions are matched by the index preserved by cleaners and simplificators (or by match_column, e.g.
+    # the timestamp for downsampling which renumbers positions) and every original position is compared
+    # with the simplified segment around it, all vessels at once:
+    # - sed_error_m: distance to the position interpolated in time on the segment
+    # - perpendicular_error_m: distance to the segment line
+    # - speed_deviation_kn: speed of the segment minus speed since the previous original position
+    # - distance_deviation_m: distance travelled along the simplified trajectory minus along the original
+    #   one, at the time of the position
+    # positions before the first or after the last simplified position (e.g. removed by cleaning) have no errors
+    def __init__(self, group_column: str = 'mmsi', sort_col: str = 'position_timestamp', match_column: str = None,
+                 geodesy_method: str = GEODESIC):
+        self.group_column = group_column
+        self.sort_col = sort_col
+        self.match_column = match_column
+        self.geodesy_method = geodesy_method
+
+    def _keys(self, pdf: pd.DataFrame) -> pd.DataFrame:
+        # group value and match value of every position, groupby(group_column).apply(...) and FleetRunner
+        # results have the group column in the index
+        if self.group_column in pdf.columns:
+            group_values = pdf[self.group_column].to_numpy()
+            index = pdf.index.droplevel(self.group_column) if self.group_column in pdf.index.names else pdf.index
+        else:
+            group_values = pdf.index.get_level_values(self.group_column).to_numpy()
+            index = pdf.index.droplevel(self.group_column)
+        match_values = pdf[self.match_column].to_numpy() if self.match_column is not None else index.to_numpy()
+
+        return pd.DataFrame({self.group_column: group_values, 'match_value': match_values})
+
+    def _prepare_original(self, original_pdf: pd.DataFrame) -> dict:
+        # positions sorted by vessel and time, repeated timestamps are dropped like in sort_and_reset_index
+        keys_pdf = self._keys(original_pdf)
+        keys_pdf[self.sort_col] = pd.to_datetime(original_pdf[self.sort_col]).to_numpy()
+        keys_pdf['longitude'] = original_pdf['longitude'].to_numpy(dtype=np.float64)
+        keys_pdf['latitude'] = original_pdf['latitude'].to_numpy(dtype=np.float64)
+        keys_pdf = keys_pdf.drop_duplicates(subset=[self.group_column, self.sort_col])
+        keys_pdf = keys_pdf.sort_values([self.group_column, self.sort_col], kind='stable').reset_index(drop=True)
+
+        group_values = keys_pdf[self.group_column].to_numpy()
+        positions = np.arange(len(keys_pdf))
+        is_vessel_start = np.ones(len(keys_pdf), dtype=bool)
+        is_vessel_start[1:] = group_values[1:] != group_values[:-1]
+        vessel_starts = np.maximum.accumulate(np.where(is_vessel_start, positions, 0))
+        longitudes = keys_pdf['longitude'].to_numpy()
+        latitudes = keys_pdf['latitude'].to_numpy()
+        timestamps_ns = keys_pdf[self.sort_col].to_numpy().view(np.int64)
+
+        # moves from the previous original position
+        bearing, back_azimuth, move_distances_m = inverse(
+            longitudes[positions - 1], latitudes[positions - 1], longitudes, latitudes, self.geodesy_method)
+        move_distances_m = np.where(is_vessel_start, 0, np.asarray(move_distances_m, dtype=np.float64))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            move_speeds_kn = move_distances_m / ((timestamps_ns - timestamps_ns[positions - 1]) / 1e9) * (3600 / 1852)
+        move_speeds_kn[is_vessel_start] = np.nan
+        travelled_distances_m = np.cumsum(move_distances_m)
+
+        return {
+            'keys_pdf': keys_pdf,
+            'vessel_starts': vessel_starts,
+            'vessel_ends': np.minimum.accumulate(np.where(np.roll(is_vessel_start, -1), positions, len(positions))[::-1])[::-1],
+            'longitudes': longitudes,
+            'latitudes': latitudes,
+            'timestamps_ns': timestamps_ns,
+            'move_speeds_kn': move_speeds_kn,
+            # along the trajectory from its first position
+            'travelled_distances_m': travelled_distances_m - travelled_distances_m[vessel_starts],
+        }
+
+    def _point_errors(self, original: dict, simplified_pdf: pd.DataFrame) -> pd.DataFrame:
+        keys_pdf = original['keys_pdf']
+        longitudes, latitudes, timestamps_ns = original['longitudes'], original['latitudes'], original['timestamps_ns']
+        positions = np.arange(len(keys_pdf))
+        simplified_keys_pdf = self._keys(simplified_pdf)
+        is_kept = pd.MultiIndex.from_frame(keys_pdf[[self.group_column, 'match_value']]).isin(
+            pd.MultiIndex.from_frame(simplified_keys_pdf))
+
+        # the simplified segment around every position, from the last kept position to the next one
+        segment_starts = np.maximum.accumulate(np.where(is_kept, positions, -1))
+        segment_ends = np.minimum.accumulate(np.where(is_kept, positions, len(positions))[::-1])[::-1]
+        vessel_starts = original['vessel_starts']
+        is_covered = (segment_starts >= vessel_starts) & (segment_ends <= original['vessel_ends'])
+        # segments of moves from previous positions, which are the segments of removed positions
+        # and the segments ending at kept positions
+        move_segment_starts = segment_starts[positions - 1]
+        is_move_covered = is_covered & (positions > vessel_starts) & (move_segment_starts >= vessel_starts)
+        move_segment_starts = np.where(is_move_covered, move_segment_starts, positions)
+        segment_starts = np.where(is_covered, segment_starts, positions)
+        segment_ends = np.where(is_covered, segment_ends, positions)
+
+        durations_ns = timestamps_ns[segment_ends] - timestamps_ns[segment_starts]
+        ratios = np.divide(timestamps_ns - timestamps_ns[segment_starts], durations_ns,
+                           out=np.zeros(len(positions)), where=durations_ns > 0)
+        sed_longitudes, sed_latitudes = sed_points_on_line(
+            longitudes[segment_starts], latitudes[segment_starts], longitudes[segment_ends], latitudes[segment_ends], ratios)
+        perpendicular_longitudes, perpendicular_latitudes = perpendicular_points_on_line(
+            longitudes[segment_starts], latitudes[segment_starts], longitudes[segment_ends], latitudes[segment_ends], longitudes, latitudes)
+        bearing, back_azimuth, distances_m = inverse(
+            np.concatenate([sed_longitudes, perpendicular_longitudes, longitudes[move_segment_starts]]),
+            np.concatenate([sed_latitudes, perpendicular_latitudes, latitudes[move_segment_starts]]),
+            np.concatenate([longitudes, longitudes, longitudes[segment_ends]]),
+            np.concatenate([latitudes, latitudes, latitudes[segment_ends]]),
+            self.geodesy_method)
+        sed_errors_m, perpendicular_errors_m, move_segment_distances_m = np.split(np.asarray(distances_m, dtype=np.float64), 3)
+
+        # distance along the simplified trajectory summed over segments ending at kept positions
+        travelled_distances_m = np.cumsum(np.where(is_kept, move_segment_distances_m, 0))
+        simplified_travelled_distances_m = (
+            travelled_distances_m[segment_starts] - travelled_distances_m[vessel_starts] + ratios * move_segment_distances_m)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            move_segment_speeds_kn = move_segment_distances_m / (
+                (timestamps_ns[segment_ends] - timestamps_ns[move_segment_starts]) / 1e9) * (3600 / 1852)
+
+        result_pdf = keys_pdf[[self.group_column, 'match_value', self.sort_col]].copy()
+        result_pdf['is_kept'] = is_kept
+        result_pdf['sed_error_m'] = np.where(is_covered, sed_errors_m, np.nan)
+        result_pdf['perpendicular_error_m'] = np.where(is_covered, perpendicular_errors_m, np.nan)
+        result_pdf['speed_deviation_kn'] = np.where(is_move_covered, move_segment_speeds_kn - original['move_speeds_kn'], np.nan)
+        result_pdf['distance_deviation_m'] = np.where(
+            is_covered, simplified_travelled_distances_m - original['travelled_distances_m'], np.nan)
+
+        return result_pdf
+
+    def point_errors(self, original_pdf: pd.DataFrame, simplified_pdf: pd.DataFrame) -> pd.DataFrame:
+        # one row per original position
+        return self._point_errors(self._prepare_original(original_pdf), simplified_pdf)
+
+    def _aggregate(self, point_errors_pdf: pd.DataFrame, columns: list) -> pd.DataFrame:
+        point_errors_pdf = point_errors_pdf.assign(
+            absolute_speed_deviation_kn=point_errors_pdf['speed_deviation_kn'].abs(),
+            absolute_distance_deviation_m=point_errors_pdf['distance_deviation_m'].abs())
+        result_pdf = point_errors_pdf.groupby(columns, sort=True).agg(
+            points_count=('is_kept', 'size'),
+            kept_points_count=('is_kept', 'sum'),
+            mean_sed_error_m=('sed_error_m', 'mean'),
+            max_sed_error_m=('sed_error_m', 'max'),
+            mean_perpendicular_error_m=('perpendicular_error_m', 'mean'),
+            max_perpendicular_error_m=('perpendicular_error_m', 'max'),
+            mean_absolute_speed_deviation_kn=('absolute_speed_deviation_kn', 'mean'),
+            max_absolute_speed_deviation_kn=('absolute_speed_deviation_kn', 'max'),
+            max_absolute_distance_deviation_m=('absolute_distance_deviation_m', 'max'),
+        )
+        result_pdf.insert(2, 'compression_ratio', result_pdf['points_count'] / result_pdf['kept_points_count'])
+
+        return result_pdf
+
+    def vessel_errors(self, original_pdf: pd.DataFrame, simplified_pdf: pd.DataFrame) -> pd.DataFrame:
+        return self._aggregate(self.point_errors(original_pdf, simplified_pdf), [self.group_column])
+
+    def algorithm_errors(self, original_pdf: pd.DataFrame, simplified_pdfs: dict, per_vessel: bool = False) -> pd.DataFrame:
+        # simplified_pdfs are algorithm name -> simplified trajectories of the same original ones,
+        # errors are aggregated per algorithm (and vessel)
+        original = self._prepare_original(original_pdf)
+        point_errors_pdf = pd.concat(
+            [self._point_errors(original, simplified_pdf).assign(algorithm=algorithm) for algorithm, simplified_pdf in simplified_pdfs.items()],
+            ignore_index=True)
+
+        return self._aggregate(point_errors_pdf, ['algorithm', self.group_column] if per_vessel else ['algorithm'])
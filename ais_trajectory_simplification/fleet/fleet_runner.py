@@ -0,0 +1,189 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from ais_trajectory_simplification.cache.result_cache import ResultCache
+from ais_trajectory_simplification.stats.processing_stats import ProcessingStats
+
+# columns attached by every worker process, filled by _attach_shared_columns
+_shared_columns = {}
+_shared_memories = []
+
+
+def _attach_shared_columns(shared_columns_spec: dict):
+    for column, (shared_memory_name, dtype, length) in shared_columns_spec.items():
+        shm = shared_memory.SharedMemory(name=shared_memory_name)
+        _shared_memories.append(shm)
+        _shared_columns[column] = np.ndarray(length, dtype=dtype, buffer=shm.buf)
+
+
+def _build_vessel_pdf(columns: list, index_name, start: int, stop: int, pickled_columns: dict) -> pd.DataFrame:
+    data = {}
+    for column in columns:
+        if column in pickled_columns:
+            data[column] = pickled_columns[column]
+        else:
+            data[column] = _shared_columns[column][start:stop].copy()
+    pdf = pd.DataFrame(data)
+    pdf.index = pd.Index(_shared_columns[FleetRunner.INDEX_COLUMN][start:stop].copy(), name=index_name)
+
+    return pdf
+
+
+def _process_vessels(func, columns: list, index_name, vessels: list) -> list:
+    results = []
+    for group_value, start, stop, pickled_columns in vessels:
+        pdf = _build_vessel_pdf(columns, index_name, start, stop, pickled_columns)
+        results.append((group_value, func(pdf)))
+
+    return results
+
+
+def _process_with_class(processor_class, method_name: str, init_kwargs: dict, method_kwargs: dict, pdf: pd.DataFrame,
+                        collect_stats: bool = False, cache: ResultCache = None):
+    stats = ProcessingStats(processor_class.__name__) if collect_stats else None
+
+    def process():
+        if stats is not None:
+            processor = processor_class(pdf, stats=stats, **init_kwargs)
+        else:
+            processor = processor_class(pdf, **init_kwargs)
+        return getattr(processor, method_name)(**method_kwargs)
+
+    if cache is None:
+        result = process()
+        return (result, stats, None) if collect_stats else result
+
+    cache_stats = ProcessingStats()
+    key = cache.key(pdf, processor_class, method_name, init_kwargs, method_kwargs)
+    return cache.get_or_compute(process, key, cache_stats), stats, cache_stats
+
+
+class FleetRunner:
+    INDEX_COLUMN = '__index__'
+
+    def __init__(self, pdf: pd.DataFrame, group_column: str = 'mmsi', sort_col: str = 'position_timestamp',
+                 max_workers: int = None, points_per_task: int = None):
+        self.group_column = group_column
+        self.max_workers = max_workers if max_workers is not None else os.cpu_count()
+        self.points_per_task = points_per_task
+
+        self.index_name = pdf.index.name
+        self.pdf = pdf.sort_values(group_column, kind='stable')
+        if sort_col in self.pdf and self.pdf[sort_col].dtype == object:
+            self.pdf[sort_col] = pd.to_datetime(self.pdf[sort_col])
+        self.columns = list(self.pdf.columns)
+
+        group_values = self.pdf[group_column].to_numpy()
+        boundaries = np.flatnonzero(group_values[1:] != group_values[:-1]) + 1
+        self.offsets = np.concatenate([[0], boundaries, [len(self.pdf)]]).astype(np.int64)
+        self.group_values = group_values[self.offsets[:-1]] if len(self.pdf) > 0 else group_values
+        # filled by run with collect_stats
+        self.stats = None
+        self.vessel_stats = {}
+
+    def _is_shareable(self, values: np.ndarray) -> bool:
+        return values.dtype.kind in 'biuf' or values.dtype == np.dtype('datetime64[ns]')
+
+    def _create_shared_columns(self):
+        shared_memories = []
+        shared_columns_spec = {}
+        pickled_columns = {}
+        columns = {column: self.pdf[column].to_numpy() for column in self.columns}
+        columns[self.INDEX_COLUMN] = self.pdf.index.to_numpy()
+        for column, values in columns.items():
+            if not self._is_shareable(values):
+                pickled_columns[column] = values
+                continue
+            shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+            shared_memories.append(shm)
+            shared_values = np.ndarray(len(values), dtype=values.dtype, buffer=shm.buf)
+            shared_values[:] = values
+            shared_columns_spec[column] = (shm.name, values.dtype.str, len(values))
+
+        return shared_memories, shared_columns_spec, pickled_columns
+
+    def _create_tasks(self, pickled_columns: dict) -> list:
+        # longest trajectories go first and short ones are packed together,
+        # so that workers are evenly loaded and small vessels do not pay per-task overhead
+        lengths = np.diff(self.offsets)
+        order = np.argsort(-lengths, kind='stable')
+        points_per_task = self.points_per_task
+        if points_per_task is None:
+            points_per_task = max(1, int(np.ceil(lengths.sum() / (max(self.max_workers, 1) * 8))))
+
+        tasks = []
+        task = []
+        task_points = 0
+        for position in order:
+            start, stop = int(self.offsets[position]), int(self.offsets[position + 1])
+            vessel_pickled_columns = {column: values[start:stop] for column, values in pickled_columns.items()}
+            task.append((self.group_values[position], start, stop, vessel_pickled_columns))
+            task_points = task_points + stop - start
+            if task_points >= points_per_task:
+                tasks.append(task)
+                task = []
+                task_points = 0
+        if task:
+            tasks.append(task)
+
+        return tasks
+
+    def _map(self, func) -> dict:
+        shared_memories, shared_columns_spec, pickled_columns = self._create_shared_columns()
+        try:
+            tasks = self._create_tasks(pickled_columns)
+            process_task = partial(_process_vessels, func, self.columns, self.index_name)
+            if self.max_workers <= 1:
+                _attach_shared_columns(shared_columns_spec)
+                results = [process_task(task) for task in tasks]
+            else:
+                with ProcessPoolExecutor(
+                    max_workers=self.max_workers, initializer=_attach_shared_columns, initargs=(shared_columns_spec,)
+                ) as executor:
+                    results = list(executor.map(process_task, tasks))
+        finally:
+            for column in shared_columns_spec:
+                _shared_columns.pop(column, None)
+            while _shared_memories:
+                _shared_memories.pop().close()
+            for shm in shared_memories:
+                shm.close()
+                shm.unlink()
+
+        return dict(result for task_results in results for result in task_results)
+
+    def _concat(self, vessel_results: dict) -> pd.DataFrame:
+        group_values = sorted(vessel_results)
+        if not group_values:
+            return self.pdf.iloc[:0]
+
+        return pd.concat([vessel_results[group_value] for group_value in group_values], keys=group_values, names=[self.group_column])
+
+    def apply(self, func) -> pd.DataFrame:
+        # func(pdf) is called for every vessel like in groupby(group_column).apply(func),
+        # it has to be picklable (a module level function or functools.partial of it)
+        return self._concat(self._map(func))
+
+    def run(self, processor_class, method_name: str, init_kwargs: dict = None, collect_stats: bool = False,
+            cache: ResultCache = None, **method_kwargs) -> pd.DataFrame:
+        # e.g. run(DPSimplificator, 'simplify_trajectory', epsilon_m=100); with collect_stats
+        # ProcessingStats of every vessel are kept in vessel_stats and their sums in stats,
+        # with cache only vessels whose positions or parameters changed are processed
+        vessel_results = self._map(partial(
+            _process_with_class, processor_class, method_name, init_kwargs or {}, method_kwargs,
+            collect_stats=collect_stats, cache=cache))
+        if not (collect_stats or cache is not None):
+            return self._concat(vessel_results)
+
+        if collect_stats:
+            self.vessel_stats = {group_value: stats for group_value, (result, stats, cache_stats) in vessel_results.items()}
+            self.stats = ProcessingStats.aggregate(self.vessel_stats.values(), processor_class.__name__)
+        if cache is not None:
+            for result, stats, cache_stats in vessel_results.values():
+                cache.stats.merge(cache_stats)
+            cache.evict()
+
+        return self._concat({group_value: result for group_value, (result, stats, cache_stats) in vessel_results.items()})
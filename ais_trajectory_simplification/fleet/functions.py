@@ -0,0 +1,29 @@
+import numpy as np
+from ais_trajectory_simplification.cleaning.functions import prepare_fleet_trajectory
+from ais_trajectory_simplification.geodesy.functions import GEODESIC
+from ais_trajectory_simplification.stats.processing_stats import DISABLED_STATS
+
+
+def process_many(processor_class, method_name: str, pdf, offsets: np.ndarray = None, group_column: str = 'mmsi', init_kwargs: dict = None,
+                 return_mask: bool = False, with_metrics: bool = True, **method_kwargs):
+    # all vessels of a fleet frame sorted by group_column and time are processed by one processor_class instance
+    # working on vessel offsets, without a DataFrame per vessel; the result frame has rows of all vessels one after
+    # another, the keep_mask is aligned with rows of pdf
+    init_kwargs = init_kwargs or {}
+    stats = init_kwargs.get('stats') or DISABLED_STATS
+    # with lean_metrics only the metrics read by processor_class are calculated
+    metric_columns = processor_class.INPUT_METRIC_COLUMNS if init_kwargs.get('lean_metrics') else None
+    with stats.phase('prepare_fleet'):
+        trajectory, input_positions = prepare_fleet_trajectory(
+            pdf, offsets, group_column, init_kwargs.get('geodesy_method', GEODESIC), with_metrics,
+            metric_columns=metric_columns, compact=init_kwargs.get('compact', False))
+    stats.count('vessels_count', len(trajectory.offsets) - 1)
+    processor = processor_class(trajectory, **init_kwargs)
+    result = getattr(processor, method_name)(return_mask=return_mask, **method_kwargs)
+    if not return_mask:
+        return result
+
+    keep_mask = np.zeros(len(pdf), dtype=bool)
+    keep_mask[input_positions] = result
+
+    return keep_mask
@@ -0,0 +1,64 @@
+import pandas as pd
+import numpy as np
+from ais_trajectory_simplification.cleaning.functions import prepare_fleet_trajectory, prepare_trajectory
+from ais_trajectory_simplification.cleaning.next_better_trajectory_cleaner import NextBetterTrajectoryCleaner
+from ais_trajectory_simplification.geodesy.functions import GEODESIC
+from ais_trajectory_simplification.segmentation.voyage_segmenter import VoyageSegmenter
+from ais_trajectory_simplification.simplification.downsampling_simplificator import DownsamplingSimplificator
+from ais_trajectory_simplification.stats.processing_stats import ProcessingStats, DISABLED_STATS
+from ais_trajectory_simplification.trajectory.trajectory import Trajectory
+
+
+class TrajectoryPipeline:
+    # chains cleaners and simplificators on one prepared Trajectory: positions are sorted and deduplicated
+    # and metrics calculated once, after each step only rows next to removed positions are recalculated;
+    # the result is the same as of passing the output of each step to the constructor of the next one
+    def __init__(self, geodesy_method: str = GEODESIC, stats: ProcessingStats = None, lean_metrics: bool = False, compact: bool = False):
+        self.geodesy_method = geodesy_method
+        # shared by all steps, each step is also timed as a phase named by its class
+        self.stats = stats if stats is not None else DISABLED_STATS
+        # with lean_metrics all steps keep only Trajectory.LEAN_METRIC_COLUMNS, which include metrics read by any of them
+        self.lean_metrics = lean_metrics
+        self.metric_columns = Trajectory.LEAN_METRIC_COLUMNS if lean_metrics else None
+        self.compact = compact
+        self.steps = []
+
+    def add_step(self, processor_class, method_name: str, init_kwargs: dict = None, **method_kwargs):
+        self.steps.append((processor_class, init_kwargs or {}, method_name, method_kwargs))
+        return self
+
+    def clean(self, **init_kwargs):
+        return self.add_step(NextBetterTrajectoryCleaner, 'clean_trajectory', init_kwargs)
+
+    def downsample(self, downsampling_sec):
+        return self.add_step(DownsamplingSimplificator, 'simplify_trajectory', downsampling_sec=downsampling_sec)
+
+    def simplify(self, simplificator_class, init_kwargs: dict = None, **method_kwargs):
+        return self.add_step(simplificator_class, 'simplify_trajectory', init_kwargs, **method_kwargs)
+
+    def simplify_voyages(self, simplificator_class, init_kwargs: dict = None, **method_kwargs):
+        # init_kwargs of VoyageSegmenter, method_kwargs of the simplificator
+        return self.add_step(VoyageSegmenter, 'simplify_trajectory', init_kwargs, simplificator_class=simplificator_class, **method_kwargs)
+
+    def process_trajectory(self, pdf):
+        trajectory = prepare_trajectory(pdf, self.geodesy_method, metric_columns=self.metric_columns, compact=self.compact)
+        for step_number, (processor_class, init_kwargs, method_name, method_kwargs) in enumerate(self.steps):
+            with self.stats.phase(processor_class.__name__):
+                if step_number > 0:
+                    trajectory.update_metrics(geodesy_method=self.geodesy_method, metric_columns=self.metric_columns)
+                processor = processor_class(trajectory, geodesy_method=self.geodesy_method, stats=self.stats,
+                                            **{**({'lean_metrics': True} if self.lean_metrics else {}), **init_kwargs})
+                trajectory = getattr(processor, method_name)(return_trajectory=True, **method_kwargs)
+
+        return trajectory
+
+    def process(self, pdf: pd.DataFrame) -> pd.DataFrame:
+        return self.process_trajectory(pdf).to_pdf()
+
+    def process_many(self, pdf, offsets: np.ndarray = None, group_column: str = 'mmsi') -> pd.DataFrame:
+        # all vessels of a fleet frame sorted by group_column and time go through every step at once
+        with self.stats.phase('prepare_fleet'):
+            trajectory, input_positions = prepare_fleet_trajectory(
+                pdf, offsets, group_column, self.geodesy_method, metric_columns=self.metric_columns, compact=self.compact)
+
+        return self.process_trajectory(trajectory).to_pdf()
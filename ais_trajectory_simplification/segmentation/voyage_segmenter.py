@@ -0,0 +1,202 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import math
+import pandas as pd
+import numpy as np
+from ais_trajectory_simplification.cleaning.functions import get_azimuths_and_distance, prepare_trajectory
+from ais_trajectory_simplification.geodesy.functions import GEODESIC
+from ais_trajectory_simplification.stats.processing_stats import ProcessingStats, DISABLED_STATS
+from ais_trajectory_simplification.trajectory.trajectory import Trajectory
+
+
+def _simplify_segment(simplificator_class, init_kwargs: dict, method_kwargs: dict, trajectory: Trajectory) -> np.ndarray:
+    return simplificator_class(trajectory, **init_kwargs).simplify_trajectory(return_mask=True, **method_kwargs)
+
+
+class VoyageSegmenter:
+    # splits a trajectory into voyages and stops: a stop is a run of positions lasting at least
+    # min_stop_duration_s whose bounding box is smaller than stop_max_distance_m (the stop test
+    # of OEPPSimplificator), voyages are also split where time_since_prev_pos_s exceeds max_gap_s
+    # metrics read by the segmenter, the only ones calculated with lean_metrics
+    INPUT_METRIC_COLUMNS = ['time_since_prev_pos_s']
+
+    def __init__(self, pdf: pd.DataFrame, stop_max_distance_m=500, min_stop_duration_s=3600, max_gap_s=3 * 3600,
+                 geodesy_method: str = GEODESIC, stats: ProcessingStats = None, lean_metrics: bool = False, compact: bool = False):
+        self.stop_max_distance_m = stop_max_distance_m
+        self.min_stop_duration_s = min_stop_duration_s
+        self.max_gap_s = max_gap_s
+        self.geodesy_method = geodesy_method
+        self.stats = stats if stats is not None else DISABLED_STATS
+        self.lean_metrics = lean_metrics
+        # metrics of results, with lean_metrics without shifted copies of other columns
+        self.metric_columns = Trajectory.LEAN_METRIC_COLUMNS if lean_metrics else Trajectory.METRIC_COLUMNS
+
+        with self.stats.phase('prepare'):
+            self.trajectory = prepare_trajectory(
+                pdf, self.geodesy_method, metric_columns=self.INPUT_METRIC_COLUMNS if lean_metrics else None, compact=compact)
+        self.stats.count('input_points_count', len(self.trajectory))
+        self.longitudes = self.trajectory.longitudes
+        self.latitudes = self.trajectory.latitudes
+        # set by segment
+        self.segment_numbers = None
+        self.is_stop = None
+
+    def _add_to_extremes(self, extremes: list, position: int):
+        # positions of sliding window minima and maxima, nan coordinates are skipped like in OEPPWindow
+        for values, sign, positions in extremes:
+            value = values[position]
+            if math.isnan(value):
+                continue
+            while positions and sign * values[positions[-1]] >= sign * value:
+                positions.pop()
+            positions.append(position)
+
+    def _find_stops(self, is_gap: np.ndarray) -> list:
+        # (start, end) of stops, a stop is extended from the earliest position as long as its bounding box
+        # stays small; the longest window from start never ends before the one from start - 1, so end only
+        # moves forward and the box is kept by sliding window minima and maxima in O(n)
+        points_count = len(self.trajectory)
+        longitudes, latitudes = self.longitudes.tolist(), self.latitudes.tolist()
+        # minima and maxima of longitudes and latitudes, in the order of get_azimuths_and_distance arguments
+        extremes = [(values, sign, deque()) for values in (longitudes, latitudes) for sign in (1, -1)]
+        box, stop_distance_m = None, None
+        geodesic_calls_count = 0
+        stops = []
+        start, end = 0, -1
+        while start < points_count - 1:
+            if end < start:
+                end = start
+                self._add_to_extremes(extremes, start)
+            for values, sign, positions in extremes:
+                while positions and positions[0] < start:
+                    positions.popleft()
+            # a window from a position without coordinates is never a stop, like in OEPPWindow
+            is_valid_start = not (math.isnan(longitudes[start]) or math.isnan(latitudes[start]))
+            while is_valid_start and end + 1 < points_count and not is_gap[end + 1]:
+                candidate_box = []
+                for values, sign, positions in extremes:
+                    extreme, value = values[positions[0]], values[end + 1]
+                    candidate_box.append(extreme if math.isnan(value) or sign * value >= sign * extreme else value)
+                if candidate_box != box:
+                    box = candidate_box
+                    geodesic_calls_count = geodesic_calls_count + 1
+                    bearing, back_azimuth, stop_distance_m = get_azimuths_and_distance(
+                        box[0], box[2], box[1], box[3], self.geodesy_method)
+                if not stop_distance_m < self.stop_max_distance_m:
+                    break
+                end = end + 1
+                self._add_to_extremes(extremes, end)
+            if is_valid_start and end > start and self.trajectory.seconds_between(start, end) >= self.min_stop_duration_s:
+                stops.append((start, end))
+                start = end + 1
+            else:
+                start = start + 1
+        self.stats.count('geodesic_calls_count', geodesic_calls_count)
+
+        return stops
+
+    def segment(self):
+        # segment_numbers count voyages and stops of the trajectory from 0
+        points_count = len(self.trajectory)
+        with self.stats.phase('segment'):
+            is_gap = self.trajectory.float_column('time_since_prev_pos_s') > self.max_gap_s
+            # vessels of a fleet trajectory are segmented separately
+            is_segment_start = is_gap | self.trajectory.first_rows()
+            stops = self._find_stops(is_segment_start)
+            self.is_stop = np.zeros(points_count, dtype=bool)
+            for start, end in stops:
+                self.is_stop[start:end + 1] = True
+                is_segment_start[start] = True
+                is_segment_start[end + 1:end + 2] = True
+            self.segment_numbers = np.cumsum(is_segment_start) - 1
+        self.stats.count('segments_count', int(is_segment_start.sum()))
+        self.stats.count('stops_count', len(stops))
+        self.stats.count('gaps_count', int(is_gap.sum()))
+
+        return self.segment_numbers, self.is_stop
+
+    def _segment_bounds(self) -> np.ndarray:
+        segment_starts = np.flatnonzero(np.diff(self.segment_numbers, prepend=-1))
+        return np.column_stack([segment_starts, np.append(segment_starts[1:], len(self.trajectory))])
+
+    def _stop_representative(self, start: int, end: int) -> int:
+        # the position closest to the mean position of the stop
+        longitudes, latitudes = self.longitudes[start:end], self.latitudes[start:end]
+        mean_latitude = latitudes.mean()
+        squared_distances = ((longitudes - longitudes.mean()) * np.cos(np.radians(mean_latitude)))**2 + (latitudes - mean_latitude)**2
+
+        return start + int(np.argmin(squared_distances))
+
+    def _result(self, keep_mask: np.ndarray, return_trajectory: bool):
+        result = self.trajectory.take(keep_mask)
+        # numbered from 0 for every vessel of a fleet trajectory
+        vessel_first_segment_numbers = np.maximum.accumulate(np.where(self.trajectory.first_rows(), self.segment_numbers, 0))
+        result.set_column('segment_number', (self.segment_numbers - vessel_first_segment_numbers)[keep_mask])
+        result.set_column('is_stop', self.is_stop[keep_mask])
+        # positions removed since the previous kept position, counted from the index like in the cleaner
+        no_of_cleaned_positions = np.zeros(len(result), dtype=np.int64)
+        no_of_cleaned_positions[1:] = np.diff(result.index) - 1
+        no_of_cleaned_positions[result.first_rows()] = 0
+        result.set_column('no_of_cleaned_positions_since_prev_pos', no_of_cleaned_positions)
+        result.update_metrics(geodesy_method=self.geodesy_method, metric_columns=self.metric_columns)
+        result.move_columns_to_end(self.metric_columns)
+
+        return result if return_trajectory else result.to_pdf()
+
+    def segment_trajectory(self, return_trajectory: bool = False):
+        # all positions with segment_number and is_stop
+        if self.segment_numbers is None:
+            self.segment()
+        keep_mask = np.ones(len(self.trajectory), dtype=bool)
+        self.stats.count_selection(keep_mask)
+        with self.stats.phase('build_result'):
+            result = self._result(keep_mask, return_trajectory)
+        self.stats.emit()
+
+        return result
+
+    def simplify_trajectory(self, simplificator_class, init_kwargs: dict = None, max_workers: int = 1, return_mask: bool = False,
+                            return_trajectory: bool = False, **method_kwargs):
+        # every voyage is simplified on its own, as if it was a whole trajectory, in max_workers processes;
+        # a stop is replaced by one of its positions and metrics are recalculated across segment boundaries
+        if self.segment_numbers is None:
+            self.segment()
+        init_kwargs = {'geodesy_method': self.geodesy_method, **({'lean_metrics': True} if self.lean_metrics else {}), **(init_kwargs or {})}
+        keep_mask = np.zeros(len(self.trajectory), dtype=bool)
+        voyage_bounds = []
+        for start, end in self._segment_bounds():
+            if self.is_stop[start]:
+                keep_mask[self._stop_representative(start, end)] = True
+            elif end - start <= 2:
+                keep_mask[start:end] = True
+            else:
+                voyage_bounds.append((start, end))
+
+        with self.stats.phase('simplify'):
+            voyages = []
+            vessel_numbers = self.trajectory.vessel_numbers()
+            for start, end in voyage_bounds:
+                voyage_mask = np.zeros(len(self.trajectory), dtype=bool)
+                voyage_mask[start:end] = True
+                # metrics of the first position do not depend on the previous segment
+                voyage = self.trajectory.take(voyage_mask).single_vessel(vessel_numbers[start])
+                voyages.append(voyage.calculate_metrics(geodesy_method=self.geodesy_method, metric_columns=self.metric_columns))
+            simplify_segment = partial(_simplify_segment, simplificator_class, init_kwargs, method_kwargs)
+            if max_workers <= 1 or len(voyages) <= 1:
+                voyage_keep_masks = [simplify_segment(voyage) for voyage in voyages]
+            else:
+                with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                    voyage_keep_masks = list(executor.map(simplify_segment, voyages))
+            for (start, end), voyage_keep_mask in zip(voyage_bounds, voyage_keep_masks):
+                keep_mask[start:end] = voyage_keep_mask
+        self.stats.count_selection(keep_mask)
+        if return_mask:
+            self.stats.emit()
+            return keep_mask
+
+        with self.stats.phase('build_result'):
+            result = self._result(keep_mask, return_trajectory)
+        self.stats.emit()
+
+        return result
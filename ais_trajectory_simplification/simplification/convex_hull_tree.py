@@ -0,0 +1,96 @@
+import numpy as np
+
+
+class ConvexHullTree:
+    # convex hulls of blocks of leaf_size, 2 * leaf_size, 4 * leaf_size, ... consecutive points, built in
+    # O(n log n); the point of a range farthest from a line is a vertex of the hulls covering the range,
+    # where it is found by a binary search on edge angles, so a range is searched in O(log^2 n) instead of O(n)
+    def __init__(self, xs: np.ndarray, ys: np.ndarray, leaf_size: int = 32):
+        self.xs = np.asarray(xs, dtype=np.float64)
+        self.ys = np.asarray(ys, dtype=np.float64)
+        self.leaf_size = leaf_size
+        self.blocks_count = len(self.xs) // leaf_size
+
+        hulls = [self._hull(np.arange(block * leaf_size, (block + 1) * leaf_size)) for block in range(self.blocks_count)]
+        # nodes of level k cover 2^k blocks, node ids are numbered level by level
+        self.level_offsets = [0]
+        level_hulls = hulls
+        while len(level_hulls) > 1:
+            self.level_offsets.append(self.level_offsets[-1] + len(level_hulls))
+            level_hulls = [
+                self._hull(np.concatenate([level_hulls[node], level_hulls[node + 1]])) for node in range(0, len(level_hulls) - 1, 2)]
+            hulls.extend(level_hulls)
+
+        vertices_counts = np.array([len(hull) for hull in hulls], dtype=np.int64)
+        self.vertex_offsets = np.concatenate([[0], np.cumsum(vertices_counts)]).astype(np.int64)
+        self.vertex_positions = np.concatenate(hulls).astype(np.int64) if hulls else np.zeros(0, dtype=np.int64)
+        # edges go from every vertex to the next one counterclockwise, from the leftmost vertex their angles
+        # grow from -90 to 270 deg; node id * 8 keeps edges of all nodes in one sorted array
+        next_positions = np.roll(self.vertex_positions, -1)
+        next_positions[self.vertex_offsets[1:] - 1] = self.vertex_positions[self.vertex_offsets[:-1]]
+        edge_angles = self._angles(
+            self.xs[next_positions] - self.xs[self.vertex_positions], self.ys[next_positions] - self.ys[self.vertex_positions])
+        self.edge_keys = np.repeat(np.arange(len(hulls)) * 8, vertices_counts) + edge_angles + np.pi / 2
+
+    def _angles(self, dxs, dys) -> np.ndarray:
+        angles = np.arctan2(dys, dxs)
+        return np.where(angles <= -np.pi / 2, angles + 2 * np.pi, angles)
+
+    def _hull(self, positions: np.ndarray) -> np.ndarray:
+        # monotone chain, counterclockwise from the leftmost (and lowest) vertex without collinear vertices
+        positions = positions[np.lexsort((self.ys[positions], self.xs[positions]))]
+        xs, ys = self.xs[positions].tolist(), self.ys[positions].tolist()
+        order = list(range(len(positions)))
+
+        def chain(indexes):
+            chain_indexes = []
+            for index in indexes:
+                while len(chain_indexes) >= 2 and (
+                    (xs[chain_indexes[-1]] - xs[chain_indexes[-2]]) * (ys[index] - ys[chain_indexes[-2]])
+                    - (ys[chain_indexes[-1]] - ys[chain_indexes[-2]]) * (xs[index] - xs[chain_indexes[-2]])) <= 0:
+                    chain_indexes.pop()
+                chain_indexes.append(index)
+            return chain_indexes
+
+        lower, upper = chain(order), chain(order[::-1])
+        hull_indexes = lower[:-1] + upper[:-1] if len(lower) + len(upper) > 2 else lower
+
+        return positions[hull_indexes]
+
+    def _nodes(self, start_block: int, end_block: int) -> list:
+        # ids of nodes exactly covering blocks start_block ... end_block - 1
+        nodes = []
+        level = 0
+        while start_block < end_block:
+            if start_block & 1:
+                nodes.append(self.level_offsets[level] + start_block)
+                start_block = start_block + 1
+            if end_block & 1:
+                end_block = end_block - 1
+                nodes.append(self.level_offsets[level] + end_block)
+            start_block, end_block = start_block >> 1, end_block >> 1
+            level = level + 1
+
+        return nodes
+
+    def candidate_positions(self, start: int, end: int, x1, y1, x2, y2) -> np.ndarray:
+        # positions among start ... end - 1 which include the one farthest from the line through (x1, y1)
+        # and (x2, y2), or from (x1, y1) if both points are the same
+        start_block = -(-start // self.leaf_size)
+        end_block = end // self.leaf_size
+        if start_block >= end_block:
+            return np.arange(start, end)
+        scanned_positions = [np.arange(start, start_block * self.leaf_size), np.arange(end_block * self.leaf_size, end)]
+        nodes = np.array(self._nodes(start_block, end_block), dtype=np.int64)
+
+        if x1 == x2 and y1 == y2:
+            vertex_positions = [self.vertex_positions[self.vertex_offsets[node]:self.vertex_offsets[node + 1]] for node in nodes]
+            return np.concatenate(scanned_positions + vertex_positions)
+
+        # extreme vertices in both directions perpendicular to the line
+        direction_angles = self._angles(np.array([x2 - x1, x1 - x2]), np.array([y2 - y1, y1 - y2]))
+        nodes = np.repeat(nodes, 2)
+        edges = np.searchsorted(self.edge_keys, nodes * 8 + np.tile(direction_angles, len(nodes) // 2) + np.pi / 2)
+        vertices = np.where(edges == self.vertex_offsets[nodes + 1], self.vertex_offsets[nodes], edges)
+
+        return np.concatenate(scanned_positions + [self.vertex_positions[vertices]])
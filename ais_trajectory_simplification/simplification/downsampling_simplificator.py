@@ -1,28 +1,146 @@
 import pandas as pd
 import numpy as np
-from ais_trajectory_simplification.cleaning.functions import calculate_metrics, sort_and_reset_index
+from ais_trajectory_simplification.cleaning.functions import prepare_trajectory
+from ais_trajectory_simplification.fleet.functions import process_many
+from ais_trajectory_simplification.geodesy.functions import GEODESIC
+from ais_trajectory_simplification.stats.processing_stats import ProcessingStats, DISABLED_STATS
+from ais_trajectory_simplification.trajectory.trajectory import Trajectory
+from ais_trajectory_simplification.trajectory.trajectory_checkpoint import TrajectoryCheckpoint
 
 
 class DownsamplingSimplificator:
-    def __init__(self, pdf: pd.DataFrame):
-        self.pdf = sort_and_reset_index(pdf)
-        self.pdf 
-
-    def simplify_trajectory(self, downsampling_sec):
-        result_pdf = self.pdf.copy()
-        # result_pdf['position_timestamp'] = result_pdf['position_timestamp'].dt.tz_convert(None)
-
-        result_pdf['time_group'] = np.floor(
-            (result_pdf['position_timestamp'] - pd.Timestamp("1970-01-01")) / pd.Timedelta(f"{downsampling_sec}s")).astype('int')
-
-        # last should have different value
-        result_pdf.loc[result_pdf['position_timestamp'] ==
-                       result_pdf['position_timestamp'].max(), 'time_group'] = 99999999
-
-        result_pdf = result_pdf.groupby('time_group').first()
-        result_pdf = result_pdf.sort_values('position_timestamp')
-        result_pdf = result_pdf.reset_index(drop=True)
-        result_pdf.index.name = "index"
-        
-        result_pdf = calculate_metrics(result_pdf)
-        return result_pdf
+    # buckets only read times, metrics are calculated only for kept positions
+    INPUT_METRIC_COLUMNS = []
+
+    def __init__(self, pdf: pd.DataFrame, geodesy_method: str = GEODESIC, stats: ProcessingStats = None, checkpoint: TrajectoryCheckpoint = None,
+                 lean_metrics: bool = False, compact: bool = False):
+        self.geodesy_method = geodesy_method
+        self.stats = stats if stats is not None else DISABLED_STATS
+        # metrics of results, with lean_metrics without shifted copies of other columns
+        self.metric_columns = Trajectory.LEAN_METRIC_COLUMNS if lean_metrics else Trajectory.METRIC_COLUMNS
+        # made by simplify_trajectory_part of the previous part of the trajectory
+        self.checkpoint = checkpoint
+        if checkpoint is not None:
+            pdf = checkpoint.prepend_to(pdf)
+        self.input_columns = list(pdf.columns) if isinstance(pdf, pd.DataFrame) else None
+        with self.stats.phase('prepare'):
+            self.trajectory = prepare_trajectory(pdf, self.geodesy_method, with_metrics=False, compact=compact)
+        self.stats.count('input_points_count', len(self.trajectory))
+
+    def _bucket_first_positions(self, timestamps_ns: np.ndarray, positions: np.ndarray, downsampling_ns: int) -> np.ndarray:
+        # positions are sorted by time, the first one of every time bucket is kept,
+        # with a fleet trajectory of every bucket of every vessel
+        buckets = np.floor_divide(timestamps_ns[positions], downsampling_ns)
+        is_first = np.empty(len(positions), dtype=bool)
+        is_first[:1] = True
+        np.not_equal(buckets[1:], buckets[:-1], out=is_first[1:])
+        if self.trajectory.offsets is not None:
+            vessel_numbers = self.trajectory.vessel_numbers()[positions]
+            is_first[1:] = is_first[1:] | (vessel_numbers[1:] != vessel_numbers[:-1])
+
+        return positions[is_first]
+
+    def select_points(self, downsampling_secs: list, is_last: bool = True) -> dict:
+        # downsampling_sec -> keep_mask; the first points of buckets of an interval which is a multiple
+        # of a shorter one are among the first points of the shorter one's buckets, so only those are checked
+        points_count = len(self.trajectory)
+        # buckets are aligned to epoch, so times of a compact trajectory are converted once for all rates
+        timestamps_ns = self.trajectory.timestamps_ns
+        keep_masks = {}
+        candidate_positions = np.arange(points_count)
+        candidate_downsampling_ns = None
+        for downsampling_sec in sorted(set(downsampling_secs)):
+            downsampling_ns = pd.Timedelta(f"{downsampling_sec}s").value
+            positions = np.arange(points_count)
+            if candidate_downsampling_ns is not None and downsampling_ns % candidate_downsampling_ns == 0:
+                positions = candidate_positions
+            candidate_positions = self._bucket_first_positions(timestamps_ns, positions, downsampling_ns)
+            candidate_downsampling_ns = downsampling_ns
+
+            keep_mask = np.zeros(points_count, dtype=bool)
+            keep_mask[candidate_positions] = True
+            # the last point is always kept, the last point of a trajectory part only with the last part
+            if is_last:
+                keep_mask[-1:] = True
+                keep_mask[self.trajectory.vessel_offsets()[1:-1] - 1] = True
+            keep_masks[downsampling_sec] = keep_mask
+
+        return keep_masks
+
+    def _result(self, keep_mask: np.ndarray, return_trajectory: bool):
+        result = self.trajectory.take(keep_mask)
+        # numbered from 0 for every vessel
+        offsets = result.vessel_offsets()
+        result.index = np.arange(len(result)) - offsets[:-1][result.vessel_numbers()]
+        result.index_name = 'index'
+        result.calculate_metrics(geodesy_method=self.geodesy_method, metric_columns=self.metric_columns)
+
+        return result if return_trajectory else result.to_pdf()
+
+    def simplify_trajectories(self, downsampling_secs: list, return_mask: bool = False, return_trajectory: bool = False) -> dict:
+        # all rates in one call, e.g. simplify_trajectories([600, 1800, 7200]) -> {600: pdf, 1800: pdf, 7200: pdf}
+        with self.stats.phase('select'):
+            keep_masks = self.select_points(downsampling_secs)
+        for keep_mask in keep_masks.values():
+            self.stats.count_selection(keep_mask)
+        if return_mask:
+            self.stats.emit()
+            return keep_masks
+
+        with self.stats.phase('build_result'):
+            results = {
+                downsampling_sec: self._result(keep_mask, return_trajectory) for downsampling_sec, keep_mask in keep_masks.items()
+            }
+        self.stats.count('geodesic_calls_count', len(results))
+        self.stats.count('array_copies_count', sum(len(result.columns) + 1 for result in results.values()))
+        self.stats.emit()
+
+        return results
+
+    def simplify_trajectory(self, downsampling_sec, return_mask: bool = False, return_trajectory: bool = False):
+        return self.simplify_trajectories([downsampling_sec], return_mask, return_trajectory)[downsampling_sec]
+
+    @classmethod
+    def simplify_many(cls, pdf, offsets: np.ndarray = None, group_column: str = 'mmsi', init_kwargs: dict = None, return_mask: bool = False,
+                      **method_kwargs):
+        # all vessels of a fleet frame sorted by group_column and time at once, see fleet.functions.process_many
+        return process_many(cls, 'simplify_trajectory', pdf, offsets, group_column, init_kwargs, return_mask, with_metrics=False,
+                            **method_kwargs)
+
+    def simplify_trajectory_part(self, downsampling_sec, is_last: bool = False):
+        # simplifies a trajectory part by part, e.g. one day at a time, and returns (result, checkpoint);
+        # buckets do not depend on the first point, so only the last two kept points are passed
+        # to the next part for metrics, concatenated results are the same as of simplify_trajectory
+        if self.input_columns is None:
+            raise ValueError("Only DataFrames can be simplified in parts")
+        parameters = {'downsampling_sec': downsampling_sec, 'geodesy_method': self.geodesy_method}
+        if self.checkpoint is None:
+            output_points_count, context_points_count = 0, 0
+        else:
+            self.checkpoint.check(type(self).__name__, parameters)
+            output_points_count = self.checkpoint.state['output_points_count']
+            context_points_count = self.checkpoint.state['context_points_count']
+
+        with self.stats.phase('select'):
+            keep_mask = self.select_points([downsampling_sec], is_last)[downsampling_sec]
+        self.stats.count('output_points_count', int(keep_mask.sum()) - context_points_count)
+
+        with self.stats.phase('build_result'):
+            result = self.trajectory.take(keep_mask)
+            result.index = np.arange(len(result)) + output_points_count - context_points_count
+            result.index_name = 'index'
+            result.calculate_metrics(geodesy_method=self.geodesy_method, metric_columns=self.metric_columns)
+            result = result.to_pdf().iloc[context_points_count:]
+            checkpoint = None
+            if not is_last:
+                kept_positions = np.flatnonzero(keep_mask)[-2:]
+                checkpoint_mask = np.zeros(len(keep_mask), dtype=bool)
+                checkpoint_mask[kept_positions] = True
+                checkpoint = TrajectoryCheckpoint(type(self).__name__, parameters,
+                    self.trajectory.take(checkpoint_mask).to_pdf()[self.input_columns], {
+                        'output_points_count': int(output_points_count + len(result)),
+                        'context_points_count': len(kept_positions),
+                    })
+        self.stats.emit()
+
+        return result, checkpoint
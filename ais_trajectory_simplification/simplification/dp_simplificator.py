@@ -1,135 +1,152 @@
 import pandas as pd
 import numpy as np
-from ais_trajectory_simplification.cleaning.functions import get_azimuths_and_distance, calculate_metrics, sort_and_reset_index
-from geopy import distance
-from sortedcontainers import SortedList
+from ais_trajectory_simplification.cleaning.functions import prepare_trajectory
+from ais_trajectory_simplification.fleet.functions import process_many
+from ais_trajectory_simplification.geodesy.functions import GEODESIC, inverse
+from ais_trajectory_simplification.stats.processing_stats import ProcessingStats, DISABLED_STATS
+from ais_trajectory_simplification.trajectory.trajectory import Trajectory
+from ais_trajectory_simplification.simplification.convex_hull_tree import ConvexHullTree
+from ais_trajectory_simplification.simplification.functions import perpendicular_distances_m, perpendicular_points_on_line, select_split_points, split_point_significances, save_significances, load_significances
+
+# farthest point searches of the split loop: scan computes distances of all points of a segment,
+# hull only of vertices of a ConvexHullTree, auto switches to hull when the splits are degenerated
+SCAN = 'scan'
+HULL = 'hull'
+AUTO = 'auto'
 
 
 class DPSimplificator:
-    def __init__(self, pdf: pd.DataFrame):
-        self.pdf = sort_and_reset_index(pdf)
-        self.pdf = calculate_metrics(self.pdf)
-        self.pdf['no_of_cleaned_positions_since_prev_pos'] = 0
-
-        self.index_column_name = self.pdf.index.name
-        self.pdf = self.pdf.reset_index()
-        self.index_loc = self.pdf.columns.get_loc(self.index_column_name)
-        self.latitude_loc = self.pdf.columns.get_loc('latitude')
-        self.longitude_loc = self.pdf.columns.get_loc('longitude')
-        self.prev_pos_latitude_loc = self.pdf.columns.get_loc(
-            'prev_pos_latitude')
-        self.prev_pos_longitude_loc = self.pdf.columns.get_loc(
-            'prev_pos_longitude')
-        self.position_timestamp_loc = self.pdf.columns.get_loc(
-            'position_timestamp')
-        self.prev_pos_position_timestamp_loc = self.pdf.columns.get_loc(
-            'prev_pos_position_timestamp')
-        self.speed_reference_kn_loc = self.pdf.columns.get_loc(
-            'speed_reference_kn')
-        self.time_since_prev_pos_s_loc = self.pdf.columns.get_loc(
-            'time_since_prev_pos_s')
-        self.distance_since_prev_pos_m_loc = self.pdf.columns.get_loc(
-            'distance_since_prev_pos_m')
-        self.speed_since_prev_pos_kn_loc = self.pdf.columns.get_loc(
-            'speed_since_prev_pos_kn')
-        self.prev_speed_since_prev_pos_kn_loc = self.pdf.columns.get_loc(
-            'prev_speed_since_prev_pos_kn')
-        self.acceleration_kn_s_loc = self.pdf.columns.get_loc(
-            'acceleration_kn_s')
-        self.bearing_since_prev_pos_deg_loc = self.pdf.columns.get_loc(
-            'bearing_since_prev_pos_deg')
-        self.no_of_cleaned_positions_since_prev_pos_loc = self.pdf.columns.get_loc(
-            'no_of_cleaned_positions_since_prev_pos')
-
-    def _calculate_from_new_previous_position(self, position, prev_position):
-        position[self.bearing_since_prev_pos_deg_loc], back_azimuth, position[self.distance_since_prev_pos_m_loc] = get_azimuths_and_distance(
-            prev_position[self.longitude_loc], prev_position[self.latitude_loc], position[self.longitude_loc], position[self.latitude_loc])
-        if position[self.bearing_since_prev_pos_deg_loc] < 0:
-            position[self.bearing_since_prev_pos_deg_loc] + 360
-
-        position[self.time_since_prev_pos_s_loc] = (
-            position[self.position_timestamp_loc] - prev_position[self.position_timestamp_loc]) / np.timedelta64(1, 's')
-        position[self.speed_since_prev_pos_kn_loc] = (
-            position[self.distance_since_prev_pos_m_loc] / position[self.time_since_prev_pos_s_loc]) * (3600 / 1852)
-
-        position[self.no_of_cleaned_positions_since_prev_pos_loc] = position[self.index_loc] - \
-            prev_position[self.index_loc] - 1
-
-        return position
-
-    def simplify_trajectory(self, epsilon_m):
-        points = self.pdf.to_numpy()
-        selected_points_positions = SortedList([0, len(points) - 1])  # , key=lambda x: x[0])
-        start_point_position = 0
-        while start_point_position < len(selected_points_positions) - 1:
-            (farthest_point, distance) = self.find_farthest_point(
-                points[selected_points_positions[start_point_position]:selected_points_positions[start_point_position+1]+1])
-            if distance > epsilon_m:
-                idx = np.where(points[:, self.index_loc] == farthest_point[self.index_loc])[0][0]
-                selected_points_positions.add(idx)
+    # with auto, a split loop is degenerated after AUTO_EVALUATIONS_FACTOR * n * log2(n) distance evaluations,
+    # regular trajectories need 1 - 2.5 * n * log2(n) and loitering or circling ones up to n^2 / 2
+    AUTO_EVALUATIONS_FACTOR = 4
+    # splits only read positions, so no metrics are calculated with lean_metrics
+    INPUT_METRIC_COLUMNS = []
+
+    def __init__(self, pdf: pd.DataFrame, geodesy_method: str = GEODESIC, stats: ProcessingStats = None, farthest_point_search: str = AUTO,
+                 lean_metrics: bool = False, compact: bool = False):
+        if farthest_point_search not in [SCAN, HULL, AUTO]:
+            raise ValueError(f"Unknown farthest point search '{farthest_point_search}', use one of {[SCAN, HULL, AUTO]}")
+        self.geodesy_method = geodesy_method
+        self.stats = stats if stats is not None else DISABLED_STATS
+        # metrics of results, with lean_metrics without shifted copies of other columns
+        self.metric_columns = Trajectory.LEAN_METRIC_COLUMNS if lean_metrics else Trajectory.METRIC_COLUMNS
+        self.farthest_point_search = farthest_point_search
+        self.segments_count = 0
+        self.distance_evaluations_count = 0
+        self.loop_distance_evaluations_count = 0
+        # (start, end) of the vessel of the segments split by the loop, vessels of a fleet trajectory are split one after another
+        self.loop_vessel_bounds = (0, 0)
+        self.hull_tree = None
+
+        with self.stats.phase('prepare'):
+            self.trajectory = prepare_trajectory(
+                pdf, self.geodesy_method, metric_columns=self.INPUT_METRIC_COLUMNS if lean_metrics else None, compact=compact)
+            self.trajectory.set_column('no_of_cleaned_positions_since_prev_pos', np.zeros(len(self.trajectory), dtype=np.int64))
+        self.stats.count('input_points_count', len(self.trajectory))
+        self.longitudes = self.trajectory.longitudes
+        self.latitudes = self.trajectory.latitudes
+        # set by calculate_significances or load_significances, simplify_trajectory then only filters them
+        self.significances_m = None
+
+    def _count_segments(self, segments_count: int, distance_evaluations_count: int):
+        # one geodesic call per evaluated segment, distance evaluations grow quadratically on degenerated splits
+        self.stats.count('segments_count', self.segments_count - segments_count)
+        self.stats.count('geodesic_calls_count', self.segments_count - segments_count)
+        self.stats.count('distance_evaluations_count', self.distance_evaluations_count - distance_evaluations_count)
+
+    def calculate_significances(self) -> np.ndarray:
+        segments_count, distance_evaluations_count = self.segments_count, self.distance_evaluations_count
+        with self.stats.phase('significances'):
+            self.loop_vessel_bounds = (0, 0)
+            self.significances_m = split_point_significances(
+                len(self.trajectory), self.segment_distances_m, self.farthest_point, self.trajectory.offsets)
+        self._count_segments(segments_count, distance_evaluations_count)
+        return self.significances_m
+
+    def save_significances(self, path: str):
+        if self.significances_m is None:
+            self.calculate_significances()
+        save_significances(path, self.trajectory.index, self.significances_m)
+
+    def load_significances(self, path: str) -> np.ndarray:
+        self.significances_m = load_significances(path, self.trajectory.index)
+        return self.significances_m
+
+    def simplify_trajectory(self, epsilon_m, return_mask: bool = False, return_trajectory: bool = False):
+        segments_count, distance_evaluations_count = self.segments_count, self.distance_evaluations_count
+        with self.stats.phase('select'):
+            if self.significances_m is not None and epsilon_m >= 0:
+                keep_mask = self.significances_m > epsilon_m
             else:
-                start_point_position = start_point_position + 1
-                while (start_point_position < len(selected_points_positions) - 1) and (selected_points_positions[start_point_position] + 1 == selected_points_positions[start_point_position+1]):
-                    start_point_position = start_point_position + 1
+                self.loop_vessel_bounds = (0, 0)
+                keep_mask = select_split_points(
+                    len(self.trajectory), epsilon_m, self.segment_distances_m, self.farthest_point, self.trajectory.offsets)
+        self._count_segments(segments_count, distance_evaluations_count)
+        self.stats.count_selection(keep_mask)
+        if return_mask:
+            self.stats.emit()
+            return keep_mask
 
         # add also no_of_cleaned_positions_since_prev_pos
-        simplified_pdf_arr = points[selected_points_positions, :]
-        result_pdf = pd.DataFrame(simplified_pdf_arr, columns=self.pdf.columns).astype(
-            self.pdf.dtypes.to_dict())
-        result_pdf = result_pdf.drop(
-            result_pdf.columns[
-                [
-                    self.prev_pos_latitude_loc,
-                    self.prev_pos_longitude_loc,
-                    self.prev_pos_position_timestamp_loc,
-                    self.time_since_prev_pos_s_loc,
-                    self.distance_since_prev_pos_m_loc,
-                    self.speed_since_prev_pos_kn_loc,
-                    self.prev_speed_since_prev_pos_kn_loc,
-                    self.acceleration_kn_s_loc,
-                    self.bearing_since_prev_pos_deg_loc,
-                    self.prev_speed_since_prev_pos_kn_loc
-                ]
-            ],
-            axis=1
-        )
-        result_pdf = result_pdf.set_index(self.index_column_name)
-        result_pdf = calculate_metrics(result_pdf)
-
-        return result_pdf
-
-    def find_farthest_point(self, points: np.ndarray):
-        start_point = points[0]
-        end_point = points[-1]
-        perpendicular_distance_f = self.distance_from_line(start_point, end_point)
-        farthest_point = max(points[1:-1], default=-1, key=perpendicular_distance_f)
-        if isinstance(farthest_point, int):
-            return (None, 0)
-        else:
-            return (farthest_point, perpendicular_distance_f(farthest_point))
-
-    def distance_from_line(self, start_point, end_point):
-        def distance_from_line_wrapper_m(point):
-            perpendicular_point = self.perpendicular_point_on_line(
-                start_point[self.longitude_loc],
-                start_point[self.latitude_loc],
-                end_point[self.longitude_loc],
-                end_point[self.latitude_loc],
-                point[self.longitude_loc],
-                point[self.latitude_loc])
-            return distance.distance((perpendicular_point[1], perpendicular_point[0]), (point[self.latitude_loc], point[self.longitude_loc])).m
-
-        return distance_from_line_wrapper_m
-
-    # based on https://stackoverflow.com/questions/47177493/python-point-on-a-line-closest-to-third-point
-    # 1 and 2 are line points
-
-    def perpendicular_point_on_line(self, x1, y1, x2, y2, x3, y3):
-        dx, dy = x2-x1, y2-y1
-        det = dx*dx + dy*dy
-        a = (dy*(y3-y1)+dx*(x3-x1))/det
-        x = x1+a*dx
-        y = y1+a*dy
-        y = -90 if (y < -90) else y
-        y = 90 if (y > 90) else y
-        return x, y
+        with self.stats.phase('build_result'):
+            result = self.trajectory.take(keep_mask)
+            result.update_metrics(geodesy_method=self.geodesy_method, metric_columns=self.metric_columns)
+            result.move_columns_to_end(self.metric_columns)
+            result = result if return_trajectory else result.to_pdf()
+        self.stats.count('array_copies_count', len(result.columns) + 1)
+        self.stats.emit()
+
+        return result
+
+    @classmethod
+    def simplify_many(cls, pdf, offsets: np.ndarray = None, group_column: str = 'mmsi', init_kwargs: dict = None, return_mask: bool = False,
+                      **method_kwargs):
+        # all vessels of a fleet frame sorted by group_column and time at once, see fleet.functions.process_many
+        return process_many(cls, 'simplify_trajectory', pdf, offsets, group_column, init_kwargs, return_mask, **method_kwargs)
+
+    def segment_distances_m(self, start: int, end: int) -> np.ndarray:
+        self.segments_count = self.segments_count + 1
+        self.distance_evaluations_count = self.distance_evaluations_count + end - start - 1
+        return perpendicular_distances_m(self.longitudes, self.latitudes, start, end, self.geodesy_method)
+
+    def _is_degenerated(self, start: int) -> bool:
+        # every vessel has its own budget, so a fleet trajectory is simplified like its vessels one by one
+        vessel_start, vessel_end = self.loop_vessel_bounds
+        if not vessel_start <= start < vessel_end:
+            offsets = self.trajectory.vessel_offsets()
+            vessel = np.searchsorted(offsets, start, side='right') - 1
+            vessel_start, vessel_end = self.loop_vessel_bounds = int(offsets[vessel]), int(offsets[vessel + 1])
+            self.loop_distance_evaluations_count = self.distance_evaluations_count
+        points_count = vessel_end - vessel_start
+        evaluations_count = self.distance_evaluations_count - self.loop_distance_evaluations_count
+
+        return evaluations_count > self.AUTO_EVALUATIONS_FACTOR * points_count * np.log2(max(points_count, 2))
+
+    def farthest_point(self, start: int, end: int) -> tuple:
+        if self.farthest_point_search == HULL or (self.farthest_point_search == AUTO and self._is_degenerated(start)):
+            return self.hull_farthest_point(start, end)
+
+        distances_m = self.segment_distances_m(start, end)
+        farthest_position = np.argmax(distances_m)
+        return start + 1 + farthest_position, distances_m[farthest_position]
+
+    def hull_farthest_point(self, start: int, end: int) -> tuple:
+        # candidates are farthest from the line in degrees, where points are projected on it, their distances
+        # in metres then differ only by the change of the length of a degree of longitude along the segment
+        if self.hull_tree is None:
+            with self.stats.phase('hull_tree'):
+                self.hull_tree = ConvexHullTree(self.longitudes, self.latitudes)
+        candidate_positions = np.unique(self.hull_tree.candidate_positions(
+            start + 1, end, self.longitudes[start], self.latitudes[start], self.longitudes[end], self.latitudes[end]))
+        self.segments_count = self.segments_count + 1
+        self.distance_evaluations_count = self.distance_evaluations_count + len(candidate_positions)
+        self.stats.count('hull_searches_count', 1)
+
+        candidate_longitudes, candidate_latitudes = self.longitudes[candidate_positions], self.latitudes[candidate_positions]
+        perpendicular_longitudes, perpendicular_latitudes = perpendicular_points_on_line(
+            self.longitudes[start], self.latitudes[start], self.longitudes[end], self.latitudes[end], candidate_longitudes, candidate_latitudes)
+        bearing, back_azimuth, distances_m = inverse(
+            perpendicular_longitudes, perpendicular_latitudes, candidate_longitudes, candidate_latitudes, self.geodesy_method)
+        farthest_candidate = np.argmax(distances_m)
+
+        return candidate_positions[farthest_candidate], np.asarray(distances_m)[farthest_candidate]
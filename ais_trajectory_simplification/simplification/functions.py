@@ -0,0 +1,155 @@
+from functools import partial
+import numpy as np
+from ais_trajectory_simplification.geodesy.functions import GEODESIC, inverse
+
+
+def perpendicular_points_on_line(x1, y1, x2, y2, x3, y3):
+    # based on https://stackoverflow.com/questions/47177493/python-point-on-a-line-closest-to-third-point
+    # 1 and 2 are line points, 3 can be an array of points (and 1, 2 arrays of lines of the same length)
+    dx, dy = x2 - x1, y2 - y1
+    det = dx*dx + dy*dy
+    if np.ndim(det) > 0:
+        # degenerated lines, distance is measured to the start point
+        a = np.divide(dy*(y3 - y1) + dx*(x3 - x1), det, out=np.zeros(np.shape(det), dtype=np.float64), where=det != 0)
+    elif det == 0:
+        a = np.zeros_like(x3, dtype=np.float64)
+    else:
+        a = (dy*(y3 - y1) + dx*(x3 - x1)) / det
+    x = x1 + a*dx
+    y = np.clip(y1 + a*dy, -90, 90)
+    return x, y
+
+
+def perpendicular_distances_m(longitudes: np.ndarray, latitudes: np.ndarray, start: int, end: int, geodesy_method: str = GEODESIC) -> np.ndarray:
+    # distances of points between start and end (exclusive) from the start-end line
+    inner_longitudes = longitudes[start + 1:end]
+    inner_latitudes = latitudes[start + 1:end]
+    perpendicular_longitudes, perpendicular_latitudes = perpendicular_points_on_line(
+        longitudes[start], latitudes[start], longitudes[end], latitudes[end], inner_longitudes, inner_latitudes)
+    bearing, back_azimuth, distance_m = inverse(
+        perpendicular_longitudes, perpendicular_latitudes, inner_longitudes, inner_latitudes, geodesy_method)
+
+    return np.asarray(distance_m)
+
+
+def sed_points_on_line(x1, y1, x2, y2, ratio):
+    dx = (x2 - x1) * ratio
+    dy = (y2 - y1) * ratio
+
+    x = x1 + dx
+    y = y1 + dy
+    return x, y
+
+
+def sed_distances_m(longitudes: np.ndarray, latitudes: np.ndarray, timestamps_ns: np.ndarray, start: int, end: int, geodesy_method: str = GEODESIC) -> np.ndarray:
+    # synchronized euclidean distances of points between start and end (exclusive)
+    # from positions interpolated in time on the start-end line
+    inner_longitudes = longitudes[start + 1:end]
+    inner_latitudes = latitudes[start + 1:end]
+    ratio = (timestamps_ns[start + 1:end] - timestamps_ns[start]) / (timestamps_ns[end] - timestamps_ns[start])
+    sed_longitudes, sed_latitudes = sed_points_on_line(
+        longitudes[start], latitudes[start], longitudes[end], latitudes[end], ratio)
+    bearing, back_azimuth, distance_m = inverse(
+        sed_longitudes, sed_latitudes, inner_longitudes, inner_latitudes, geodesy_method)
+
+    return np.asarray(distance_m)
+
+
+def triangle_areas_m2(longitudes: np.ndarray, latitudes: np.ndarray, timestamps_ns: np.ndarray, prev_positions: np.ndarray,
+                      positions: np.ndarray, next_positions: np.ndarray, time_aware: bool = False, geodesy_method: str = GEODESIC) -> np.ndarray:
+    # areas of triangles prev-position-next as half of the prev-next distance times the distance of the position
+    # from the prev-next line, or with time_aware from the position interpolated in time on it (as in TDTR)
+    if time_aware:
+        ratios = (timestamps_ns[positions] - timestamps_ns[prev_positions]) / (timestamps_ns[next_positions] - timestamps_ns[prev_positions])
+        line_longitudes, line_latitudes = sed_points_on_line(
+            longitudes[prev_positions], latitudes[prev_positions], longitudes[next_positions], latitudes[next_positions], ratios)
+    else:
+        line_longitudes, line_latitudes = perpendicular_points_on_line(
+            longitudes[prev_positions], latitudes[prev_positions], longitudes[next_positions], latitudes[next_positions],
+            longitudes[positions], latitudes[positions])
+    # bases and heights in one call
+    bearing, back_azimuth, distances_m = inverse(
+        np.concatenate([longitudes[prev_positions], line_longitudes]),
+        np.concatenate([latitudes[prev_positions], line_latitudes]),
+        np.concatenate([longitudes[next_positions], longitudes[positions]]),
+        np.concatenate([latitudes[next_positions], latitudes[positions]]),
+        geodesy_method)
+    bases_m, heights_m = np.split(np.asarray(distances_m, dtype=np.float64), 2)
+
+    return bases_m * heights_m / 2
+
+
+def farthest_point(segment_distances_f, start: int, end: int) -> tuple:
+    distances_m = segment_distances_f(start, end)
+    farthest_position = np.argmax(distances_m)
+
+    return start + 1 + farthest_position, distances_m[farthest_position]
+
+
+def vessel_segments(points_count: int, offsets: np.ndarray = None) -> list:
+    # (first, last) positions of every non-empty vessel, reversed so that the split loop starts with the first one
+    offsets = np.array([0, points_count]) if offsets is None else np.asarray(offsets)
+    starts, ends = offsets[:-1], offsets[1:]
+    is_not_empty = ends > starts
+
+    return list(zip(starts[is_not_empty].tolist(), (ends[is_not_empty] - 1).tolist()))[::-1]
+
+
+def select_split_points(points_count: int, epsilon_m, segment_distances_f, farthest_point_f=None, offsets: np.ndarray = None) -> np.ndarray:
+    # Douglas-Peucker split loop working on array positions;
+    # segment_distances_f(start, end) returns distances of points start+1 ... end-1,
+    # farthest_point_f(start, end) can return (position, distance) of the farthest one instead;
+    # with offsets of vessels of a fleet trajectory every vessel is split separately
+    farthest_point_f = farthest_point_f if farthest_point_f is not None else partial(farthest_point, segment_distances_f)
+    keep_mask = np.zeros(points_count, dtype=bool)
+    segments = vessel_segments(points_count, offsets)
+    for start, end in segments:
+        keep_mask[[start, end]] = True
+
+    while segments:
+        start, end = segments.pop()
+        if end - start < 2:
+            continue
+        split, distance_m = farthest_point_f(start, end)
+        if distance_m > epsilon_m:
+            keep_mask[split] = True
+            segments.append((split, end))
+            segments.append((start, split))
+
+    return keep_mask
+
+
+def split_point_significances(points_count: int, segment_distances_f, farthest_point_f=None, offsets: np.ndarray = None) -> np.ndarray:
+    # Douglas-Peucker split loop run to the end; significance of a point is the smallest distance on
+    # the path of splits which selected it, so select_split_points(points_count, epsilon_m, f)
+    # keeps exactly the points with significance > epsilon_m for any epsilon_m >= 0
+    farthest_point_f = farthest_point_f if farthest_point_f is not None else partial(farthest_point, segment_distances_f)
+    significances = np.zeros(points_count, dtype=np.float64)
+    segments = []
+    for start, end in vessel_segments(points_count, offsets):
+        significances[[start, end]] = np.inf
+        segments.append((start, end, np.inf))
+
+    while segments:
+        start, end, parent_significance = segments.pop()
+        if end - start < 2:
+            continue
+        split, distance_m = farthest_point_f(start, end)
+        significance = min(parent_significance, distance_m)
+        significances[split] = significance
+        segments.append((split, end, significance))
+        segments.append((start, split, significance))
+
+    return significances
+
+
+def save_significances(path: str, index: np.ndarray, significances_m: np.ndarray):
+    np.savez(path, index=index, significances_m=significances_m)
+
+
+def load_significances(path: str, index: np.ndarray) -> np.ndarray:
+    with np.load(path, allow_pickle=False) as data:
+        if not np.array_equal(data['index'], index):
+            raise ValueError(f"Significances in {path} were calculated for different positions")
+        return data['significances_m']
+
@@ -1,56 +1,147 @@
 import pandas as pd
 import numpy as np
-from ais_trajectory_simplification.cleaning.functions import get_azimuths_and_distance, calculate_metrics, sort_and_reset_index
+from ais_trajectory_simplification.cleaning.functions import get_azimuths_and_distance, prepare_trajectory
+from ais_trajectory_simplification.fleet.functions import process_many
+from ais_trajectory_simplification.geodesy.functions import GEODESIC
+from ais_trajectory_simplification.stats.processing_stats import ProcessingStats, DISABLED_STATS
+from ais_trajectory_simplification.trajectory.trajectory_checkpoint import TrajectoryCheckpoint
+
+
+class OEPPWindow:
+    # running statistics of a growing O-EPP window, mirrors _is_stop and _is_bearing_straight
+    # of OEPPSimplificator (including the min/max semantics for nan values) in O(1) per point
+    def __init__(self, max_heading_deviation_deg, geodesy_method: str = GEODESIC):
+        self.max_heading_deviation_deg = max_heading_deviation_deg
+        self.geodesy_method = geodesy_method
+        self.geodesic_calls_count = 0
+
+    def reset(self, longitude, latitude, bearing, speed_kn):
+        self.min_longitude = self.max_longitude = longitude
+        self.min_latitude = self.max_latitude = latitude
+        self.min_bearing = self.max_bearing = bearing
+        self.min_speed_kn = self.max_speed_kn = speed_kn
+        # bearings used by the wrap-around around north
+        self.middle_bearings_count = 0
+        self.min_high_bearing = None
+        self.max_low_bearing = None
+        self.stop_distance_m = None
+        self._add_wrap_around_bearing(bearing)
+
+    def _add_wrap_around_bearing(self, bearing):
+        if (bearing <= 360 - self.max_heading_deviation_deg) and (bearing >= self.max_heading_deviation_deg):
+            self.middle_bearings_count = self.middle_bearings_count + 1
+        if bearing > 360 - self.max_heading_deviation_deg and (self.min_high_bearing is None or bearing < self.min_high_bearing):
+            self.min_high_bearing = bearing
+        if bearing < self.max_heading_deviation_deg and (self.max_low_bearing is None or bearing > self.max_low_bearing):
+            self.max_low_bearing = bearing
+
+    def extend(self, longitude, latitude, bearing, speed_kn):
+        if longitude < self.min_longitude:
+            self.min_longitude = longitude
+            self.stop_distance_m = None
+        if longitude > self.max_longitude:
+            self.max_longitude = longitude
+            self.stop_distance_m = None
+        if latitude < self.min_latitude:
+            self.min_latitude = latitude
+            self.stop_distance_m = None
+        if latitude > self.max_latitude:
+            self.max_latitude = latitude
+            self.stop_distance_m = None
+        if bearing < self.min_bearing:
+            self.min_bearing = bearing
+        if bearing > self.max_bearing:
+            self.max_bearing = bearing
+        if speed_kn < self.min_speed_kn:
+            self.min_speed_kn = speed_kn
+        if speed_kn > self.max_speed_kn:
+            self.max_speed_kn = speed_kn
+        self._add_wrap_around_bearing(bearing)
+
+    def is_stop(self, stop_max_distance_m):
+        if self.stop_distance_m is None:
+            self.geodesic_calls_count = self.geodesic_calls_count + 1
+            bearing, back_azimuth, self.stop_distance_m = get_azimuths_and_distance(
+                self.min_longitude, self.min_latitude, self.max_longitude, self.max_latitude, self.geodesy_method)
+
+        return self.stop_distance_m < stop_max_distance_m
+
+    def is_bearing_straight(self, max_heading_deviation_deg, max_speed_deviation_kn):
+        heading_min_deg = self.min_bearing
+        heading_max_deg = self.max_bearing
+
+        if (heading_min_deg - max_heading_deviation_deg) <= 0 and (heading_max_deg + max_heading_deviation_deg) >= 360:
+            if self.middle_bearings_count > 0:
+                return False
+            heading_min_deg = self.min_high_bearing - 360
+            heading_max_deg = self.max_low_bearing
+
+        heading_deviation_deg = heading_max_deg - heading_min_deg
+        proper_heading_deviation = heading_deviation_deg <= max_heading_deviation_deg
+
+        speed_range = self.max_speed_kn - self.min_speed_kn
+        proper_speed_limit = speed_range <= max_speed_deviation_kn
+        return proper_heading_deviation and proper_speed_limit
 
 
 class OEPPSimplificator:
-    def __init__(self, pdf: pd.DataFrame, speed_limit_multiplier: int = 2):
+    RECALCULATED_COLUMNS = [
+        'bearing_since_prev_pos_deg',
+        'distance_since_prev_pos_m',
+        'time_since_prev_pos_s',
+        'speed_since_prev_pos_kn',
+        'no_of_cleaned_positions_since_prev_pos',
+    ]
+    # metrics read or returned by the simplificator, the only ones calculated with lean_metrics
+    INPUT_METRIC_COLUMNS = [
+        'bearing_since_prev_pos_deg',
+        'distance_since_prev_pos_m',
+        'time_since_prev_pos_s',
+        'speed_since_prev_pos_kn',
+    ]
+
+    def __init__(self, pdf: pd.DataFrame, speed_limit_multiplier: int = 2, geodesy_method: str = GEODESIC, stats: ProcessingStats = None,
+                 checkpoint: TrajectoryCheckpoint = None, lean_metrics: bool = False, compact: bool = False):
         self.speed_service_multiplier = speed_limit_multiplier
+        self.geodesy_method = geodesy_method
+        self.stats = stats if stats is not None else DISABLED_STATS
+        # made by simplify_trajectory_part of the previous part of the trajectory
+        self.checkpoint = checkpoint
+        if checkpoint is not None:
+            pdf = checkpoint.prepend_to(pdf)
+        self.input_columns = list(pdf.columns) if isinstance(pdf, pd.DataFrame) else None
+
+        with self.stats.phase('prepare'):
+            self.trajectory = prepare_trajectory(
+                pdf, self.geodesy_method, metric_columns=self.INPUT_METRIC_COLUMNS if lean_metrics else None, compact=compact)
+            self.trajectory.set_column('no_of_cleaned_positions_since_prev_pos', np.zeros(len(self.trajectory), dtype=np.int64))
+        self.stats.count('input_points_count', len(self.trajectory))
 
-        self.pdf = sort_and_reset_index(pdf)
-        self.pdf = calculate_metrics(self.pdf)
-        self.pdf['no_of_cleaned_positions_since_prev_pos'] = 0
-
-        self.index_column_name = self.pdf.index.name
-        self.pdf = self.pdf.reset_index()
-        self.index_loc = self.pdf.columns.get_loc(self.index_column_name)
-        self.latitude_loc = self.pdf.columns.get_loc('latitude')
-        self.longitude_loc = self.pdf.columns.get_loc('longitude')
-        self.prev_pos_latitude_loc = self.pdf.columns.get_loc(
-            'prev_pos_latitude')
-        self.prev_pos_longitude_loc = self.pdf.columns.get_loc(
-            'prev_pos_longitude')
-        self.position_timestamp_loc = self.pdf.columns.get_loc(
-            'position_timestamp')
-        self.prev_pos_position_timestamp_loc = self.pdf.columns.get_loc(
-            'prev_pos_position_timestamp')
-        self.speed_reference_kn_loc = self.pdf.columns.get_loc(
-            'speed_reference_kn')
-        self.time_since_prev_pos_s_loc = self.pdf.columns.get_loc(
-            'time_since_prev_pos_s')
-        self.distance_since_prev_pos_m_loc = self.pdf.columns.get_loc(
-            'distance_since_prev_pos_m')
-        self.speed_since_prev_pos_kn_loc = self.pdf.columns.get_loc(
-            'speed_since_prev_pos_kn')
-        self.prev_speed_since_prev_pos_kn_loc = self.pdf.columns.get_loc(
-            'prev_speed_since_prev_pos_kn')
-        self.acceleration_kn_s_loc = self.pdf.columns.get_loc(
-            'acceleration_kn_s')
-        self.bearing_since_prev_pos_deg_loc = self.pdf.columns.get_loc(
-            'bearing_since_prev_pos_deg')
-        self.no_of_cleaned_positions_since_prev_pos_loc = self.pdf.columns.get_loc(
-            'no_of_cleaned_positions_since_prev_pos')
-
-    def _is_stop(self, pdf, stop_max_distance_m):
+        self.indexes = self.trajectory.index
+        self.longitudes = self.trajectory.longitudes
+        self.latitudes = self.trajectory.latitudes
+        self.bearings = self.trajectory.float_column('bearing_since_prev_pos_deg')
+        self.speeds_kn = self.trajectory.float_column('speed_since_prev_pos_kn')
+
+    def _checkpoint_parameters(self, stop_max_distance_m, max_heading_deviation_deg, max_speed_deviation_kn) -> dict:
+        return {
+            'speed_limit_multiplier': self.speed_service_multiplier,
+            'geodesy_method': self.geodesy_method,
+            'stop_max_distance_m': stop_max_distance_m,
+            'max_heading_deviation_deg': max_heading_deviation_deg,
+            'max_speed_deviation_kn': max_speed_deviation_kn,
+        }
+
+    def _is_stop(self, start: int, end: int, stop_max_distance_m):
         bearing, back_azimuth, distance_m = get_azimuths_and_distance(
-            min(pdf[:, self.longitude_loc]), min(pdf[:, self.latitude_loc]), max(
-                pdf[:, self.longitude_loc]), max(pdf[:, self.latitude_loc])
+            min(self.longitudes[start:end]), min(self.latitudes[start:end]), max(
+                self.longitudes[start:end]), max(self.latitudes[start:end]), self.geodesy_method
         )
 
         return distance_m < stop_max_distance_m
 
-    def _is_bearing_straight(self, pdf_arr, max_heading_deviation_deg, max_speed_deviation_kn):
-        bearing_arr = pdf_arr[:, self.bearing_since_prev_pos_deg_loc]
+    def _is_bearing_straight(self, start: int, end: int, max_heading_deviation_deg, max_speed_deviation_kn):
+        bearing_arr = self.bearings[start:end]
         heading_min_deg = min(bearing_arr)
         heading_max_deg = max(bearing_arr)
 
@@ -65,68 +156,166 @@ class OEPPSimplificator:
         heading_deviation_deg = heading_max_deg - heading_min_deg
         proper_heading_deviation = heading_deviation_deg <= max_heading_deviation_deg
 
-        speed_range = max(pdf_arr[:, self.speed_since_prev_pos_kn_loc]
-                          ) - min(pdf_arr[:, self.speed_since_prev_pos_kn_loc])
+        speed_range = max(self.speeds_kn[start:end]) - min(self.speeds_kn[start:end])
         proper_speed_limit = speed_range <= max_speed_deviation_kn
         return proper_heading_deviation and proper_speed_limit
 
-    def _calculate_from_new_previous_position(self, position, prev_position):
-        position[self.bearing_since_prev_pos_deg_loc], back_azimuth, position[self.distance_since_prev_pos_m_loc] = get_azimuths_and_distance(
-            prev_position[self.longitude_loc], prev_position[self.latitude_loc], position[self.longitude_loc], position[self.latitude_loc])
-        if position[self.bearing_since_prev_pos_deg_loc] < 0:
-            position[self.bearing_since_prev_pos_deg_loc] + 360
+    def _calculate_from_new_previous_position(self, position: int, prev_position: int):
+        bearing, back_azimuth, distance_m = get_azimuths_and_distance(
+            self.longitudes[prev_position], self.latitudes[prev_position], self.longitudes[position], self.latitudes[position],
+            self.geodesy_method)
+        time_s = self.trajectory.seconds_between(prev_position, position)
+        speed_kn = (distance_m / time_s) * (3600 / 1852)
+        no_of_cleaned_positions = self.indexes[position] - self.indexes[prev_position] - 1
 
-        position[self.time_since_prev_pos_s_loc] = (
-            position[self.position_timestamp_loc] - prev_position[self.position_timestamp_loc]) / np.timedelta64(1, 's')
-        position[self.speed_since_prev_pos_kn_loc] = (
-            position[self.distance_since_prev_pos_m_loc] / position[self.time_since_prev_pos_s_loc]) * (3600 / 1852)
+        return bearing, distance_m, time_s, speed_kn, no_of_cleaned_positions
 
-        position[self.no_of_cleaned_positions_since_prev_pos_loc] = position[self.index_loc] - \
-            prev_position[self.index_loc] - 1
+    def _reset_window(self, window: OEPPWindow, segment_start: int, bearing, speed_kn):
+        window.reset(self.longitudes[segment_start], self.latitudes[segment_start], bearing, speed_kn)
 
-        return position
+        return segment_start + 1
 
-    def simplify_trajectory(self, stop_max_distance_m, max_heading_deviation_deg, max_speed_deviation_kn):
-        pdf_arr = self.pdf.to_numpy()
+    def _select_points(self, stop_max_distance_m, max_heading_deviation_deg, max_speed_deviation_kn, segment_start: int = 0,
+                       recalculated_positions: dict = None, is_last: bool = True):
+        # with is_last=False a window reaching the last point is left open, returns also the start
+        # of the open window, points up to it are decided; vessels of a fleet trajectory are simplified
+        # one after another, segment_start is of the first one
+        keep_mask = np.ones(len(self.longitudes), dtype=bool)
+        recalculated_positions = dict(recalculated_positions or {})
+        if len(self.longitudes) == 0:
+            return keep_mask, recalculated_positions, segment_start
+
+        window = OEPPWindow(max_heading_deviation_deg, self.geodesy_method)
         min_segment_size = 4
-        i = min_segment_size
-        segment_start = 0
-        iterator_end = len(pdf_arr)
-        while segment_start + i <= iterator_end:
-            segment_pdf = pdf_arr[segment_start:segment_start+i]
-            is_stop = self._is_stop(segment_pdf, stop_max_distance_m)
-            is_bearing_straight = self._is_bearing_straight(
-                segment_pdf, max_heading_deviation_deg, max_speed_deviation_kn)
-
-            if ((not is_stop) and (not is_bearing_straight)) or (segment_start + i) == iterator_end:
-                if i > min_segment_size:
-                    pdf_arr = np.delete(pdf_arr, np.s_[segment_start+1:segment_start+i-2], axis=0)
-                    pdf_arr[segment_start+1] = self._calculate_from_new_previous_position(pdf_arr[segment_start+1], pdf_arr[segment_start])
-                    segment_start = segment_start + 1
-                    iterator_end = len(pdf_arr)
+        windows_count = 0
+        segments_count = 0
+        offsets = self.trajectory.vessel_offsets()
+        for vessel_start, iterator_end in zip(offsets[:-1].tolist(), offsets[1:].tolist()):
+            if vessel_start == iterator_end:
+                continue
+            if vessel_start > 0:
+                segment_start = vessel_start
+            i = min_segment_size
+            # points after segment_start are never modified, so the window only has to
+            # remember the (possibly recalculated) bearing and speed of its first point
+            if segment_start in recalculated_positions:
+                bearing, distance_m, time_s, speed_kn, no_of_cleaned_positions = recalculated_positions[segment_start]
+            else:
+                bearing, speed_kn = self.bearings[segment_start], self.speeds_kn[segment_start]
+            window_end = self._reset_window(window, segment_start, bearing, speed_kn)
+            while segment_start + i <= iterator_end:
+                windows_count = windows_count + 1
+                while window_end < segment_start + i:
+                    window.extend(self.longitudes[window_end], self.latitudes[window_end],
+                                  self.bearings[window_end], self.speeds_kn[window_end])
+                    window_end = window_end + 1
+                is_bearing_straight = window.is_bearing_straight(max_heading_deviation_deg, max_speed_deviation_kn)
+                is_stop = (not is_bearing_straight) and window.is_stop(stop_max_distance_m)
+                if (not is_last) and (segment_start + i) == iterator_end and (is_stop or is_bearing_straight):
+                    break
+
+                if ((not is_stop) and (not is_bearing_straight)) or (segment_start + i) == iterator_end:
+                    segments_count = segments_count + 1
+                    if i > min_segment_size:
+                        keep_mask[segment_start+1:segment_start+i-2] = False
+                        new_segment_start = segment_start + i - 2
+                        recalculated_positions[new_segment_start] = self._calculate_from_new_previous_position(
+                            new_segment_start, segment_start)
+                        segment_start = new_segment_start
+                        bearing, distance_m, time_s, speed_kn, no_of_cleaned_positions = recalculated_positions[segment_start]
+                    else:
+                        segment_start = segment_start + 1
+                        bearing, speed_kn = self.bearings[segment_start], self.speeds_kn[segment_start]
                     i = min_segment_size
+                    window_end = self._reset_window(window, segment_start, bearing, speed_kn)
                 else:
-                    segment_start = segment_start + 1
-                    i = min_segment_size
-            else:
-                i = i + 1
-
-        clean_pdf_arr = pdf_arr
-        result_pdf = pd.DataFrame(clean_pdf_arr, columns=self.pdf.columns).astype(
-            self.pdf.dtypes.to_dict())
-        result_pdf = result_pdf.drop(
-            result_pdf.columns[
-                [
-                    self.prev_pos_latitude_loc,
-                    self.prev_pos_longitude_loc,
-                    self.prev_pos_position_timestamp_loc,
-                    self.prev_speed_since_prev_pos_kn_loc,
-                    self.acceleration_kn_s_loc,
-                    self.bearing_since_prev_pos_deg_loc,
-                ]
-            ],
-            axis=1
-        )
-        result_pdf = result_pdf.set_index(self.index_column_name)
+                    i = i + 1
+        self.stats.count('windows_count', windows_count)
+        self.stats.count('segments_count', segments_count)
+        self.stats.count('geodesic_calls_count', window.geodesic_calls_count + len(recalculated_positions))
+
+        return keep_mask, recalculated_positions, segment_start
+
+    def _result_trajectory(self, keep_mask, recalculated_positions):
+        result = self.trajectory.take(keep_mask, recalculated_positions, self.RECALCULATED_COLUMNS)
+        result.drop([
+            'prev_pos_latitude',
+            'prev_pos_longitude',
+            'prev_pos_position_timestamp',
+            'prev_speed_since_prev_pos_kn',
+            'acceleration_kn_s',
+            'bearing_since_prev_pos_deg',
+        ])
+
+        return result
+
+    def simplify_trajectory(self, stop_max_distance_m, max_heading_deviation_deg, max_speed_deviation_kn, return_mask: bool = False, return_trajectory: bool = False):
+        with self.stats.phase('select'):
+            keep_mask, recalculated_positions, segment_start = self._select_points(
+                stop_max_distance_m, max_heading_deviation_deg, max_speed_deviation_kn)
+        self.stats.count_selection(keep_mask)
+        if return_mask:
+            self.stats.emit()
+            return keep_mask
+
+        with self.stats.phase('build_result'):
+            result = self._result_trajectory(keep_mask, recalculated_positions)
+            result = result if return_trajectory else result.to_pdf()
+        self.stats.count('array_copies_count', len(result.columns) + 1)
+        self.stats.emit()
+
+        return result
+
+    @classmethod
+    def simplify_many(cls, pdf, offsets: np.ndarray = None, group_column: str = 'mmsi', init_kwargs: dict = None, return_mask: bool = False,
+                      **method_kwargs):
+        # all vessels of a fleet frame sorted by group_column and time at once, see fleet.functions.process_many
+        return process_many(cls, 'simplify_trajectory', pdf, offsets, group_column, init_kwargs, return_mask, **method_kwargs)
+
+    def simplify_trajectory_part(self, stop_max_distance_m, max_heading_deviation_deg, max_speed_deviation_kn, is_last: bool = False):
+        # simplifies a trajectory part by part, e.g. one day at a time, and returns (result, checkpoint);
+        # points of the window left open at the end of the part are not returned, the simplificator of the
+        # next part gets them from the checkpoint, so concatenated results are the same as of simplify_trajectory
+        if self.input_columns is None:
+            raise ValueError("Only DataFrames can be simplified in parts")
+        parameters = self._checkpoint_parameters(stop_max_distance_m, max_heading_deviation_deg, max_speed_deviation_kn)
+        if self.checkpoint is None:
+            segment_start, recalculated_positions = 0, {}
+            output_start = 0
+        else:
+            self.checkpoint.check(type(self).__name__, parameters)
+            segment_start = self.checkpoint.state['segment_start']
+            recalculated_positions = {
+                int(recalculated_position): tuple(values)
+                for recalculated_position, values in self.checkpoint.state['recalculated_positions'].items()
+            }
+            output_start = segment_start + 1
+
+        with self.stats.phase('select'):
+            keep_mask, recalculated_positions, segment_start = self._select_points(
+                stop_max_distance_m, max_heading_deviation_deg, max_speed_deviation_kn, segment_start, recalculated_positions, is_last)
+        output_mask = keep_mask.copy()
+        output_mask[:output_start] = False
+        if not is_last:
+            output_mask[segment_start + 1:] = False
+        self.stats.count_selection(output_mask)
+
+        with self.stats.phase('build_result'):
+            result = self._result_trajectory(output_mask, recalculated_positions).to_pdf()
+            checkpoint = None
+            if not is_last and len(keep_mask) > 0:
+                # the previous point of the window start is needed for its metrics
+                checkpoint_start = max(segment_start - 1, 0)
+                checkpoint_mask = np.zeros(len(keep_mask), dtype=bool)
+                checkpoint_mask[checkpoint_start:] = True
+                checkpoint = TrajectoryCheckpoint(type(self).__name__, parameters,
+                    self.trajectory.take(checkpoint_mask).to_pdf()[self.input_columns], {
+                        'segment_start': int(segment_start - checkpoint_start),
+                        'recalculated_positions': {
+                            int(recalculated_position - checkpoint_start): [value.item() if hasattr(value, 'item') else value for value in recalculated_positions[recalculated_position]]
+                            for recalculated_position in [segment_start] if recalculated_position in recalculated_positions
+                        },
+                    })
+        self.stats.emit()
 
-        return result_pdf
+        return result, checkpoint
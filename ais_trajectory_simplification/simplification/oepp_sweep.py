@@ -0,0 +1,131 @@
+import bisect
+import heapq
+import itertools
+import time
+import numpy as np
+import pandas as pd
+from ais_trajectory_simplification.cleaning.functions import get_azimuths_and_distance
+from ais_trajectory_simplification.geodesy.functions import GEODESIC
+from ais_trajectory_simplification.simplification.oepp_simplificator import OEPPSimplificator, OEPPWindow
+
+
+class OEPPSweep:
+    # evaluates OEPPSimplificator.simplify_trajectory for a grid of parameters on one prepared trajectory;
+    # all stop distances with the same heading and speed limits are evaluated in one pass: they share
+    # windows until a stop test closes the window only for the stricter ones (a looser stop distance can
+    # only extend a window) and are merged again when they reach the same segment start;
+    # diagonals of window bounding boxes and recalculated segment starts are shared by all combinations
+    MIN_SEGMENT_SIZE = 4
+    # previous segment start of segment starts which were not recalculated
+    NOT_RECALCULATED = -1
+
+    def __init__(self, pdf: pd.DataFrame, speed_limit_multiplier: int = 2, geodesy_method: str = GEODESIC):
+        self.geodesy_method = geodesy_method
+        self.simplificator = OEPPSimplificator(pdf, speed_limit_multiplier, geodesy_method)
+        self.points_count = len(self.simplificator.longitudes)
+        # bounding box -> its diagonal
+        self.stop_distances_m = {}
+        # (segment start, previous segment start) -> _calculate_from_new_previous_position result
+        self.recalculated_positions = {}
+
+    def _stop_distance_m(self, window: OEPPWindow):
+        if window.stop_distance_m is None:
+            bounding_box = (window.min_longitude, window.min_latitude, window.max_longitude, window.max_latitude)
+            if bounding_box not in self.stop_distances_m:
+                bearing, back_azimuth, self.stop_distances_m[bounding_box] = get_azimuths_and_distance(*bounding_box, self.geodesy_method)
+            window.stop_distance_m = self.stop_distances_m[bounding_box]
+
+        return window.stop_distance_m
+
+    def _recalculated_position(self, segment_start: int, prev_segment_start: int) -> tuple:
+        key = (segment_start, prev_segment_start)
+        if key not in self.recalculated_positions:
+            self.recalculated_positions[key] = self.simplificator._calculate_from_new_previous_position(segment_start, prev_segment_start)
+
+        return self.recalculated_positions[key]
+
+    def _select_points(self, stop_max_distances_m: list, max_heading_deviation_deg, max_speed_deviation_kn) -> dict:
+        # the same points as OEPPSimplificator._select_points for every stop distance,
+        # returns stop distance -> (keep_mask, recalculated_positions)
+        simplificator = self.simplificator
+        stop_max_distances_m = sorted(set(stop_max_distances_m))
+        results = {
+            stop_max_distance_m: (np.ones(self.points_count, dtype=bool), {}) for stop_max_distance_m in stop_max_distances_m
+        }
+        if self.points_count == 0:
+            return results
+
+        window = OEPPWindow(max_heading_deviation_deg, self.geodesy_method)
+        # segment starts are processed in order, so all stop distances reaching one are merged before it is processed
+        segment_starts = [(0, self.NOT_RECALCULATED)]
+        waiting_stop_distances_m = {(0, self.NOT_RECALCULATED): stop_max_distances_m}
+        while segment_starts:
+            segment_start, prev_segment_start = heapq.heappop(segment_starts)
+            active_stop_distances_m = sorted(waiting_stop_distances_m.pop((segment_start, prev_segment_start)))
+            if segment_start + self.MIN_SEGMENT_SIZE > self.points_count:
+                continue
+
+            if prev_segment_start == self.NOT_RECALCULATED:
+                bearing, speed_kn = simplificator.bearings[segment_start], simplificator.speeds_kn[segment_start]
+            else:
+                bearing, distance_m, time_s, speed_kn, no_of_cleaned_positions = self._recalculated_position(segment_start, prev_segment_start)
+            window_end = simplificator._reset_window(window, segment_start, bearing, speed_kn)
+
+            i = self.MIN_SEGMENT_SIZE
+            while active_stop_distances_m:
+                while window_end < segment_start + i:
+                    window.extend(simplificator.longitudes[window_end], simplificator.latitudes[window_end],
+                                  simplificator.bearings[window_end], simplificator.speeds_kn[window_end])
+                    window_end = window_end + 1
+
+                if (segment_start + i) == self.points_count:
+                    closed_stop_distances_m, active_stop_distances_m = active_stop_distances_m, []
+                elif window.is_bearing_straight(max_heading_deviation_deg, max_speed_deviation_kn):
+                    closed_stop_distances_m = []
+                else:
+                    # windows are stops only for stop distances greater than the diagonal
+                    split = bisect.bisect_right(active_stop_distances_m, self._stop_distance_m(window))
+                    closed_stop_distances_m, active_stop_distances_m = active_stop_distances_m[:split], active_stop_distances_m[split:]
+
+                if closed_stop_distances_m:
+                    if i > self.MIN_SEGMENT_SIZE:
+                        new_segment_start = segment_start + i - 2
+                        next_key = (new_segment_start, segment_start)
+                        recalculated_position = self._recalculated_position(new_segment_start, segment_start)
+                        for stop_max_distance_m in closed_stop_distances_m:
+                            keep_mask, recalculated_positions = results[stop_max_distance_m]
+                            keep_mask[segment_start+1:segment_start+i-2] = False
+                            recalculated_positions[new_segment_start] = recalculated_position
+                    else:
+                        next_key = (segment_start + 1, self.NOT_RECALCULATED)
+                    if next_key not in waiting_stop_distances_m:
+                        waiting_stop_distances_m[next_key] = []
+                        heapq.heappush(segment_starts, next_key)
+                    waiting_stop_distances_m[next_key].extend(closed_stop_distances_m)
+                i = i + 1
+
+        return results
+
+    def sweep(self, stop_max_distances_m: list, max_heading_deviations_deg: list, max_speed_deviations_kn: list, with_results: bool = False) -> pd.DataFrame:
+        # one row per combination, with simplified DataFrames in result if with_results;
+        # runtime_s is the time of the pass shared by all stop distances with the same heading and speed limits
+        records = []
+        for max_heading_deviation_deg, max_speed_deviation_kn in itertools.product(max_heading_deviations_deg, max_speed_deviations_kn):
+            start_time = time.perf_counter()
+            results = self._select_points(stop_max_distances_m, max_heading_deviation_deg, max_speed_deviation_kn)
+            runtime_s = time.perf_counter() - start_time
+            for stop_max_distance_m in stop_max_distances_m:
+                keep_mask, recalculated_positions = results[stop_max_distance_m]
+                record = {
+                    'stop_max_distance_m': stop_max_distance_m,
+                    'max_heading_deviation_deg': max_heading_deviation_deg,
+                    'max_speed_deviation_kn': max_speed_deviation_kn,
+                    'input_points_count': self.points_count,
+                    'points_count': int(keep_mask.sum()),
+                    'runtime_s': runtime_s,
+                }
+                if with_results:
+                    record['result'] = self.simplificator._result_trajectory(keep_mask, recalculated_positions).to_pdf()
+                records.append(record)
+
+        return pd.DataFrame(records)
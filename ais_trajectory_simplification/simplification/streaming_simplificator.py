@@ -0,0 +1,271 @@
+import numpy as np
+import pandas as pd
+from ais_trajectory_simplification.geodesy.functions import GEODESIC, inverse
+from ais_trajectory_simplification.simplification.functions import perpendicular_distances_m, sed_distances_m
+from ais_trajectory_simplification.simplification.oepp_simplificator import OEPPWindow
+
+
+class StreamPosition:
+    __slots__ = ['row', 'index', 'longitude', 'latitude', 'timestamp_ns',
+                 'bearing', 'distance_m', 'time_s', 'speed_kn', 'no_of_cleaned_positions']
+
+    def __init__(self, row: dict, index, longitude: float, latitude: float, timestamp_ns: int):
+        self.row = row
+        self.index = index
+        self.longitude = longitude
+        self.latitude = latitude
+        self.timestamp_ns = timestamp_ns
+        self.bearing = np.nan
+        self.distance_m = np.nan
+        self.time_s = np.nan
+        self.speed_kn = np.nan
+        self.no_of_cleaned_positions = 0
+
+    def calculate_from_previous_position(self, prev_position, geodesy_method: str = GEODESIC):
+        bearing, back_azimuth, distance_m = inverse(
+            prev_position.longitude, prev_position.latitude, self.longitude, self.latitude, geodesy_method)
+        time_s = (self.timestamp_ns - prev_position.timestamp_ns) / 1e9
+        speed_kn = (distance_m / time_s) * (3600 / 1852)
+        no_of_cleaned_positions = self.index - prev_position.index - 1
+
+        return bearing, distance_m, time_s, speed_kn, no_of_cleaned_positions
+
+    def to_record(self) -> dict:
+        record = dict(self.row)
+        record['distance_since_prev_pos_m'] = self.distance_m
+        record['time_since_prev_pos_s'] = self.time_s
+        record['speed_since_prev_pos_kn'] = self.speed_kn
+        record['no_of_cleaned_positions_since_prev_pos'] = self.no_of_cleaned_positions
+        return record
+
+
+class OpeningWindowVesselSimplificator:
+    # opening window variant of Douglas-Peucker (or TDTR if time_aware): the window grows from the
+    # last committed anchor until a buffered position is farther than epsilon_m from the line between
+    # the anchor and the newest position, then the position before the newest one is committed;
+    # the window is also closed when it holds max_buffer_size positions
+    def __init__(self, epsilon_m, time_aware: bool = False, max_buffer_size: int = 1000, geodesy_method: str = GEODESIC):
+        self.epsilon_m = epsilon_m
+        self.time_aware = time_aware
+        self.max_buffer_size = max_buffer_size
+        self.geodesy_method = geodesy_method
+
+        self.anchor = None
+        self.positions = []
+
+    def _commit(self, position: StreamPosition) -> StreamPosition:
+        if self.anchor is not None:
+            position.bearing, position.distance_m, position.time_s, position.speed_kn, position.no_of_cleaned_positions = (
+                position.calculate_from_previous_position(self.anchor, self.geodesy_method))
+        self.anchor = position
+        return position
+
+    def _max_distance_m(self) -> float:
+        window = [self.anchor] + self.positions
+        longitudes = np.array([position.longitude for position in window], dtype=np.float64)
+        latitudes = np.array([position.latitude for position in window], dtype=np.float64)
+        if self.time_aware:
+            timestamps_ns = np.array([position.timestamp_ns for position in window], dtype=np.int64)
+            distances_m = sed_distances_m(longitudes, latitudes, timestamps_ns, 0, len(window) - 1, self.geodesy_method)
+        else:
+            distances_m = perpendicular_distances_m(longitudes, latitudes, 0, len(window) - 1, self.geodesy_method)
+
+        return distances_m.max()
+
+    def add(self, position: StreamPosition) -> list:
+        if self.anchor is None:
+            return [self._commit(position)]
+
+        self.positions.append(position)
+        if len(self.positions) < 2:
+            return []
+
+        if len(self.positions) > self.max_buffer_size or self._max_distance_m() > self.epsilon_m:
+            committed_position = self._commit(self.positions[-2])
+            self.positions = self.positions[-1:]
+            return [committed_position]
+
+        return []
+
+    def flush(self) -> list:
+        committed_positions = [self._commit(position) for position in self.positions[-1:]]
+        self.positions = []
+        return committed_positions
+
+
+class OEPPVesselSimplificator:
+    # the same windows as OEPPSimplificator.simplify_trajectory evaluated as positions arrive,
+    # committed positions are identical to the batch result; positions which will be removed
+    # for sure are dropped right away, so only a few positions are kept in memory
+    MIN_SEGMENT_SIZE = 4
+
+    def __init__(self, stop_max_distance_m, max_heading_deviation_deg, max_speed_deviation_kn, geodesy_method: str = GEODESIC):
+        self.stop_max_distance_m = stop_max_distance_m
+        self.max_heading_deviation_deg = max_heading_deviation_deg
+        self.max_speed_deviation_kn = max_speed_deviation_kn
+        self.geodesy_method = geodesy_method
+
+        self.window = OEPPWindow(max_heading_deviation_deg, geodesy_method)
+        self.last_position = None
+        # positions[0] is the segment start, positions 1 ... dropped_count after it are removed for sure
+        self.positions = []
+        self.dropped_count = 0
+        self.window_size = 0
+        self.i = self.MIN_SEGMENT_SIZE
+
+    def _available_count(self) -> int:
+        return len(self.positions) + self.dropped_count
+
+    def _position(self, window_position: int) -> StreamPosition:
+        if window_position == 0:
+            return self.positions[0]
+        return self.positions[window_position - self.dropped_count]
+
+    def _start_segment(self, position: StreamPosition, remaining_positions: list):
+        self.positions = [position] + remaining_positions
+        self.dropped_count = 0
+        self.i = self.MIN_SEGMENT_SIZE
+        self.window.reset(position.longitude, position.latitude, position.bearing, position.speed_kn)
+        self.window_size = 1
+
+    def _close_segment(self, segment_size: int) -> StreamPosition:
+        segment_start = self.positions[0]
+        if segment_size > self.MIN_SEGMENT_SIZE:
+            new_segment_start = self._position(segment_size - 2)
+            remaining_positions = self.positions[segment_size - 2 - self.dropped_count + 1:]
+            # bearing is not converted to 0 - 360 like in OEPPSimplificator
+            (new_segment_start.bearing, new_segment_start.distance_m, new_segment_start.time_s,
+             new_segment_start.speed_kn, new_segment_start.no_of_cleaned_positions) = (
+                new_segment_start.calculate_from_previous_position(segment_start, self.geodesy_method))
+        else:
+            new_segment_start = self.positions[1]
+            remaining_positions = self.positions[2:]
+        self._start_segment(new_segment_start, remaining_positions)
+
+        return new_segment_start
+
+    def add(self, position: StreamPosition) -> list:
+        if self.last_position is not None:
+            position.bearing, position.distance_m, position.time_s, position.speed_kn, no_of_cleaned_positions = (
+                position.calculate_from_previous_position(self.last_position, self.geodesy_method))
+            if position.bearing < 0:
+                position.bearing = position.bearing + 360
+        self.last_position = position
+
+        if not self.positions:
+            self._start_segment(position, [])
+            return [position]
+
+        self.positions.append(position)
+        committed_positions = []
+        while self._available_count() >= self.i:
+            while self.window_size < self.i:
+                window_position = self._position(self.window_size)
+                self.window.extend(window_position.longitude, window_position.latitude,
+                                   window_position.bearing, window_position.speed_kn)
+                self.window_size = self.window_size + 1
+            is_bearing_straight = self.window.is_bearing_straight(self.max_heading_deviation_deg, self.max_speed_deviation_kn)
+            is_stop = (not is_bearing_straight) and self.window.is_stop(self.stop_max_distance_m)
+
+            if (not is_stop) and (not is_bearing_straight):
+                committed_positions.append(self._close_segment(self.i))
+            else:
+                self.i = self.i + 1
+                # once a window longer than the minimal one passed, positions 1 ... i-4
+                # are removed whenever this window is closed
+                newly_dropped_count = (self.i - self.MIN_SEGMENT_SIZE if self.i > self.MIN_SEGMENT_SIZE + 1 else 0) - self.dropped_count
+                if newly_dropped_count > 0:
+                    del self.positions[1:1 + newly_dropped_count]
+                    self.dropped_count = self.dropped_count + newly_dropped_count
+
+        return committed_positions
+
+    def flush(self) -> list:
+        committed_positions = []
+        if not self.positions:
+            return committed_positions
+
+        # the batch algorithm closes the last window when it reaches the end of the trajectory
+        available_count = self._available_count()
+        if available_count >= self.MIN_SEGMENT_SIZE and self.i == available_count + 1:
+            committed_positions.append(self._close_segment(available_count))
+        committed_positions.extend(self.positions[1:])
+        self.positions = []
+
+        return committed_positions
+
+
+class StreamingSimplificator:
+    ALGORITHMS = ['dp', 'tdtr', 'oepp']
+
+    def __init__(self, algorithm: str, group_column: str = 'mmsi', sort_col: str = 'position_timestamp',
+                 max_points_per_vessel: int = 1000, geodesy_method: str = GEODESIC, **params):
+        # params are epsilon_m for dp and tdtr, or stop_max_distance_m, max_heading_deviation_deg
+        # and max_speed_deviation_kn for oepp
+        if algorithm not in self.ALGORITHMS:
+            raise ValueError(f"Unknown algorithm '{algorithm}', use one of {self.ALGORITHMS}")
+        self.algorithm = algorithm
+        self.group_column = group_column
+        self.sort_col = sort_col
+        self.max_points_per_vessel = max_points_per_vessel
+        self.geodesy_method = geodesy_method
+        self.params = params
+
+        self.index_name = None
+        self.vessels = {}
+        self.last_timestamps_ns = {}
+
+    def _create_vessel_simplificator(self):
+        if self.algorithm == 'oepp':
+            return OEPPVesselSimplificator(geodesy_method=self.geodesy_method, **self.params)
+
+        return OpeningWindowVesselSimplificator(
+            time_aware=self.algorithm == 'tdtr', max_buffer_size=self.max_points_per_vessel,
+            geodesy_method=self.geodesy_method, **self.params)
+
+    def push_position(self, row: dict, index) -> list:
+        group_value = row[self.group_column]
+        vessel = self.vessels.get(group_value)
+        if vessel is None:
+            vessel = self.vessels[group_value] = self._create_vessel_simplificator()
+
+        timestamp = pd.Timestamp(row[self.sort_col])
+        row[self.sort_col] = timestamp
+        position = StreamPosition(row, index, row['longitude'], row['latitude'], timestamp.value)
+        # positions have to come in time order, repeated timestamps are skipped like in sort_and_reset_index
+        if position.timestamp_ns <= self.last_timestamps_ns.get(group_value, np.iinfo(np.int64).min):
+            return []
+        self.last_timestamps_ns[group_value] = position.timestamp_ns
+
+        return vessel.add(position)
+
+    def _to_pdf(self, positions: list) -> pd.DataFrame:
+        result_pdf = pd.DataFrame(
+            [position.to_record() for position in positions],
+            index=pd.Index([position.index for position in positions], name=self.index_name))
+        return result_pdf
+
+    def push(self, pdf: pd.DataFrame) -> pd.DataFrame:
+        # positions of one or many vessels, returns positions which became final
+        self.index_name = 'index' if pdf.index.name is None else pdf.index.name
+        pdf = pdf.copy()
+        pdf[self.sort_col] = pd.to_datetime(pdf[self.sort_col])
+        pdf = pdf.sort_values(self.sort_col, kind='stable')
+
+        committed_positions = []
+        for index, row in zip(pdf.index, pdf.to_dict('records')):
+            committed_positions.extend(self.push_position(row, index))
+
+        return self._to_pdf(committed_positions)
+
+    def flush(self, group_value=None) -> pd.DataFrame:
+        # ends trajectories of one or all vessels and returns their remaining positions
+        group_values = list(self.vessels) if group_value is None else [group_value]
+        committed_positions = []
+        for value in group_values:
+            vessel = self.vessels.pop(value, None)
+            self.last_timestamps_ns.pop(value, None)
+            if vessel is not None:
+                committed_positions.extend(vessel.flush())
+
+        return self._to_pdf(committed_positions)
@@ -0,0 +1,147 @@
+import heapq
+import pandas as pd
+import numpy as np
+from ais_trajectory_simplification.cleaning.functions import prepare_trajectory
+from ais_trajectory_simplification.fleet.functions import process_many
+from ais_trajectory_simplification.geodesy.functions import GEODESIC
+from ais_trajectory_simplification.stats.processing_stats import ProcessingStats, DISABLED_STATS
+from ais_trajectory_simplification.trajectory.trajectory import Trajectory
+from ais_trajectory_simplification.simplification.functions import triangle_areas_m2
+
+
+class VWSimplificator:
+    # Visvalingam-Whyatt: the position with the smallest triangle area with its neighbours is removed
+    # until target_points_count positions are left or no area is below max_area_m2;
+    # with time_aware the area is measured from the position interpolated in time, like in TDTR
+    # areas only read positions and times, so no metrics are calculated with lean_metrics
+    INPUT_METRIC_COLUMNS = []
+
+    def __init__(self, pdf: pd.DataFrame, time_aware: bool = False, geodesy_method: str = GEODESIC, stats: ProcessingStats = None,
+                 lean_metrics: bool = False, compact: bool = False):
+        self.time_aware = time_aware
+        self.geodesy_method = geodesy_method
+        self.stats = stats if stats is not None else DISABLED_STATS
+        # metrics of results, with lean_metrics without shifted copies of other columns
+        self.metric_columns = Trajectory.LEAN_METRIC_COLUMNS if lean_metrics else Trajectory.METRIC_COLUMNS
+
+        with self.stats.phase('prepare'):
+            self.trajectory = prepare_trajectory(
+                pdf, self.geodesy_method, metric_columns=self.INPUT_METRIC_COLUMNS if lean_metrics else None, compact=compact)
+            self.trajectory.set_column('no_of_cleaned_positions_since_prev_pos', np.zeros(len(self.trajectory), dtype=np.int64))
+        self.stats.count('input_points_count', len(self.trajectory))
+        self.longitudes = self.trajectory.longitudes
+        self.latitudes = self.trajectory.latitudes
+        # only ratios of time differences are used, so times of a compact trajectory are not converted
+        self.times = self.trajectory.times
+        # set by calculate_significances, simplify_trajectory then only filters them
+        self.significances_m2 = None
+        self.removal_ranks = None
+
+    def _areas_m2(self, prev_positions, positions, next_positions) -> np.ndarray:
+        return triangle_areas_m2(self.longitudes, self.latitudes, self.times, np.asarray(prev_positions),
+                                 np.asarray(positions), np.asarray(next_positions), self.time_aware, self.geodesy_method)
+
+    def calculate_significances(self) -> np.ndarray:
+        # removes positions one by one, a heap entry is outdated when its area differs from the current one;
+        # significance of a position is the largest area removed up to it, so that positions with
+        # significance > max_area_m2 are exactly the ones left when all smaller areas are removed;
+        # vessels of a fleet trajectory share the heap, but their significances and ranks are separate
+        points_count = len(self.trajectory)
+        offsets = self.trajectory.vessel_offsets()
+        vessel_numbers = self.trajectory.vessel_numbers()
+        vessel_points_counts = np.diff(offsets)
+        significances_m2 = np.full(points_count, np.inf)
+        removal_ranks = vessel_points_counts[vessel_numbers]
+        geodesic_calls_count = 0
+        heap_pushes_count = 0
+        with self.stats.phase('significances'):
+            is_end = self.trajectory.first_rows()
+            is_end[offsets[1:][vessel_points_counts > 0] - 1] = True
+            inner_positions = np.flatnonzero(~is_end)
+            if len(inner_positions) > 0:
+                inner_areas_m2 = self._areas_m2(inner_positions - 1, inner_positions, inner_positions + 1)
+                areas_m2 = np.full(points_count, np.inf)
+                areas_m2[inner_positions] = inner_areas_m2
+                areas_m2 = areas_m2.tolist()
+                geodesic_calls_count = geodesic_calls_count + 1
+                prev_positions = list(range(-1, points_count - 1))
+                next_positions = list(range(1, points_count + 1))
+                is_removed = [False] * points_count
+                is_end = is_end.tolist()
+                vessel_numbers = vessel_numbers.tolist()
+                heap = list(zip(inner_areas_m2.tolist(), inner_positions.tolist()))
+                heapq.heapify(heap)
+                heap_pushes_count = len(heap)
+
+                vessel_significances_m2 = [0.0] * (len(offsets) - 1)
+                vessel_removal_ranks = [0] * (len(offsets) - 1)
+                while heap:
+                    area_m2, position = heapq.heappop(heap)
+                    if is_removed[position] or area_m2 != areas_m2[position]:
+                        continue
+                    vessel = vessel_numbers[position]
+                    vessel_significances_m2[vessel] = max(vessel_significances_m2[vessel], area_m2)
+                    significances_m2[position] = vessel_significances_m2[vessel]
+                    removal_ranks[position] = vessel_removal_ranks[vessel]
+                    vessel_removal_ranks[vessel] = vessel_removal_ranks[vessel] + 1
+                    is_removed[position] = True
+
+                    prev_position, next_position = prev_positions[position], next_positions[position]
+                    next_positions[prev_position] = next_position
+                    prev_positions[next_position] = prev_position
+                    neighbours = [neighbour for neighbour in (prev_position, next_position) if not is_end[neighbour]]
+                    if not neighbours:
+                        continue
+                    neighbour_areas_m2 = self._areas_m2(
+                        [prev_positions[neighbour] for neighbour in neighbours], neighbours, [next_positions[neighbour] for neighbour in neighbours])
+                    geodesic_calls_count = geodesic_calls_count + 1
+                    for neighbour, neighbour_area_m2 in zip(neighbours, neighbour_areas_m2.tolist()):
+                        areas_m2[neighbour] = neighbour_area_m2
+                        heapq.heappush(heap, (neighbour_area_m2, neighbour))
+                    heap_pushes_count = heap_pushes_count + len(neighbours)
+        self.stats.count('geodesic_calls_count', geodesic_calls_count)
+        self.stats.count('heap_pushes_count', heap_pushes_count)
+        self.significances_m2 = significances_m2
+        self.removal_ranks = removal_ranks
+
+        return self.significances_m2
+
+    def simplify_trajectory(self, target_points_count: int = None, max_area_m2: float = None, return_mask: bool = False,
+                            return_trajectory: bool = False):
+        # the first and the last position are always kept, also with target_points_count < 2
+        if (target_points_count is None) == (max_area_m2 is None):
+            raise ValueError("Either target_points_count or max_area_m2 has to be given")
+        if self.significances_m2 is None:
+            self.calculate_significances()
+        with self.stats.phase('select'):
+            if target_points_count is not None:
+                # target_points_count of every vessel of a fleet trajectory
+                vessel_points_counts = np.diff(self.trajectory.vessel_offsets())[self.trajectory.vessel_numbers()]
+                keep_mask = self.removal_ranks >= vessel_points_counts - target_points_count
+            else:
+                keep_mask = self.significances_m2 > max_area_m2
+        self.stats.count_selection(keep_mask)
+        if return_mask:
+            self.stats.emit()
+            return keep_mask
+
+        with self.stats.phase('build_result'):
+            result = self.trajectory.take(keep_mask)
+            # positions removed since the previous kept position, counted from the index like in the cleaner
+            no_of_cleaned_positions = np.zeros(len(result), dtype=np.int64)
+            no_of_cleaned_positions[1:] = np.diff(result.index) - 1
+            no_of_cleaned_positions[result.first_rows()] = 0
+            result.columns['no_of_cleaned_positions_since_prev_pos'] = no_of_cleaned_positions
+            result.update_metrics(geodesy_method=self.geodesy_method, metric_columns=self.metric_columns)
+            result.move_columns_to_end(self.metric_columns)
+            result = result if return_trajectory else result.to_pdf()
+        self.stats.count('array_copies_count', len(result.columns) + 1)
+        self.stats.emit()
+
+        return result
+
+    @classmethod
+    def simplify_many(cls, pdf, offsets: np.ndarray = None, group_column: str = 'mmsi', init_kwargs: dict = None, return_mask: bool = False,
+                      **method_kwargs):
+        # all vessels of a fleet frame sorted by group_column and time at once, see fleet.functions.process_many
+        return process_many(cls, 'simplify_trajectory', pdf, offsets, group_column, init_kwargs, return_mask, **method_kwargs)
@@ -0,0 +1,18 @@
+import logging
+
+
+def logging_sink(logger: logging.Logger = None, level: int = logging.INFO):
+    logger = logger if logger is not None else logging.getLogger('ais_trajectory_simplification')
+
+    def sink(stats):
+        logger.log(level, '%s phases_s=%s counters=%s', stats.name, stats.phases_s, stats.counters)
+
+    return sink
+
+
+def callback_sink(callback):
+    # callback(stats_dict), e.g. to push counters to a metrics exporter
+    def sink(stats):
+        callback(stats.to_dict())
+
+    return sink
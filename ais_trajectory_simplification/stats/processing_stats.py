@@ -0,0 +1,85 @@
+import time
+from contextlib import nullcontext
+
+_DISABLED_PHASE = nullcontext()
+
+
+class _Phase:
+    __slots__ = ['stats', 'name', 'start_time']
+
+    def __init__(self, stats, name: str):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stats.phases_s[self.name] = self.stats.phases_s.get(self.name, 0) + time.perf_counter() - self.start_time
+        return False
+
+
+class ProcessingStats:
+    # wall time of phases and counters of a cleaner or simplificator; classes count in local
+    # variables and add them once per call, so a disabled instance costs only a few calls per vessel
+    def __init__(self, name: str = None, sink=None, enabled: bool = True):
+        self.name = name
+        # sink(stats) is called by emit, e.g. stats.functions.logging_sink() or a metrics exporter
+        self.sink = sink
+        self.enabled = enabled
+        self.phases_s = {}
+        self.counters = {}
+
+    def phase(self, name: str):
+        if not self.enabled:
+            return _DISABLED_PHASE
+        return _Phase(self, name)
+
+    def count(self, name: str, value: int = 1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def count_selection(self, keep_mask):
+        if self.enabled:
+            kept_count = int(keep_mask.sum())
+            self.count('output_points_count', kept_count)
+            self.count('deleted_rows_count', len(keep_mask) - kept_count)
+
+    def emit(self):
+        if self.enabled and self.sink is not None:
+            self.sink(self)
+
+    def merge(self, other):
+        for name, value_s in other.phases_s.items():
+            self.phases_s[name] = self.phases_s.get(name, 0) + value_s
+        for name, value in other.counters.items():
+            self.counters[name] = self.counters.get(name, 0) + value
+
+        return self
+
+    @classmethod
+    def aggregate(cls, stats_list, name: str = None, sink=None):
+        # sums of phases and counters, e.g. of all vessels of a fleet run
+        stats_list = list(stats_list)
+        aggregated_stats = cls(name, sink)
+        for stats in stats_list:
+            aggregated_stats.merge(stats)
+        aggregated_stats.counters['runs_count'] = aggregated_stats.counters.get('runs_count', 0) + len(stats_list)
+
+        return aggregated_stats
+
+    def to_dict(self) -> dict:
+        return {'name': self.name, 'phases_s': dict(self.phases_s), 'counters': dict(self.counters)}
+
+    def __getstate__(self):
+        # sinks are often not picklable, stats collected in worker processes are sent back without them
+        state = dict(self.__dict__)
+        state['sink'] = None
+        return state
+
+    def __repr__(self):
+        return f'ProcessingStats({self.to_dict()})'
+
+
+DISABLED_STATS = ProcessingStats(enabled=False)
@@ -0,0 +1,165 @@
+import json
+import os
+import shutil
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+class ParquetTrajectoryStore:
+    # Raw AIS positions partitioned by vessel and time range on disk:
+    #   <path>/store.json                                          column types
+    #   <path>/mmsi=<mmsi>/period=<time partition>/part-<chunk>.parquet
+    # CSVs are ingested chunk by chunk and vessels are read one at a time,
+    # so memory does not depend on the size of the input
+    SCHEMA = {
+        'position_timestamp': pa.timestamp('ns'),
+        'mmsi': pa.int64(),
+        'latitude': pa.float64(),
+        'longitude': pa.float64(),
+        'speed_reference_kn': pa.float64(),
+    }
+
+    def __init__(self, path: str, group_column: str = 'mmsi', sort_col: str = 'position_timestamp', time_partition: str = 'D',
+                 schema: dict = None):
+        self.path = path
+        self.group_column = group_column
+        self.sort_col = sort_col
+        # pandas period frequency used for time range partitions, e.g. 'D' or 'M'
+        self.time_partition = time_partition
+        # column name -> pyarrow type (or its alias, e.g. 'float64'), columns which are neither in SCHEMA nor
+        # in schema are kept as strings; the type of a column is fixed by the first write and taken from
+        # store.json afterwards, so that parts of all chunks can be merged
+        self.stored_types = {}
+        if os.path.exists(self._metadata_path()):
+            with open(self._metadata_path()) as file:
+                self.stored_types = {column: pa.type_for_alias(alias) for column, alias in json.load(file)['column_types'].items()}
+        self.column_types = {**self.SCHEMA, **self.stored_types}
+        self._add_column_types(schema)
+
+    def _metadata_path(self) -> str:
+        return os.path.join(self.path, 'store.json')
+
+    def _add_column_types(self, schema: dict):
+        for column, column_type in (schema or {}).items():
+            column_type = pa.type_for_alias(column_type) if isinstance(column_type, str) else column_type
+            if column in self.stored_types and self.stored_types[column] != column_type:
+                raise ValueError(f"Column {column} is stored as {self.stored_types[column]}, not as {column_type}")
+            self.column_types[column] = column_type
+
+    def _schema(self, pdf: pd.DataFrame) -> pa.Schema:
+        schema = pa.schema([pa.field(column, self.column_types.get(column, pa.string())) for column in pdf.columns])
+        if any(column not in self.stored_types for column in schema.names):
+            self.stored_types.update({field.name: field.type for field in schema if field.name not in self.stored_types})
+            os.makedirs(self.path, exist_ok=True)
+            with open(self._metadata_path(), 'w') as file:
+                json.dump({'column_types': {column: str(column_type) for column, column_type in self.stored_types.items()}}, file)
+
+        return schema
+
+    def _partition_path(self, group_value, period: str) -> str:
+        return os.path.join(self.path, f"{self.group_column}={group_value}", f"period={period}")
+
+    def write(self, pdf: pd.DataFrame, part_name: str):
+        pdf = pdf.copy()
+        pdf[self.sort_col] = pd.to_datetime(pdf[self.sort_col])
+        periods = pdf[self.sort_col].dt.to_period(self.time_partition).astype(str)
+        schema = self._schema(pdf)
+        for (group_value, period), partition_pdf in pdf.groupby([self.group_column, periods], sort=False):
+            partition_path = self._partition_path(group_value, period)
+            os.makedirs(partition_path, exist_ok=True)
+            # columns of a chunk are converted by arrow, e.g. text of a CSV to numbers or an empty float column to strings
+            table = pa.Table.from_pandas(partition_pdf, preserve_index=False).cast(schema)
+            # format version 2.6 keeps nanosecond timestamps
+            pq.write_table(table, os.path.join(partition_path, f"part-{part_name}.parquet"), version='2.6')
+
+    def ingest_csv(self, csv_path: str, chunksize: int = 1000000, column_mapping: dict = None, schema: dict = None,
+                   **read_csv_kwargs) -> int:
+        # column_mapping renames source columns, e.g. {'# Timestamp': 'position_timestamp', 'MMSI': 'mmsi'},
+        # schema types renamed columns like the schema of the store; values are read as text and converted
+        # to the column types, so the type of a column does not depend on the values of a chunk
+        self._add_column_types(schema)
+        read_csv_kwargs.setdefault('dtype', str)
+        rows_count = 0
+        with pd.read_csv(csv_path, chunksize=chunksize, **read_csv_kwargs) as chunks:
+            for chunk_number, chunk_pdf in enumerate(chunks):
+                if column_mapping:
+                    chunk_pdf = chunk_pdf.rename(columns=column_mapping)
+                part_name = f"{os.path.splitext(os.path.basename(csv_path))[0]}-{chunk_number:06d}"
+                self.write(chunk_pdf, part_name)
+                rows_count = rows_count + len(chunk_pdf)
+
+        return rows_count
+
+    def vessels(self) -> list:
+        if not os.path.isdir(self.path):
+            return []
+        prefix = f"{self.group_column}="
+        group_values = [name[len(prefix):] for name in os.listdir(self.path) if name.startswith(prefix)]
+
+        return sorted(int(value) if value.lstrip('-').isdigit() else value for value in group_values)
+
+    def periods(self, group_value) -> list:
+        vessel_path = os.path.join(self.path, f"{self.group_column}={group_value}")
+        return sorted(name[len('period='):] for name in os.listdir(vessel_path) if name.startswith('period='))
+
+    def _part_files(self, group_value, periods: list) -> list:
+        files = []
+        for period in periods:
+            partition_path = self._partition_path(group_value, period)
+            files.extend(os.path.join(partition_path, name) for name in sorted(os.listdir(partition_path)) if name.endswith('.parquet'))
+
+        return files
+
+    def read_vessel(self, group_value, start=None, end=None, columns: list = None) -> pd.DataFrame:
+        # positions of one vessel sorted by time, optionally limited to start <= time < end
+        periods = self.periods(group_value)
+        if start is not None:
+            start_period = str(pd.Timestamp(start).to_period(self.time_partition))
+            periods = [period for period in periods if period >= start_period]
+        if end is not None:
+            end_period = str(pd.Timestamp(end).to_period(self.time_partition))
+            periods = [period for period in periods if period <= end_period]
+
+        tables = [pq.read_table(file, columns=columns) for file in self._part_files(group_value, periods)]
+        if not tables:
+            return pd.DataFrame(columns=columns)
+        pdf = pa.concat_tables(tables, promote=True).to_pandas()
+        if start is not None:
+            pdf = pdf[pdf[self.sort_col] >= pd.Timestamp(start)]
+        if end is not None:
+            pdf = pdf[pdf[self.sort_col] < pd.Timestamp(end)]
+
+        return pdf.sort_values(self.sort_col, kind='stable').reset_index(drop=True)
+
+    def iter_vessels(self, start=None, end=None, columns: list = None):
+        for group_value in self.vessels():
+            yield group_value, self.read_vessel(group_value, start, end, columns)
+
+    def apply(self, func, start=None, end=None, columns: list = None) -> pd.DataFrame:
+        # like groupby(group_column).apply(func), but only one vessel is loaded at a time
+        results = {group_value: func(pdf) for group_value, pdf in self.iter_vessels(start, end, columns)}
+        if not results:
+            return pd.DataFrame()
+
+        return pd.concat(list(results.values()), keys=list(results), names=[self.group_column])
+
+    def compact(self):
+        # merges the part files of every partition into one file sorted by time
+        for group_value in self.vessels():
+            for period in self.periods(group_value):
+                files = self._part_files(group_value, [period])
+                if len(files) <= 1:
+                    continue
+                table = pa.concat_tables([pq.read_table(file) for file in files], promote=True)
+                table = table.sort_by(self.sort_col)
+                partition_path = self._partition_path(group_value, period)
+                compacted_file = os.path.join(partition_path, 'compacted.parquet.tmp')
+                pq.write_table(table, compacted_file, version='2.6')
+                for file in files:
+                    os.remove(file)
+                os.replace(compacted_file, os.path.join(partition_path, 'part-compacted.parquet'))
+
+    def clear(self):
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
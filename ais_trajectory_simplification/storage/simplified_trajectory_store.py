@@ -0,0 +1,323 @@
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+class SimplifiedTrajectoryStore:
+    # Simplified trajectories with a grid index over their segments (pairs of consecutive positions):
+    #   <path>/store.json                    grid parameters
+    #   <path>/positions/part-<name>.parquet simplified positions as they were written
+    #   <path>/segments/part-<name>.parquet  one row per segment, end longitude unwrapped over the antimeridian
+    #   <path>/cells/part-<name>.parquet     every grid cell touched by the bounding box and time range of a segment
+    # cells are time bucket x latitude band x longitude band numbered in this order, so a query only
+    # reads the segments of contiguous ranges of sorted cell numbers; positions between simplified
+    # positions are interpolated linearly in longitude, latitude and time
+    SEGMENT_COLUMNS = ['start_longitude', 'start_latitude', 'end_longitude', 'end_latitude', 'start_timestamp_ns', 'end_timestamp_ns']
+
+    def __init__(self, path: str, group_column: str = 'mmsi', sort_col: str = 'position_timestamp',
+                 cell_size_deg: float = 1.0, cell_duration: str = '1D', max_cells_per_segment: int = 4096):
+        self.path = path
+        self.group_column = group_column
+        self.sort_col = sort_col
+        self.cell_size_deg = cell_size_deg
+        self.cell_duration_ns = pd.Timedelta(cell_duration).value
+        # segments touching more cells (e.g. long gaps in reception) are checked by every query instead
+        self.max_cells_per_segment = max_cells_per_segment
+        # grid parameters of an existing store are always taken from it
+        if os.path.exists(self._metadata_path()):
+            with open(self._metadata_path()) as file:
+                metadata = json.load(file)
+            self.cell_size_deg = metadata['cell_size_deg']
+            self.cell_duration_ns = metadata['cell_duration_ns']
+        self.longitude_cells_count = int(np.ceil(360 / self.cell_size_deg))
+        self.latitude_cells_count = int(np.ceil(180 / self.cell_size_deg))
+        # loaded by _load_index, cleared by write
+        self._index = None
+
+    def _metadata_path(self) -> str:
+        return os.path.join(self.path, 'store.json')
+
+    def _part_path(self, kind: str, part_name: str) -> str:
+        return os.path.join(self.path, kind, f"part-{part_name}.parquet")
+
+    def _part_files(self, kind: str) -> list:
+        kind_path = os.path.join(self.path, kind)
+        if not os.path.isdir(kind_path):
+            return []
+        return [os.path.join(kind_path, name) for name in sorted(os.listdir(kind_path)) if name.endswith('.parquet')]
+
+    def _timestamps_ns(self, values) -> np.ndarray:
+        timestamps = pd.DatetimeIndex(pd.to_datetime(values))
+        if timestamps.tz is not None:
+            timestamps = timestamps.tz_convert(None)
+        return timestamps.asi8
+
+    def _timestamp_ns(self, value) -> int:
+        timestamp = pd.Timestamp(value)
+        if timestamp.tz is not None:
+            timestamp = timestamp.tz_convert(None)
+        return timestamp.value
+
+    def _flatten(self, pdf: pd.DataFrame) -> pd.DataFrame:
+        # e.g. groupby(group_column).apply(...) or FleetRunner results have the group column in the index
+        if self.group_column in pdf.index.names:
+            pdf = pdf.reset_index(level=self.group_column, drop=self.group_column in pdf.columns)
+        pdf = pdf.reset_index()
+        pdf[self.sort_col] = pd.to_datetime(pdf[self.sort_col])
+
+        return pdf.sort_values([self.group_column, self.sort_col], kind='stable').reset_index(drop=True)
+
+    def _cell_ranges(self, min_longitudes, min_latitudes, max_longitudes, max_latitudes, start_timestamps_ns, end_timestamps_ns):
+        # first cell and number of cells along time, latitude and longitude; longitudes may exceed +-180
+        first_longitude_cells = np.floor((np.asarray(min_longitudes) + 180) / self.cell_size_deg).astype(np.int64)
+        longitude_cells_counts = np.minimum(
+            np.floor((np.asarray(max_longitudes) + 180) / self.cell_size_deg).astype(np.int64) - first_longitude_cells + 1,
+            self.longitude_cells_count)
+        first_latitude_cells = np.clip(
+            np.floor((np.asarray(min_latitudes) + 90) / self.cell_size_deg).astype(np.int64), 0, self.latitude_cells_count - 1)
+        latitude_cells_counts = np.clip(
+            np.floor((np.asarray(max_latitudes) + 90) / self.cell_size_deg).astype(np.int64), 0, self.latitude_cells_count - 1
+        ) - first_latitude_cells + 1
+        first_time_cells = np.floor_divide(start_timestamps_ns, self.cell_duration_ns)
+        time_cells_counts = np.floor_divide(end_timestamps_ns, self.cell_duration_ns) - first_time_cells + 1
+
+        return (first_time_cells, time_cells_counts, first_latitude_cells, latitude_cells_counts,
+                first_longitude_cells % self.longitude_cells_count, longitude_cells_counts)
+
+    def _cell_numbers(self, time_cells, latitude_cells, longitude_cells) -> np.ndarray:
+        return (time_cells * self.latitude_cells_count + latitude_cells) * self.longitude_cells_count + longitude_cells
+
+    def _segment_cells(self, segments: dict):
+        # (cell numbers, segment positions) of all cells of every segment, and the mask of segments with too many cells
+        min_longitudes = np.minimum(segments['start_longitude'], segments['end_longitude'])
+        max_longitudes = np.maximum(segments['start_longitude'], segments['end_longitude'])
+        min_latitudes = np.minimum(segments['start_latitude'], segments['end_latitude'])
+        max_latitudes = np.maximum(segments['start_latitude'], segments['end_latitude'])
+        first_time_cells, time_cells_counts, first_latitude_cells, latitude_cells_counts, first_longitude_cells, longitude_cells_counts = (
+            self._cell_ranges(min_longitudes, min_latitudes, max_longitudes, max_latitudes,
+                              segments['start_timestamp_ns'], segments['end_timestamp_ns']))
+
+        cells_counts = time_cells_counts * latitude_cells_counts * longitude_cells_counts
+        is_oversized = cells_counts > self.max_cells_per_segment
+        cells_counts[is_oversized] = 0
+        segment_positions = np.repeat(np.arange(len(cells_counts)), cells_counts)
+        offsets = np.arange(len(segment_positions)) - np.repeat(np.cumsum(cells_counts) - cells_counts, cells_counts)
+        longitude_offsets = offsets % longitude_cells_counts[segment_positions]
+        offsets = offsets // longitude_cells_counts[segment_positions]
+        latitude_offsets = offsets % latitude_cells_counts[segment_positions]
+        time_offsets = offsets // latitude_cells_counts[segment_positions]
+        cell_numbers = self._cell_numbers(
+            first_time_cells[segment_positions] + time_offsets,
+            first_latitude_cells[segment_positions] + latitude_offsets,
+            (first_longitude_cells[segment_positions] + longitude_offsets) % self.longitude_cells_count)
+
+        return cell_numbers, segment_positions, is_oversized
+
+    def _segments(self, pdf: pd.DataFrame) -> pd.DataFrame:
+        # pdf sorted by group column and time; a vessel with a single position gets one zero length segment
+        group_values = pdf[self.group_column].to_numpy()
+        longitudes = pdf['longitude'].to_numpy(dtype=np.float64)
+        latitudes = pdf['latitude'].to_numpy(dtype=np.float64)
+        timestamps_ns = self._timestamps_ns(pdf[self.sort_col])
+
+        is_vessel_start = np.ones(len(pdf), dtype=bool)
+        is_vessel_start[1:] = group_values[1:] != group_values[:-1]
+        is_vessel_end = np.roll(is_vessel_start, -1)
+        starts = np.flatnonzero(~is_vessel_end | is_vessel_start)
+        ends = np.where(is_vessel_end[starts], starts, starts + 1)
+        longitude_differences = (longitudes[ends] - longitudes[starts] + 180) % 360 - 180
+
+        return pd.DataFrame({
+            self.group_column: group_values[starts],
+            'start_longitude': longitudes[starts],
+            'start_latitude': latitudes[starts],
+            'end_longitude': longitudes[starts] + longitude_differences,
+            'end_latitude': latitudes[ends],
+            'start_timestamp_ns': timestamps_ns[starts],
+            'end_timestamp_ns': timestamps_ns[ends],
+        })
+
+    def write(self, pdf: pd.DataFrame, part_name: str):
+        # simplified positions of one or many vessels; a part with the same name is replaced
+        os.makedirs(self.path, exist_ok=True)
+        if not os.path.exists(self._metadata_path()):
+            with open(self._metadata_path(), 'w') as file:
+                json.dump({'cell_size_deg': self.cell_size_deg, 'cell_duration_ns': self.cell_duration_ns}, file)
+
+        pdf = self._flatten(pdf)
+        segments_pdf = self._segments(pdf)
+        cell_numbers, segment_positions, is_oversized = self._segment_cells(
+            {column: segments_pdf[column].to_numpy() for column in self.SEGMENT_COLUMNS})
+        segments_pdf['is_oversized'] = is_oversized
+
+        for kind, part_pdf in [('positions', pdf), ('segments', segments_pdf),
+                               ('cells', pd.DataFrame({'cell': cell_numbers, 'segment': segment_positions}))]:
+            os.makedirs(os.path.join(self.path, kind), exist_ok=True)
+            # format version 2.6 keeps nanosecond timestamps
+            pq.write_table(pa.Table.from_pandas(part_pdf, preserve_index=False), self._part_path(kind, part_name), version='2.6')
+        self._index = None
+
+    def _load_index(self) -> dict:
+        if self._index is not None:
+            return self._index
+
+        segments_pdfs = []
+        cell_numbers = []
+        segment_positions = []
+        segments_count = 0
+        for segments_file in self._part_files('segments'):
+            segments_pdf = pq.read_table(segments_file).to_pandas()
+            cells_table = pq.read_table(os.path.join(self.path, 'cells', os.path.basename(segments_file)))
+            segments_pdfs.append(segments_pdf)
+            cell_numbers.append(cells_table.column('cell').to_numpy())
+            segment_positions.append(cells_table.column('segment').to_numpy() + segments_count)
+            segments_count = segments_count + len(segments_pdf)
+
+        if segments_pdfs:
+            segments_pdf = pd.concat(segments_pdfs, ignore_index=True)
+            cell_numbers = np.concatenate(cell_numbers)
+            segment_positions = np.concatenate(segment_positions)
+        else:
+            segments_pdf = pd.DataFrame({column: np.array([], dtype=np.float64) for column in self.SEGMENT_COLUMNS})
+            segments_pdf['is_oversized'] = np.array([], dtype=bool)
+            segments_pdf[self.group_column] = np.array([], dtype=np.int64)
+            cell_numbers = segment_positions = np.array([], dtype=np.int64)
+        order = np.argsort(cell_numbers, kind='stable')
+
+        self._index = {column: segments_pdf[column].to_numpy() for column in self.SEGMENT_COLUMNS}
+        self._index[self.group_column] = segments_pdf[self.group_column].to_numpy()
+        self._index['oversized_segments'] = np.flatnonzero(segments_pdf['is_oversized'].to_numpy())
+        self._index['cells'] = cell_numbers[order]
+        self._index['cell_segments'] = segment_positions[order]
+
+        return self._index
+
+    def _candidate_segments(self, min_longitude, min_latitude, max_longitude, max_latitude, start_ns, end_ns) -> np.ndarray:
+        # segments registered in cells of the box and time range, max_longitude may exceed 180
+        index = self._load_index()
+        first_time_cell, time_cells_count, first_latitude_cell, latitude_cells_count, first_longitude_cell, longitude_cells_count = (
+            int(value) for value in self._cell_ranges(min_longitude, min_latitude, max_longitude, max_latitude, start_ns, end_ns))
+        rows = self._cell_numbers(
+            np.repeat(np.arange(first_time_cell, first_time_cell + time_cells_count), latitude_cells_count),
+            np.tile(np.arange(first_latitude_cell, first_latitude_cell + latitude_cells_count), time_cells_count), 0)
+
+        # longitude cells of a row are one range, or two when they wrap around the antimeridian
+        last_longitude_cell = first_longitude_cell + longitude_cells_count - 1
+        if last_longitude_cell < self.longitude_cells_count:
+            longitude_ranges = [(first_longitude_cell, last_longitude_cell)]
+        else:
+            longitude_ranges = [(first_longitude_cell, self.longitude_cells_count - 1), (0, last_longitude_cell - self.longitude_cells_count)]
+        range_starts = np.concatenate([np.searchsorted(index['cells'], rows + first, 'left') for first, last in longitude_ranges])
+        range_ends = np.concatenate([np.searchsorted(index['cells'], rows + last, 'right') for first, last in longitude_ranges])
+
+        lengths = range_ends - range_starts
+        positions = np.repeat(range_starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+        return np.union1d(index['cell_segments'][positions], index['oversized_segments'])
+
+    def _interpolate(self, segments: np.ndarray, timestamps_ns: np.ndarray):
+        index = self._load_index()
+        durations_ns = index['end_timestamp_ns'][segments] - index['start_timestamp_ns'][segments]
+        fractions = np.divide(timestamps_ns - index['start_timestamp_ns'][segments], durations_ns,
+                              out=np.zeros(len(segments)), where=durations_ns > 0)
+        longitudes = index['start_longitude'][segments] + fractions * (index['end_longitude'][segments] - index['start_longitude'][segments])
+        latitudes = index['start_latitude'][segments] + fractions * (index['end_latitude'][segments] - index['start_latitude'][segments])
+
+        return longitudes, latitudes
+
+    def query_box(self, min_longitude, min_latitude, max_longitude, max_latitude, start, end) -> pd.DataFrame:
+        # segments crossing the box between start and end, with the times of entering and leaving it;
+        # a box with min_longitude > max_longitude crosses the antimeridian
+        index = self._load_index()
+        if max_longitude < min_longitude:
+            max_longitude = max_longitude + 360
+        start_ns, end_ns = self._timestamp_ns(start), self._timestamp_ns(end)
+        segments = self._candidate_segments(min_longitude, min_latitude, max_longitude, max_latitude, start_ns, end_ns)
+
+        # parts of segments within the time range
+        window_starts_ns = np.maximum(index['start_timestamp_ns'][segments], start_ns)
+        window_ends_ns = np.minimum(index['end_timestamp_ns'][segments], end_ns)
+        is_in_time = window_starts_ns <= window_ends_ns
+        segments, window_starts_ns, window_ends_ns = segments[is_in_time], window_starts_ns[is_in_time], window_ends_ns[is_in_time]
+        start_longitudes, start_latitudes = self._interpolate(segments, window_starts_ns)
+        end_longitudes, end_latitudes = self._interpolate(segments, window_ends_ns)
+
+        # Liang-Barsky clipping against the box shifted by whole turns, segment longitudes are within -360 - 360
+        enter_fractions = np.full(len(segments), np.inf)
+        exit_fractions = np.full(len(segments), -np.inf)
+        for shift in [-360, 0, 360]:
+            shift_enter_fractions = np.zeros(len(segments))
+            shift_exit_fractions = np.ones(len(segments))
+            is_crossing = np.ones(len(segments), dtype=bool)
+            for p, q in [
+                (start_longitudes - end_longitudes, start_longitudes - (min_longitude + shift)),
+                (end_longitudes - start_longitudes, (max_longitude + shift) - start_longitudes),
+                (start_latitudes - end_latitudes, start_latitudes - min_latitude),
+                (end_latitudes - start_latitudes, max_latitude - start_latitudes),
+            ]:
+                is_crossing &= (p != 0) | (q >= 0)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    ratios = q / p
+                shift_enter_fractions = np.where(p < 0, np.maximum(shift_enter_fractions, ratios), shift_enter_fractions)
+                shift_exit_fractions = np.where(p > 0, np.minimum(shift_exit_fractions, ratios), shift_exit_fractions)
+            is_crossing &= shift_enter_fractions <= shift_exit_fractions
+            enter_fractions = np.where(is_crossing, np.minimum(enter_fractions, shift_enter_fractions), enter_fractions)
+            exit_fractions = np.where(is_crossing, np.maximum(exit_fractions, shift_exit_fractions), exit_fractions)
+
+        is_crossing = enter_fractions <= exit_fractions
+        segments = segments[is_crossing]
+        window_starts_ns, window_durations_ns = window_starts_ns[is_crossing], (window_ends_ns - window_starts_ns)[is_crossing]
+
+        return pd.DataFrame({
+            self.group_column: index[self.group_column][segments],
+            'segment_start_timestamp': pd.to_datetime(index['start_timestamp_ns'][segments]),
+            'segment_end_timestamp': pd.to_datetime(index['end_timestamp_ns'][segments]),
+            'enter_timestamp': pd.to_datetime(window_starts_ns + np.round(enter_fractions[is_crossing] * window_durations_ns).astype(np.int64)),
+            'exit_timestamp': pd.to_datetime(window_starts_ns + np.round(exit_fractions[is_crossing] * window_durations_ns).astype(np.int64)),
+        })
+
+    def vessels_in_box(self, min_longitude, min_latitude, max_longitude, max_latitude, start, end) -> list:
+        segments_pdf = self.query_box(min_longitude, min_latitude, max_longitude, max_latitude, start, end)
+        return sorted(segments_pdf[self.group_column].unique())
+
+    def positions_at(self, timestamp, group_values: list = None) -> pd.DataFrame:
+        # interpolated positions of vessels whose simplified trajectory covers the timestamp
+        index = self._load_index()
+        timestamp_ns = self._timestamp_ns(timestamp)
+        segments = self._candidate_segments(-180, -90, 180, 90, timestamp_ns, timestamp_ns)
+        segments = segments[(index['start_timestamp_ns'][segments] <= timestamp_ns) & (index['end_timestamp_ns'][segments] >= timestamp_ns)]
+        if group_values is not None:
+            segments = segments[np.isin(index[self.group_column][segments], group_values)]
+        # a timestamp of a simplified position is the end of one segment and the start of the next one
+        vessel_group_values, first_segments = np.unique(index[self.group_column][segments], return_index=True)
+        segments = segments[first_segments]
+        longitudes, latitudes = self._interpolate(segments, np.full(len(segments), timestamp_ns))
+
+        return pd.DataFrame({
+            self.group_column: vessel_group_values,
+            self.sort_col: pd.Timestamp(timestamp_ns),
+            'longitude': (longitudes + 180) % 360 - 180,
+            'latitude': latitudes,
+        })
+
+    def read_vessel(self, group_value, start=None, end=None) -> pd.DataFrame:
+        # stored positions of one vessel sorted by time, optionally limited to start <= time < end
+        filters = [(self.group_column, '=', group_value)]
+        if start is not None:
+            filters.append((self.sort_col, '>=', pd.Timestamp(start)))
+        if end is not None:
+            filters.append((self.sort_col, '<', pd.Timestamp(end)))
+        tables = [pq.read_table(file, filters=filters) for file in self._part_files('positions')]
+        if not tables:
+            return pd.DataFrame()
+
+        return pa.concat_tables(tables, promote=True).to_pandas().sort_values(self.sort_col, kind='stable').reset_index(drop=True)
+
+    def clear(self):
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        self._index = None
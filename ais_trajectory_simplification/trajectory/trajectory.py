@@ -0,0 +1,320 @@
+import numpy as np
+import pandas as pd
+from ais_trajectory_simplification.geodesy.functions import GEODESIC, inverse
+
+
+class Trajectory:
+    # columns added by calculate_metrics, in the order they are added
+    METRIC_COLUMNS = [
+        'prev_pos_latitude',
+        'prev_pos_longitude',
+        'bearing_since_prev_pos_deg',
+        'distance_since_prev_pos_m',
+        'prev_pos_position_timestamp',
+        'time_since_prev_pos_s',
+        'speed_since_prev_pos_kn',
+        'prev_speed_since_prev_pos_kn',
+        'acceleration_kn_s',
+    ]
+    # METRIC_COLUMNS without shifted copies of other columns, previous values are read at the previous row instead
+    LEAN_METRIC_COLUMNS = [
+        'bearing_since_prev_pos_deg',
+        'distance_since_prev_pos_m',
+        'time_since_prev_pos_s',
+        'speed_since_prev_pos_kn',
+        'acceleration_kn_s',
+    ]
+    NAT = np.iinfo(np.int64).min
+
+    # Columnar trajectory used by cleaners and simplificators: every column is a typed numpy array,
+    # timestamps are int64 epoch nanoseconds and the original index is kept separately.
+    # DataFrames are only built at the API edge by from_pdf and to_pdf.
+    def __init__(self, index: np.ndarray, columns: dict, dtypes: dict, index_name=None, sort_col: str = 'position_timestamp'):
+        self.index = index
+        self.index_name = index_name
+        # column name -> numpy array, in the order of DataFrame columns
+        self.columns = columns
+        # column name -> pandas dtype restored by to_pdf
+        self.dtypes = dtypes
+        self.sort_col = sort_col
+        # positions of rows in the trajectory this one was taken from, used by update_metrics
+        self.source_positions = None
+        # first rows of vessels of a fleet trajectory and its length, see prepare_fleet_trajectory;
+        # rows of different vessels are never previous positions of each other
+        self.offsets = None
+        # epochs of vessels of a compact trajectory, whose sort_col holds int32 seconds since them, see compact
+        self.time_epochs_ns = None
+
+    @staticmethod
+    def series_to_numpy(series: pd.Series) -> np.ndarray:
+        if isinstance(series.dtype, pd.DatetimeTZDtype):
+            return series.dt.tz_convert('UTC').dt.tz_localize(None).to_numpy(dtype='datetime64[ns]').view(np.int64)
+        if series.dtype.kind == 'M':
+            return series.to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+        return series.to_numpy()
+
+    @classmethod
+    def from_pdf(cls, pdf: pd.DataFrame, sort_col: str = 'position_timestamp'):
+        columns = {column: cls.series_to_numpy(pdf[column]) for column in pdf.columns}
+        dtypes = {column: pdf[column].dtype for column in pdf.columns}
+
+        return cls(pdf.index.to_numpy(), columns, dtypes, pdf.index.name, sort_col)
+
+    def _column_to_pandas(self, column: str):
+        values = self.timestamps_ns if column == self.sort_col else self.columns[column]
+        dtype = self.dtypes[column]
+        if isinstance(dtype, pd.DatetimeTZDtype):
+            return pd.DatetimeIndex(values.view('datetime64[ns]')).tz_localize('UTC').tz_convert(dtype.tz)
+        if dtype.kind == 'M':
+            return values.view('datetime64[ns]')
+        if values.dtype != dtype:
+            return pd.array(values).astype(dtype)
+
+        return values
+
+    def to_pdf(self) -> pd.DataFrame:
+        return pd.DataFrame(
+            {column: self._column_to_pandas(column) for column in self.columns},
+            index=pd.Index(self.index, name=self.index_name))
+
+    def __len__(self):
+        return len(self.index)
+
+    def _coordinates(self, column: str) -> np.ndarray:
+        values = self.columns[column]
+        return values if values.dtype == np.float32 else np.asarray(values, dtype=np.float64)
+
+    @property
+    def longitudes(self) -> np.ndarray:
+        # float32 of a compact trajectory are not copied
+        return self._coordinates('longitude')
+
+    @property
+    def latitudes(self) -> np.ndarray:
+        return self._coordinates('latitude')
+
+    @property
+    def timestamps_ns(self) -> np.ndarray:
+        # of a compact trajectory built on every call, kernels use times and seconds_between instead
+        if self.time_epochs_ns is None:
+            return self.columns[self.sort_col]
+
+        return self.time_epochs_ns[self.vessel_numbers()] + self.columns[self.sort_col].astype(np.int64) * 1_000_000_000
+
+    @property
+    def times(self) -> np.ndarray:
+        # epoch nanoseconds or int32 seconds of a compact trajectory, only differences within a vessel are comparable
+        return self.columns[self.sort_col]
+
+    def seconds_between(self, start_positions, end_positions):
+        # positions have to be of the same vessel
+        times = self.times
+        if self.time_epochs_ns is None:
+            return (times[end_positions] - times[start_positions]) / 1e9
+
+        return np.asarray(times[end_positions], dtype=np.float64) - times[start_positions]
+
+    def compact(self):
+        # coordinates as float32 (below 2 m at 180 deg, 0.1 m at 10 deg of longitude) and times as int32 seconds since
+        # the first position of every vessel; to_pdf restores the original dtypes
+        timestamps_ns = self.timestamps_ns
+        if np.any(timestamps_ns == self.NAT) or np.any(timestamps_ns % 1_000_000_000 != 0):
+            raise ValueError(f"Only whole seconds of {self.sort_col} without NaT can be compact")
+        for column in ['longitude', 'latitude']:
+            self.columns[column] = self.columns[column].astype(np.float32)
+        offsets = self.vessel_offsets()
+        vessel_numbers = self.vessel_numbers()
+        time_epochs_ns = np.zeros(len(offsets) - 1, dtype=np.int64)
+        is_not_empty = np.diff(offsets) > 0
+        time_epochs_ns[is_not_empty] = timestamps_ns[offsets[:-1][is_not_empty]]
+        times_s = (timestamps_ns - time_epochs_ns[vessel_numbers]) // 1_000_000_000
+        if len(times_s) > 0 and times_s.max() > np.iinfo(np.int32).max:
+            raise ValueError(f"Vessels longer than {np.iinfo(np.int32).max} s cannot be compact")
+        self.columns[self.sort_col] = times_s.astype(np.int32)
+        self.time_epochs_ns = time_epochs_ns
+
+        return self
+
+    def single_vessel(self, vessel: int):
+        # a trajectory taken from rows of one vessel of a fleet trajectory as a trajectory of its own
+        self.offsets = None
+        if self.time_epochs_ns is not None:
+            self.time_epochs_ns = self.time_epochs_ns[vessel:vessel + 1]
+
+        return self
+
+    def float_column(self, column: str) -> np.ndarray:
+        return np.asarray(self.columns[column], dtype=np.float64)
+
+    def set_column(self, column: str, values: np.ndarray, dtype=None):
+        self.columns[column] = values
+        self.dtypes[column] = np.dtype(values.dtype if dtype is None else dtype)
+
+    def drop(self, columns: list):
+        for column in columns:
+            self.columns.pop(column, None)
+            self.dtypes.pop(column, None)
+
+        return self
+
+    def copy(self, deep: bool = True):
+        # a shallow copy shares arrays, but columns can be added, replaced or dropped independently
+        columns = {column: values.copy() if deep else values for column, values in self.columns.items()}
+        result = Trajectory(self.index.copy() if deep else self.index, columns, dict(self.dtypes), self.index_name, self.sort_col)
+        result.offsets = self.offsets
+        result.time_epochs_ns = self.time_epochs_ns
+
+        return result
+
+    def vessel_offsets(self) -> np.ndarray:
+        # [0, len] of a single vessel trajectory
+        return self.offsets if self.offsets is not None else np.array([0, len(self)], dtype=np.int64)
+
+    def vessel_numbers(self) -> np.ndarray:
+        offsets = self.vessel_offsets()
+        return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+    def move_columns_to_end(self, columns: list):
+        for column in columns:
+            if column in self.columns:
+                self.columns[column] = self.columns.pop(column)
+
+        return self
+
+    def take(self, keep_mask: np.ndarray, recalculated_positions: dict = None, recalculated_columns: list = None):
+        # selects kept rows and overwrites metrics of rows that got a new previous position,
+        # recalculated_positions maps row position to values ordered as in recalculated_columns
+        result = Trajectory(self.index[keep_mask], {column: values[keep_mask] for column, values in self.columns.items()},
+                            dict(self.dtypes), self.index_name, self.sort_col)
+        result.source_positions = np.flatnonzero(keep_mask) if keep_mask.dtype == bool else keep_mask
+        if self.offsets is not None:
+            result.offsets = np.searchsorted(result.source_positions, self.offsets).astype(np.int64)
+        result.time_epochs_ns = self.time_epochs_ns
+        recalculated_positions = {
+            position: values for position, values in (recalculated_positions or {}).items() if keep_mask[position]
+        }
+        if not recalculated_positions:
+            return result
+
+        result_positions = np.cumsum(keep_mask)[list(recalculated_positions)] - 1
+        recalculated_values = list(zip(*recalculated_positions.values()))
+        for column, values in zip(recalculated_columns, recalculated_values):
+            result.columns[column][result_positions] = values
+
+        return result
+
+    def first_rows(self) -> np.ndarray:
+        # rows without a previous position
+        starts = self.vessel_offsets()[:-1]
+        is_first = np.zeros(len(self), dtype=bool)
+        is_first[starts[starts < len(self)]] = True
+
+        return is_first
+
+    def _has_prev(self, positions: np.ndarray) -> np.ndarray:
+        if self.offsets is None:
+            return positions >= 1
+
+        return ~self.first_rows()[positions]
+
+    def _calculate_position_metrics(self, positions: np.ndarray, geodesy_method: str, metric_columns: list) -> dict:
+        # values of metric_columns up to speed_since_prev_pos_kn for given row positions
+        latitudes = self.latitudes
+        longitudes = self.longitudes
+        prev_positions = positions - 1
+        has_prev = self._has_prev(positions)
+        metrics = {}
+        # float64 also for compact coordinates, like the columns restored by to_pdf
+        prev_latitudes = np.where(has_prev, latitudes[prev_positions].astype(np.float64), np.nan)
+        prev_longitudes = np.where(has_prev, longitudes[prev_positions].astype(np.float64), np.nan)
+        metrics['prev_pos_latitude'], metrics['prev_pos_longitude'] = prev_latitudes, prev_longitudes
+
+        if any(column in metric_columns for column in self.LEAN_METRIC_COLUMNS if column != 'time_since_prev_pos_s'):
+            bearings, back_azimuths, distances_m = inverse(
+                prev_longitudes, prev_latitudes, longitudes[positions], latitudes[positions], geodesy_method)
+            # convert bearing_since_prev_pos_deg from -180 - +180 to 0 - 360
+            metrics['bearing_since_prev_pos_deg'] = np.where(bearings < 0, bearings + 360, bearings)
+            metrics['distance_since_prev_pos_m'] = np.asarray(distances_m)
+
+        if self.time_epochs_ns is None:
+            timestamps_ns = self.timestamps_ns
+            prev_timestamps_ns = np.where(has_prev, timestamps_ns[prev_positions], self.NAT)
+            is_time_known = (prev_timestamps_ns != self.NAT) & (timestamps_ns[positions] != self.NAT)
+            metrics['prev_pos_position_timestamp'] = prev_timestamps_ns
+            metrics['time_since_prev_pos_s'] = np.where(is_time_known, timestamps_ns[positions] - prev_timestamps_ns, np.nan) / 1e9
+        else:
+            if 'prev_pos_position_timestamp' in metric_columns:
+                metrics['prev_pos_position_timestamp'] = np.where(has_prev, self.timestamps_ns[prev_positions], self.NAT)
+            metrics['time_since_prev_pos_s'] = np.where(has_prev, self.seconds_between(prev_positions, positions), np.nan)
+        if 'distance_since_prev_pos_m' in metrics:
+            metrics['speed_since_prev_pos_kn'] = (metrics['distance_since_prev_pos_m'] / metrics['time_since_prev_pos_s']) * (3600 / 1852)
+
+        return metrics
+
+    def _calculate_accelerations(self, positions: np.ndarray, speeds_kn: np.ndarray, times_s: np.ndarray) -> tuple:
+        prev_positions = positions - 1
+        prev_speeds_kn = np.where(self._has_prev(positions), speeds_kn[prev_positions], np.nan)
+        accelerations_kn_s = (speeds_kn[positions] - prev_speeds_kn) / times_s[positions]
+
+        return prev_speeds_kn, accelerations_kn_s
+
+    def calculate_metrics(self, default_speed_reference_kn: int = 20, geodesy_method: str = GEODESIC, metric_columns: list = None):
+        # the same metrics as cleaning.functions.calculate_metrics, columns are added in the same order;
+        # metric_columns limits them, e.g. to LEAN_METRIC_COLUMNS or only the ones a cleaner or simplificator reads
+        metric_columns = self.METRIC_COLUMNS if metric_columns is None else metric_columns
+        positions = np.arange(len(self))
+        metrics = self._calculate_position_metrics(positions, geodesy_method, metric_columns)
+
+        # caclulate speed and acceleration
+        if 'prev_speed_since_prev_pos_kn' in metric_columns or 'acceleration_kn_s' in metric_columns:
+            metrics['prev_speed_since_prev_pos_kn'], metrics['acceleration_kn_s'] = self._calculate_accelerations(
+                positions, metrics['speed_since_prev_pos_kn'], metrics['time_since_prev_pos_s'])
+        # metric columns of the input which are not recalculated would be outdated, so they are dropped
+        self.drop([column for column in self.METRIC_COLUMNS if column not in metric_columns])
+        for column in self.METRIC_COLUMNS:
+            if column in metric_columns:
+                self.set_column(column, metrics[column], self.dtypes[self.sort_col] if column == 'prev_pos_position_timestamp' else None)
+
+        # add speed_reference_kn if no such column exists or replace nulls
+        if 'speed_reference_kn' not in self.columns:
+            self.set_column('speed_reference_kn', np.full(len(self), default_speed_reference_kn))
+        elif self.columns['speed_reference_kn'].dtype.kind == 'f':
+            speed_references_kn = self.columns['speed_reference_kn']
+            self.columns['speed_reference_kn'] = np.where(np.isnan(speed_references_kn), default_speed_reference_kn, speed_references_kn)
+        self.source_positions = None
+
+        return self
+
+    def update_metrics(self, default_speed_reference_kn: int = 20, geodesy_method: str = GEODESIC, metric_columns: list = None):
+        # after take only rows which got a new previous position (and accelerations of rows after them)
+        # are recalculated, the result is the same as of calculate_metrics
+        metric_columns = self.METRIC_COLUMNS if metric_columns is None else metric_columns
+        with_accelerations = 'prev_speed_since_prev_pos_kn' in metric_columns or 'acceleration_kn_s' in metric_columns
+        required_columns = metric_columns + ['speed_reference_kn'] + (
+            ['speed_since_prev_pos_kn', 'time_since_prev_pos_s'] if with_accelerations else [])
+        if any(column not in self.columns for column in required_columns):
+            return self.calculate_metrics(default_speed_reference_kn, geodesy_method, metric_columns)
+        if self.source_positions is None:
+            return self
+
+        is_changed = np.diff(self.source_positions, prepend=-1) != 1
+        if self.offsets is not None:
+            is_changed = is_changed | self.first_rows()
+        changed_positions = np.flatnonzero(is_changed)
+        metrics = self._calculate_position_metrics(changed_positions, geodesy_method, metric_columns)
+        for column in metric_columns:
+            if column in metrics:
+                self.columns[column][changed_positions] = metrics[column]
+
+        if with_accelerations:
+            acceleration_positions = np.union1d(changed_positions, changed_positions + 1)
+            acceleration_positions = acceleration_positions[acceleration_positions < len(self)]
+            prev_speeds_kn, accelerations_kn_s = self._calculate_accelerations(
+                acceleration_positions, self.columns['speed_since_prev_pos_kn'], self.columns['time_since_prev_pos_s'])
+            for column, values in [('prev_speed_since_prev_pos_kn', prev_speeds_kn), ('acceleration_kn_s', accelerations_kn_s)]:
+                if column in metric_columns:
+                    self.columns[column][acceleration_positions] = values
+        self.source_positions = None
+
+        return self
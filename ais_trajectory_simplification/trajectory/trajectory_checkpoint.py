@@ -0,0 +1,41 @@
+import json
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+class TrajectoryCheckpoint:
+    # positions of a trajectory part which have to be processed again with the next part and the state
+    # of the cleaner or simplificator at them, made by clean_trajectory_part and simplify_trajectory_part
+    METADATA_KEY = b'trajectory_checkpoint'
+
+    def __init__(self, processor_name: str, parameters: dict, positions_pdf: pd.DataFrame, state: dict):
+        self.processor_name = processor_name
+        # parameters and state are kept as they are saved, json values
+        self.parameters = json.loads(json.dumps(parameters))
+        self.positions_pdf = positions_pdf
+        self.state = json.loads(json.dumps(state))
+
+    def check(self, processor_name: str, parameters: dict):
+        parameters = json.loads(json.dumps(parameters))
+        if processor_name != self.processor_name or parameters != self.parameters:
+            raise ValueError(
+                f"Checkpoint of {self.processor_name} with {self.parameters} cannot be resumed by {processor_name} with {parameters}")
+
+    def prepend_to(self, pdf: pd.DataFrame) -> pd.DataFrame:
+        # positions of the next part have to be later than positions of previous parts
+        return pd.concat([self.positions_pdf, pdf])
+
+    def save(self, path: str):
+        table = pa.Table.from_pandas(self.positions_pdf, preserve_index=True)
+        metadata = {'processor_name': self.processor_name, 'parameters': self.parameters, 'state': self.state}
+        table = table.replace_schema_metadata({**table.schema.metadata, self.METADATA_KEY: json.dumps(metadata).encode()})
+        # format version 2.6 keeps nanosecond timestamps
+        pq.write_table(table, path, version='2.6')
+
+    @classmethod
+    def load(cls, path: str):
+        table = pq.read_table(path)
+        metadata = json.loads(table.schema.metadata[cls.METADATA_KEY])
+
+        return cls(metadata['processor_name'], metadata['parameters'], table.to_pandas(), metadata['state'])
@@ -0,0 +1,37 @@
+import argparse
+import json
+import sys
+
+
+def compare_benchmarks(base_report: dict, new_report: dict, threshold: float = 0.1) -> list:
+    # rows of (algorithm, points_count, points/s change, peak memory change, is regression)
+    base_results = {(result['algorithm'], result['points_count']): result for result in base_report['results']}
+    rows = []
+    for result in new_report['results']:
+        base_result = base_results.get((result['algorithm'], result['points_count']))
+        if base_result is None:
+            continue
+        speed_change = result['points_per_s'] / base_result['points_per_s'] - 1
+        memory_change = None
+        if result['peak_memory_mb'] is not None and base_result['peak_memory_mb']:
+            memory_change = result['peak_memory_mb'] / base_result['peak_memory_mb'] - 1
+        is_regression = speed_change < -threshold or (memory_change is not None and memory_change > threshold)
+        rows.append((result['algorithm'], result['points_count'], speed_change, memory_change, is_regression))
+
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare two benchmark reports, exits with 1 if any result regressed.')
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed relative slowdown and memory growth')
+    args = parser.parse_args()
+
+    with open(args.base) as base_file, open(args.new) as new_file:
+        rows = compare_benchmarks(json.load(base_file), json.load(new_file), args.threshold)
+
+    for algorithm, points_count, speed_change, memory_change, is_regression in rows:
+        memory = '' if memory_change is None else f'{memory_change:+8.1%}'
+        print(f"{algorithm:>12} {points_count:>10} points/s {speed_change:+8.1%} memory {memory:>8} {'REGRESSION' if is_regression else ''}")
+    sys.exit(1 if any(row[-1] for row in rows) else 0)
@@ -0,0 +1,108 @@
+import argparse
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from ais_trajectory_simplification.cleaning.next_better_trajectory_cleaner import NextBetterTrajectoryCleaner
+from ais_trajectory_simplification.simplification.downsampling_simplificator import DownsamplingSimplificator
+from ais_trajectory_simplification.simplification.dp_simplificator import DPSimplificator
+from ais_trajectory_simplification.simplification.tdtr_simplificator import TDTRSimplificator
+from ais_trajectory_simplification.simplification.oepp_simplificator import OEPPSimplificator
+from benchmarks.synthetic_fleet import generate_fleet
+
+# name -> function processing one vessel, with the parameters used in the notebooks
+ALGORITHMS = {
+    'clean': lambda pdf: NextBetterTrajectoryCleaner(pdf).clean_trajectory(),
+    'downsampling': lambda pdf: DownsamplingSimplificator(pdf).simplify_trajectory(60),
+    'dp': lambda pdf: DPSimplificator(pdf).simplify_trajectory(100),
+    'tdtr': lambda pdf: TDTRSimplificator(pdf).simplify_trajectory(100),
+    'oepp': lambda pdf: OEPPSimplificator(pdf).simplify_trajectory(500, 20, 5),
+}
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _process_fleet(algorithm_f, fleet_pdf: pd.DataFrame) -> int:
+    output_points_count = 0
+    for mmsi, vessel_pdf in fleet_pdf.groupby('mmsi'):
+        output_points_count = output_points_count + len(algorithm_f(vessel_pdf))
+
+    return output_points_count
+
+
+def run_benchmark(algorithm: str, fleet_pdf: pd.DataFrame, repeat: int = 1, measure_memory: bool = True) -> dict:
+    # the best of repeated runs, peak memory is measured in a separate run because tracemalloc slows it down
+    algorithm_f = ALGORITHMS[algorithm]
+    runtimes_s = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        output_points_count = _process_fleet(algorithm_f, fleet_pdf)
+        runtimes_s.append(time.perf_counter() - start_time)
+
+    peak_memory_mb = None
+    if measure_memory:
+        tracemalloc.start()
+        _process_fleet(algorithm_f, fleet_pdf)
+        current_memory_b, peak_memory_b = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peak_memory_mb = peak_memory_b / 2**20
+
+    runtime_s = min(runtimes_s)
+    return {
+        'algorithm': algorithm,
+        'points_count': len(fleet_pdf),
+        'vessels_count': int(fleet_pdf['mmsi'].nunique()),
+        'output_points_count': output_points_count,
+        'runtime_s': runtime_s,
+        'points_per_s': len(fleet_pdf) / runtime_s,
+        'peak_memory_mb': peak_memory_mb,
+    }
+
+
+def run_benchmarks(sizes: list, algorithms: list, points_per_vessel: int = 5000, seed: int = 0, repeat: int = 1, measure_memory: bool = True) -> dict:
+    results = []
+    for points_count in sizes:
+        fleet_pdf = generate_fleet(points_count, points_per_vessel, seed)
+        for algorithm in algorithms:
+            result = run_benchmark(algorithm, fleet_pdf, repeat, measure_memory)
+            print(f"{algorithm:>12} {points_count:>10} points {result['points_per_s']:>12.0f} points/s "
+                  f"{result['peak_memory_mb'] or 0:>10.1f} MB", flush=True)
+            results.append(result)
+
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'created': pd.Timestamp.now(tz='UTC').isoformat(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform.platform(),
+            'points_per_vessel': points_per_vessel,
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure throughput and peak memory of cleaners and simplificators on a synthetic fleet.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--algorithms', nargs='+', default=list(ALGORITHMS), choices=list(ALGORITHMS))
+    parser.add_argument('--points-per-vessel', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc run')
+    parser.add_argument('--output', default='benchmark.json')
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.sizes, args.algorithms, args.points_per_vessel, args.seed, args.repeat, not args.no_memory)
+    with open(args.output, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+
+SCENARIOS = ['transit', 'port_stop', 'loitering', 'spikes', 'dateline', 'high_latitude']
+METERS_PER_DEGREE = 111320
+KNOT_M_S = 1852 / 3600
+
+
+def _start_position(scenario: str, rng: np.random.Generator) -> tuple:
+    if scenario == 'dateline':
+        return 179.5 + rng.uniform(-0.2, 0.2), rng.uniform(-40, 40)
+    if scenario == 'high_latitude':
+        return rng.uniform(-20, 40), rng.uniform(76, 80)
+    return rng.uniform(-10, 30), rng.uniform(35, 65)
+
+
+def _headings_and_speeds(scenario: str, points_count: int, rng: np.random.Generator) -> tuple:
+    if scenario == 'loitering':
+        # trawling and circling, heading changes by tens of degrees between positions
+        headings_deg = rng.uniform(0, 360) + np.cumsum(rng.normal(8, 15, points_count))
+        speeds_kn = np.abs(rng.normal(3, 1, points_count))
+    elif scenario == 'dateline':
+        headings_deg = rng.uniform(60, 120) + rng.normal(0, 2, points_count)
+        speeds_kn = np.abs(rng.normal(15, 1, points_count))
+    else:
+        # straight legs with a course change every few hundred positions
+        legs_count = points_count // 300 + 1
+        leg_headings_deg = rng.uniform(0, 360, legs_count)
+        headings_deg = np.repeat(leg_headings_deg, 300)[:points_count] + rng.normal(0, 2, points_count)
+        speeds_kn = np.abs(rng.normal(rng.uniform(10, 18), 1, points_count))
+
+    if scenario == 'port_stop':
+        # the middle third of the trajectory is spent in port
+        stop = slice(points_count // 3, 2 * points_count // 3)
+        speeds_kn[stop] = np.abs(rng.normal(0, 0.05, stop.stop - stop.start))
+        headings_deg[stop] = rng.uniform(0, 360, stop.stop - stop.start)
+
+    return headings_deg, speeds_kn
+
+
+def generate_vessel(points_count: int, scenario: str, mmsi: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    # AIS reports every 2 - 30 s, with a few reception gaps of up to 6 hours
+    intervals_s = rng.integers(2, 30, points_count).astype(np.float64)
+    gaps = rng.random(points_count) < 0.001
+    intervals_s[gaps] = rng.uniform(600, 6 * 3600, gaps.sum())
+    intervals_s[0] = 0
+    timestamps = pd.Timestamp('2023-01-01') + pd.to_timedelta(np.cumsum(intervals_s), unit='s')
+
+    start_longitude, start_latitude = _start_position(scenario, rng)
+    headings_deg, speeds_kn = _headings_and_speeds(scenario, points_count, rng)
+    distances_m = speeds_kn * KNOT_M_S * intervals_s
+    latitudes = start_latitude + np.cumsum(distances_m * np.cos(np.radians(headings_deg))) / METERS_PER_DEGREE
+    latitudes = np.clip(latitudes, -89.9, 89.9)
+    longitudes = start_longitude + np.cumsum(
+        distances_m * np.sin(np.radians(headings_deg)) / (METERS_PER_DEGREE * np.cos(np.radians(latitudes))))
+    # jitter of GPS positions, about 5 m
+    latitudes = latitudes + rng.normal(0, 5 / METERS_PER_DEGREE, points_count)
+    longitudes = longitudes + rng.normal(0, 5 / METERS_PER_DEGREE, points_count)
+
+    if scenario == 'spikes':
+        spikes = rng.choice(points_count, max(points_count // 50, 1), replace=False)
+        latitudes[spikes] = latitudes[spikes] + rng.choice([-1, 1], len(spikes)) * rng.uniform(0.05, 0.5, len(spikes))
+        longitudes[spikes] = longitudes[spikes] + rng.choice([-1, 1], len(spikes)) * rng.uniform(0.05, 0.5, len(spikes))
+    longitudes = (longitudes + 180) % 360 - 180
+
+    return pd.DataFrame({
+        'position_timestamp': timestamps,
+        'mmsi': mmsi,
+        'latitude': latitudes,
+        'longitude': longitudes,
+    })
+
+
+def generate_fleet(points_count: int, points_per_vessel: int = 5000, seed: int = 0) -> pd.DataFrame:
+    # vessels go through SCENARIOS in turn, the same seed gives the same fleet
+    vessel_pdfs = []
+    vessels_count = max(points_count // points_per_vessel, 1)
+    for vessel_number in range(vessels_count):
+        vessel_points_count = points_count // vessels_count + (1 if vessel_number < points_count % vessels_count else 0)
+        vessel_pdfs.append(generate_vessel(
+            vessel_points_count, SCENARIOS[vessel_number % len(SCENARIOS)], 200000000 + vessel_number, seed * 1000003 + vessel_number))
+
+    fleet_pdf = pd.concat(vessel_pdfs, ignore_index=True)
+    fleet_pdf.index.name = 'index'
+    return fleet_pdf
@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+from ais_trajectory_simplification.storage.parquet_trajectory_store import ParquetTrajectoryStore
+
+
+def test_chunks_with_different_null_patterns_are_merged(tmp_path):
+    # destination and draught are empty in the first chunk only, callsign in the second one only
+    csv_path = tmp_path / 'positions.csv'
+    pd.DataFrame({
+        'position_timestamp': pd.date_range('2023-01-01', periods=8, freq='1h').astype(str),
+        'mmsi': [219000001, 219000002] * 4,
+        'latitude': np.arange(8) + 55.5,
+        'longitude': 11.25,
+        'callsign': ['OXAB1', 'OXAB2', 'OXAB1', 'OXAB2', None, None, None, None],
+        'destination': [None, None, None, None, 'AARHUS', 'KIEL', 'AARHUS', 'KIEL'],
+        'draught': [None, None, None, None, '5.5', '6', '5.5', '6'],
+    }).to_csv(csv_path, index=False)
+
+    store = ParquetTrajectoryStore(str(tmp_path / 'store'))
+    assert store.ingest_csv(str(csv_path), chunksize=4, schema={'draught': 'float64'}) == 8
+    vessel_pdf = store.read_vessel(219000001)
+    assert vessel_pdf['destination'].tolist() == [None, None, 'AARHUS', 'AARHUS']
+    assert vessel_pdf['callsign'].tolist() == ['OXAB1', 'OXAB1', None, None]
+    assert vessel_pdf['draught'].dtype == np.float64
+
+    store.compact()
+    compacted_pdf = ParquetTrajectoryStore(str(tmp_path / 'store')).read_vessel(219000001)
+    pd.testing.assert_frame_equal(compacted_pdf, vessel_pdf)
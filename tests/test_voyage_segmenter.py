@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+from ais_trajectory_simplification.segmentation.voyage_segmenter import VoyageSegmenter
+from ais_trajectory_simplification.simplification.dp_simplificator import DPSimplificator
+from ais_trajectory_simplification.stats.processing_stats import ProcessingStats
+
+
+def _drift_pdf(points_count: int, speed_kn: float, interval_s: int) -> pd.DataFrame:
+    # slow but not stopped: every window of 500 m lasts less than an hour
+    step_deg = speed_kn * 1852 / 3600 * interval_s / 111320
+    return pd.DataFrame({
+        'position_timestamp': pd.Timestamp('2023-01-01') + pd.to_timedelta(np.arange(points_count) * interval_s, unit='s'),
+        'mmsi': 219000001,
+        'latitude': 57 + np.arange(points_count) * step_deg,
+        'longitude': 11.0,
+    })
+
+
+def test_long_slow_drift_is_searched_in_linear_time():
+    points_count = 20000
+    stats = ProcessingStats()
+    segmenter = VoyageSegmenter(_drift_pdf(points_count, 0.3, 10), stats=stats)
+    segment_numbers, is_stop = segmenter.segment()
+    assert not is_stop.any()
+    assert stats.counters['geodesic_calls_count'] <= 2 * points_count
+
+    result_pdf = segmenter.simplify_trajectory(DPSimplificator, epsilon_m=50)
+    assert result_pdf.index[0] == 0 and result_pdf.index[-1] == points_count - 1
+
+
+def test_stop_in_drift_is_found():
+    pdf = _drift_pdf(3000, 0.3, 10)
+    pdf.loc[1000:1999, ['latitude', 'longitude']] = pdf.loc[1000, ['latitude', 'longitude']].to_numpy()
+    segment_numbers, is_stop = VoyageSegmenter(pdf).segment()
+    # the stop starts at the earliest drifting position within stop_max_distance_m of it
+    assert is_stop[1000:2000].all() and not is_stop[2000:].any() and not is_stop[:600].any()
+    assert segment_numbers[1999] != segment_numbers[2000]